@@ -1,7 +1,141 @@
+import hashlib
 import os
+import threading
+import time
 import anthropic
 from datetime import date
-from app import models
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import answer_cache, models
+from app.database import engine
+from app.circuit_breaker import ANTHROPIC_BREAKER
+from app.metrics import ANTHROPIC_ERRORS, Counter, GaugeCallback, Histogram
+from app.logging_config import get_logger
+
+logger = get_logger("ai_reply")
+
+AI_MODEL            = "claude-haiku-4-5-20251001"  # fast + cheap for WhatsApp replies
+AI_REPLY_DEADLINE   = float(os.getenv("AI_REPLY_DEADLINE", 10))    # seconds from queueing to answer
+AI_CONNECT_TIMEOUT  = float(os.getenv("AI_CONNECT_TIMEOUT", 3))
+AI_MAX_CONCURRENCY  = int(os.getenv("AI_MAX_CONCURRENCY", 8))      # Claude calls in flight per process
+AI_MAX_QUEUE        = int(os.getenv("AI_MAX_QUEUE", 32))           # replies allowed to wait for a slot
+
+PROMPT_BUILD_SECONDS = Histogram(
+    "botmart_ai_prompt_build_seconds",
+    "Time to build a tenant's AI system prompt (once per tenant snapshot)",
+)
+PROMPT_CHARS = Histogram(
+    "botmart_ai_prompt_chars",
+    "Size of built AI system prompts in characters",
+    buckets=(1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000),
+)
+PROMPT_TOKENS = Counter(
+    "botmart_ai_prompt_input_tokens_total",
+    "Anthropic input tokens by prompt cache use: cache_read, cache_write, uncached",
+    ["kind"],
+)
+AI_REJECTED = Counter(
+    "botmart_ai_rejected_total",
+    "AI replies answered with the fallback instead: queue_full, queue_timeout, deadline",
+    ["reason"],
+)
+
+
+class AITransientError(Exception):
+    """Anthropic was overloaded or unreachable — the reply may succeed if retried later."""
+
+
+# ─────────────────────────────────────────────
+# SHARED ANTHROPIC CLIENT
+# ─────────────────────────────────────────────
+
+_client      = None
+_client_lock = threading.Lock()
+
+
+def get_anthropic_client(api_key):
+    """
+    One client per process, so replies reuse its keep-alive connections
+    (at most AI_MAX_CONCURRENCY are busy at once — see AISlots). SDK
+    retries are off — a retry would blow the reply deadline; failures go
+    to the circuit breaker and the fallback instead.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = anthropic.Anthropic(
+                    api_key=api_key,
+                    max_retries=0,
+                    timeout=anthropic.Timeout(AI_REPLY_DEADLINE, connect=AI_CONNECT_TIMEOUT),
+                )
+    return _client
+
+
+def close_ai_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+class AISlots:
+    """
+    At most `limit` Claude calls at once. Up to `max_waiting` more replies
+    may wait for a slot; beyond that a reply is turned away at once.
+    """
+
+    def __init__(self, limit=AI_MAX_CONCURRENCY, max_waiting=AI_MAX_QUEUE):
+        self.max_waiting = max_waiting
+        self._slots      = threading.BoundedSemaphore(limit)
+        self._lock       = threading.Lock()
+        self.waiting     = 0
+        self.in_flight   = 0
+
+    def acquire(self, timeout):
+        """True when a slot was taken, else the reason it wasn't."""
+        if self._slots.acquire(blocking=False):
+            with self._lock:
+                self.in_flight += 1
+            return True
+
+        with self._lock:
+            if self.waiting >= self.max_waiting:
+                return "queue_full"
+            self.waiting += 1
+        try:
+            got = self._slots.acquire(timeout=max(timeout, 0))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+                self.in_flight += got
+        return True if got else "queue_timeout"
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+
+ai_slots = AISlots()
+
+
+def get_ai_slot_stats():
+    return {
+        "in_flight":     ai_slots.in_flight,
+        "waiting":       ai_slots.waiting,
+        "max_in_flight": AI_MAX_CONCURRENCY,
+        "max_waiting":   AI_MAX_QUEUE,
+        "deadline":      AI_REPLY_DEADLINE,
+    }
+
+AI_SLOTS_GAUGE = GaugeCallback(
+    "botmart_ai_slots",
+    "Claude calls in flight and replies waiting for a slot",
+    lambda: {("in_flight",): ai_slots.in_flight, ("waiting",): ai_slots.waiting},
+    ["state"],
+)
 
 # ── Plan limits ──
 AI_LIMITS = {
@@ -11,10 +145,22 @@ AI_LIMITS = {
 }
 
 
-def check_and_increment_ai_usage(client, db) -> tuple[bool, str]:
+def _usage_insert():
+    """INSERT … ON CONFLICT builder for the ledger's database."""
+    if engine.dialect.name == "sqlite":
+        return sqlite_insert(models.AIUsageDaily)
+    return pg_insert(models.AIUsageDaily)
+
+
+def check_and_increment_ai_usage(client) -> tuple[bool, str]:
     """
     Returns (allowed: bool, reason: str)
-    Resets daily counter if it's a new day.
+    Counts the reply in today's ai_usage_daily row with one upsert that only
+    bumps the counter while it is under the plan's limit, so concurrent
+    workers can't overshoot it. Runs in its own short transaction, right
+    before the Claude call: the clients row is never written and no lock
+    is held during the call. The AI stage runs after the message has
+    committed, so a counted reply is never re-run by a rollback.
     """
     plan  = client.plan
     limit = AI_LIMITS.get(plan, 0)
@@ -23,66 +169,53 @@ def check_and_increment_ai_usage(client, db) -> tuple[bool, str]:
     if limit == 0:
         return False, "AI replies not available on Starter plan"
 
-    today = date.today()
-
-    # Reset counter if it's a new day
-    if client.ai_replies_reset_date != today:
-        client.ai_replies_used       = 0
-        client.ai_replies_reset_date = today
-        db.commit()
+    # Pro — unlimited; Growth — only while under the limit
+    usage = models.AIUsageDaily.__table__
+    stmt  = _usage_insert().values(client_id=client.id, day=date.today(), replies=1)
+    stmt  = stmt.on_conflict_do_update(
+        index_elements=[usage.c.client_id, usage.c.day],
+        set_={"replies": usage.c.replies + 1},
+        where=usage.c.replies < limit if limit is not None else None,
+    ).returning(usage.c.replies)
 
-    # Pro — unlimited
-    if limit is None:
-        client.ai_replies_used += 1
-        db.commit()
-        return True, "ok"
+    with engine.begin() as conn:
+        used = conn.execute(stmt).scalar()
 
-    # Growth — check limit
-    if client.ai_replies_used >= limit:
+    if used is None:
         return False, f"Daily AI limit reached ({limit}/day on {plan.title()} plan)"
-
-    client.ai_replies_used += 1
-    db.commit()
     return True, "ok"
 
 
-def build_system_prompt(client, db) -> str:
-    """Build the AI system prompt using business description, products, and rules."""
-
-    business_name        = client.business_name
-    business_description = client.business_description or ""
+def build_system_prompt(config) -> str:
+    """Build the AI system prompt from a tenant snapshot's description, products and rules."""
 
-    # ── Fetch products ──
-    products = db.query(models.Product).filter(
-        models.Product.client_id == client.id,
-        models.Product.is_active == True
-    ).all()
+    business_name        = config.client.business_name
+    business_description = config.client.business_description or ""
 
-    # ── Fetch rules ──
-    rules = db.query(models.AutoReplyRule).filter(
-        models.AutoReplyRule.client_id == client.id,
-        models.AutoReplyRule.is_active == True
-    ).all()
+    # ── Active products and rules, as loaded into the snapshot ──
+    products = config.products
+    rules    = config.rules
 
     # ── Build product context ──
-    product_context = ""
+    product_lines = []
     if products:
-        product_context = "\n\n## Products / Services\n"
+        product_lines.append("\n\n## Products / Services\n")
         for p in products:
-            product_context += f"- **{p.name}** (keyword: {p.keyword})"
+            line = f"- **{p.name}** (keyword: {p.keyword})"
             if p.category:
-                product_context += f" | Category: {p.category}"
-            product_context += f" | Price: {p.price}"
+                line += f" | Category: {p.category}"
+            line += f" | Price: {p.price}"
             if p.description:
-                product_context += f"\n  Description: {p.description}"
-            product_context += "\n"
+                line += f"\n  Description: {p.description}"
+            product_lines.append(line + "\n")
+    product_context = "".join(product_lines)
 
     # ── Build rules context ──
     rules_context = ""
     if rules:
-        rules_context = "\n\n## Auto-Reply Rules (use these responses when relevant)\n"
-        for r in rules:
-            rules_context += f"- Keyword: *{r.trigger_keyword}* → {r.response_text}\n"
+        rules_context = "\n\n## Auto-Reply Rules (use these responses when relevant)\n" + "".join(
+            f"- Keyword: *{r.trigger_keyword}* → {r.response_text}\n" for r in rules
+        )
 
     # ── Build full system prompt ──
     system_prompt = f"""You are a helpful WhatsApp customer service assistant for **{business_name}**.
@@ -109,49 +242,167 @@ Your job is to answer customer questions politely and helpfully on behalf of the
     return system_prompt
 
 
-def get_ai_reply(client, text: str, db) -> str | None:
+class SystemPrompt:
+    """A tenant's built prompt. `version` is a content hash — equal prompts share it on every worker."""
+    __slots__ = ("text", "version", "blocks")
+
+    def __init__(self, text):
+        self.text    = text
+        self.version = hashlib.sha256(text.encode()).hexdigest()[:12]
+        # One static block marked for Anthropic prompt caching — repeat
+        # replies for the tenant read it from the cache instead of
+        # reprocessing (and paying full price for) the whole catalog
+        self.blocks  = [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+
+_prompt_lock = threading.Lock()
+
+
+def get_system_prompt(config) -> SystemPrompt:
+    """
+    The tenant's prompt, built once per snapshot. Catalog, rule and
+    description changes invalidate the snapshot (app/tenant_cache.py),
+    so the next reply builds the new version.
+    """
+    prompt = getattr(config, "_system_prompt", None)
+    if prompt is not None:
+        return prompt
+
+    with _prompt_lock:
+        prompt = getattr(config, "_system_prompt", None)
+        if prompt is None:
+            started = time.perf_counter()
+            prompt  = SystemPrompt(build_system_prompt(config))
+            PROMPT_BUILD_SECONDS.observe(time.perf_counter() - started)
+            PROMPT_CHARS.observe(len(prompt.text))
+            config._system_prompt = prompt
+            logger.info("Built AI system prompt", extra={
+                "client_id": config.client.id, "prompt_version": prompt.version, "chars": len(prompt.text),
+            })
+    return prompt
+
+
+def record_prompt_usage(usage):
+    """Count input tokens by how the prompt cache served them."""
+    if usage is None:
+        return
+    PROMPT_TOKENS.inc(getattr(usage, "cache_read_input_tokens", 0) or 0, kind="cache_read")
+    PROMPT_TOKENS.inc(getattr(usage, "cache_creation_input_tokens", 0) or 0, kind="cache_write")
+    PROMPT_TOKENS.inc(getattr(usage, "input_tokens", 0) or 0, kind="uncached")
+
+
+def cached_ai_reply(config, text: str) -> str | None:
     """
-    Main function called by webhook.
-    Returns reply string or None if not allowed / error.
+    The tenant's cached answer to this question, or None. Hits don't call
+    Claude and don't count against the plan's AI replies.
     """
+    if AI_LIMITS.get(config.client.plan, 0) == 0:
+        return None
+    return answer_cache.lookup(config.client.id, config.version, get_system_prompt(config).version, text)
+
+
+def get_ai_reply(config, text: str, deadline=None, counted=False) -> str | None:
+    """
+    Main function called by the AI stage (app/ai_worker.py), for the
+    tenant snapshot's client.
+    Returns reply string or None if not allowed / error / Anthropic is
+    failing (the circuit breaker is open) / Claude is too busy to answer
+    by `deadline` (time.monotonic(), default AI_REPLY_DEADLINE from now),
+    so the caller sends its fallback. Raises AITransientError when
+    Anthropic was overloaded or unreachable — the reply has been counted
+    by then, so a retry passes counted=True and isn't counted again.
+    """
+
+    client = config.client
 
-    # ── Check plan & usage ──
-    allowed, reason = check_and_increment_ai_usage(client, db)
-    if not allowed:
-        print(f"[ai_reply] Blocked: {reason}")
+    # ── Fail fast while Anthropic is down ──
+    if ANTHROPIC_BREAKER.is_open():
         return None
 
     # ── Get Anthropic API key ──
     api_key = os.getenv("CLAUDE_API_KEY")
     if not api_key:
-        print("[ai_reply] ERROR: CLAUDE_API_KEY not set in .env")
+        logger.error("CLAUDE_API_KEY not set in .env")
         return None
 
-    # ── Build system prompt ──
-    system_prompt = build_system_prompt(client, db)
+    # ── Wait for a Claude slot, within the reply deadline ──
+    if deadline is None:
+        deadline = time.monotonic() + AI_REPLY_DEADLINE
+    slot = ai_slots.acquire(timeout=deadline - time.monotonic())
+    if slot is not True:
+        AI_REJECTED.inc(reason=slot)
+        logger.warning("AI reply skipped, Claude busy", extra={"client_id": client.id, "reason": slot})
+        return None
 
-    # ── Call Claude ──
     try:
-        anthropic_client = anthropic.Anthropic(api_key=api_key)
+        return _generate_reply(client, text, config, api_key, deadline, counted)
+    finally:
+        ai_slots.release()
+
 
-        message = anthropic_client.messages.create(
-            model="claude-haiku-4-5-20251001",  # fast + cheap for WhatsApp replies
+def _generate_reply(client, text, config, api_key, deadline, counted):
+    # ── System prompt — cached per tenant snapshot ──
+    system_prompt = get_system_prompt(config)
+
+    # ── Call Claude with what is left of the deadline ──
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        AI_REJECTED.inc(reason="deadline")
+        return None
+    if not ANTHROPIC_BREAKER.allow():
+        return None
+
+    # ── Check plan & usage — only replies that reach Claude are counted ──
+    if not counted:
+        allowed, reason = check_and_increment_ai_usage(client)
+        if not allowed:
+            ANTHROPIC_BREAKER.cancel()
+            logger.info("AI reply blocked", extra={"client_id": client.id, "reason": reason})
+            return None
+
+    try:
+        message = get_anthropic_client(api_key).messages.create(
+            model=AI_MODEL,
             max_tokens=300,
-            system=system_prompt,
+            system=system_prompt.blocks,
             messages=[
                 {"role": "user", "content": text}
-            ]
+            ],
+            timeout=anthropic.Timeout(remaining, connect=min(AI_CONNECT_TIMEOUT, remaining)),
         )
 
+        ANTHROPIC_BREAKER.record_success()
+        record_prompt_usage(message.usage)
         reply = message.content[0].text.strip()
-        print(f"[ai_reply] ✅ Reply generated for {client.business_name} ({client.plan})")
+        answer_cache.store(client.id, config.version, system_prompt.version, text, reply)
+        logger.info("AI reply generated", extra={"client_id": client.id, "plan": client.plan, "sample": True})
         return reply
 
     except anthropic.APIStatusError as e:
-        if e.status_code == 529:
-            raise  # Let webhook retry logic handle 529
-        print(f"[ai_reply] API error {e.status_code}: {e.message}")
+        ANTHROPIC_ERRORS.inc(code=str(e.status_code))
+        # Overload (529), 5xx and rate limits count against the breaker;
+        # other 4xx mean the API is up and the request was wrong
+        if e.status_code >= 500 or e.status_code == 429:
+            ANTHROPIC_BREAKER.record_failure()
+            logger.warning("Anthropic overloaded", extra={"client_id": client.id, "status": e.status_code})
+            raise AITransientError(f"Anthropic returned {e.status_code}") from e
+        ANTHROPIC_BREAKER.record_success()
+        logger.error("Anthropic API error", extra={"client_id": client.id, "status": e.status_code, "error": e.message})
+        return None
+    except anthropic.APITimeoutError:
+        ANTHROPIC_ERRORS.inc(code="timeout")
+        AI_REJECTED.inc(reason="deadline")
+        ANTHROPIC_BREAKER.record_failure()
+        logger.warning("AI reply missed its deadline", extra={"client_id": client.id, "deadline": AI_REPLY_DEADLINE})
         return None
-    except Exception as e:
-        print(f"[ai_reply] Unexpected error: {e}")
+    except anthropic.APIConnectionError as e:
+        ANTHROPIC_ERRORS.inc(code="connection")
+        ANTHROPIC_BREAKER.record_failure()
+        logger.error("Anthropic unreachable", extra={"client_id": client.id, "error": str(e)})
+        raise AITransientError("Anthropic unreachable") from e
+    except Exception:
+        ANTHROPIC_ERRORS.inc(code="exception")
+        # Settles a half-open probe too, instead of leaving it to time out
+        ANTHROPIC_BREAKER.record_failure()
+        logger.exception("Unexpected AI reply error", extra={"client_id": client.id})
         return None
\ No newline at end of file
@@ -0,0 +1,266 @@
+"""
+AI reply stage.
+
+An AI reply takes seconds to generate, and an overloaded Anthropic used to
+be retried with time.sleep(2) on the lane thread — every customer in that
+lane waited behind it. The webhook now finishes a message without its AI
+reply (contact, rules, inbound log — all committed) and hands the question
+to this stage:
+
+  • AI_WORKERS threads generate replies and send them as soon as they are
+    ready; the fallback goes out instead when no reply can be had within
+    AI_REPLY_DEADLINE of the message arriving
+  • overload and connection errors are retried with jittered exponential
+    backoff — the job is parked on a timer, no thread sleeps through it
+  • waiting jobs are served Pro first, then Growth, oldest first within a
+    plan; when AI_MAX_QUEUE jobs are waiting, a new job pushes out the
+    newest job of a lower plan, which gets the fallback
+  • AI_WORKERS=0 generates replies inline on the lane thread, as before
+
+Jobs are held in memory. A process that dies with jobs waiting loses those
+replies — their inbound messages are already logged.
+"""
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from app.ai_reply import (
+    AI_LIMITS, AI_MAX_CONCURRENCY, AI_MAX_QUEUE, AI_REJECTED, AI_REPLY_DEADLINE,
+    AITransientError, get_ai_reply,
+)
+from app.circuit_breaker import ANTHROPIC_BREAKER
+from app.logging_config import get_logger
+from app.metrics import STAGE_SECONDS, Counter, GaugeCallback
+
+AI_WORKERS         = int(os.getenv("AI_WORKERS", AI_MAX_CONCURRENCY))  # 0 = generate inline
+AI_RETRY_ATTEMPTS  = int(os.getenv("AI_RETRY_ATTEMPTS", 3))
+AI_RETRY_BACKOFF   = float(os.getenv("AI_RETRY_BACKOFF", 0.5))         # first retry delay, doubles per attempt
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", 4))
+
+PLAN_PRIORITY = {"pro": 0, "growth": 1}   # lower is served first; other plans last
+
+logger = get_logger("ai_worker")
+
+AI_RETRIES = Counter(
+    "botmart_ai_retries_total",
+    "AI replies retried after Anthropic was overloaded or unreachable",
+)
+
+
+class AIJob:
+    __slots__ = ("config", "sender", "text", "deliver", "deadline", "priority", "seq", "attempt", "queued_at", "counted")
+
+    def __init__(self, config, sender, text, deliver, seq):
+        self.config    = config
+        self.sender    = sender
+        self.text      = text
+        self.deliver   = deliver
+        self.deadline  = time.monotonic() + AI_REPLY_DEADLINE
+        self.priority  = PLAN_PRIORITY.get(config.client.plan, len(PLAN_PRIORITY))
+        self.seq       = seq
+        self.attempt   = 0
+        self.queued_at = time.monotonic()
+        self.counted   = False   # the reply is in today's AI usage — retries don't count it again
+
+    @property
+    def rank(self):
+        return (self.priority, self.seq)
+
+
+class AIQueue:
+    """Jobs waiting for an AI worker, best plan first."""
+
+    def __init__(self, max_waiting=AI_MAX_QUEUE):
+        self.max_waiting = max_waiting
+        self._heap       = []
+        self._cond       = threading.Condition()
+
+    def put(self, job):
+        """Queue a job. Returns the job pushed out to make room — maybe `job` itself — or None."""
+        with self._cond:
+            evicted = None
+            if len(self._heap) >= self.max_waiting:
+                worst = max(self._heap)
+                if worst[0] <= job.rank:
+                    return job
+                self._heap.remove(worst)
+                heapq.heapify(self._heap)
+                evicted = worst[1]
+            heapq.heappush(self._heap, (job.rank, job))
+            self._cond.notify()
+            return evicted
+
+    def get(self):
+        with self._cond:
+            while not self._heap:
+                self._cond.wait()
+            return heapq.heappop(self._heap)[1]
+
+    def depths(self):
+        with self._cond:
+            depths = {}
+            for _, job in self._heap:
+                plan = job.config.client.plan
+                depths[plan] = depths.get(plan, 0) + 1
+            return depths
+
+
+_queue    = AIQueue()
+_seq      = itertools.count()
+_lock     = threading.Lock()
+_workers  = []
+
+_timer_cond   = threading.Condition()
+_timer_heap   = []      # (due, seq, job) — retries waiting out their backoff
+_timer_thread = None
+
+
+# ─────────────────────────────────────────────
+# SUBMIT
+# ─────────────────────────────────────────────
+
+def accepts(config):
+    """
+    False when the tenant's AI replies should be generated inline — the
+    stage is off, the plan has no AI, or Anthropic's circuit is open.
+    """
+    return AI_WORKERS > 0 and AI_LIMITS.get(config.client.plan, 0) != 0 and not ANTHROPIC_BREAKER.is_open()
+
+
+def submit(config, sender, text, deliver):
+    """
+    Hand a message to the AI stage. deliver(config, sender, reply) is called
+    from the stage with the reply, or with None when the fallback should be
+    sent. Submit only once the message's transaction has committed — a job
+    can't be taken back if it rolls back.
+    Returns False, without queueing, when accepts(config) is False.
+    """
+    if not accepts(config):
+        return False
+
+    _start()
+    evicted = _queue.put(AIJob(config, sender, text, deliver, next(_seq)))
+    if evicted is not None:
+        AI_REJECTED.inc(reason="queue_full")
+        logger.warning("AI queue full, sending fallback", extra={
+            "client_id": evicted.config.client.id, "plan": evicted.config.client.plan,
+        })
+        _deliver(evicted, None)
+    return True
+
+
+# ─────────────────────────────────────────────
+# WORKERS
+# ─────────────────────────────────────────────
+
+def _generate(job):
+    try:
+        return get_ai_reply(job.config, job.text, deadline=job.deadline, counted=job.counted)
+    except AITransientError:
+        job.counted = True   # raised by the Claude call itself, after the usage was counted
+        raise
+    except Exception:
+        logger.exception("AI reply error", extra={"client_id": job.config.client.id})
+        return None
+
+
+def _deliver(job, reply):
+    try:
+        job.deliver(job.config, job.sender, reply)
+    except Exception:
+        logger.exception("Could not deliver AI reply", extra={"client_id": job.config.client.id})
+
+
+def _process(job):
+    STAGE_SECONDS.observe(time.monotonic() - job.queued_at, stage="ai_queue")
+    if time.monotonic() >= job.deadline:
+        AI_REJECTED.inc(reason="deadline")
+        _deliver(job, None)
+        return
+
+    try:
+        with STAGE_SECONDS.time(stage="ai_call"):
+            reply = _generate(job)
+    except AITransientError:
+        if _schedule_retry(job):
+            return
+        reply = None
+    _deliver(job, reply)
+
+
+def _run():
+    while True:
+        job = _queue.get()
+        try:
+            _process(job)
+        except Exception:
+            logger.exception("Unexpected error in AI worker")
+
+
+def _start():
+    if len(_workers) >= AI_WORKERS:
+        return
+    with _lock:
+        while len(_workers) < AI_WORKERS:
+            thread = threading.Thread(target=_run, name=f"ai-worker-{len(_workers)}", daemon=True)
+            thread.start()
+            _workers.append(thread)
+
+
+# ─────────────────────────────────────────────
+# RETRY TIMER
+# ─────────────────────────────────────────────
+
+def _schedule_retry(job):
+    """Park the job for its backoff. False when it is out of attempts or time."""
+    delay = min(AI_RETRY_MAX_DELAY, AI_RETRY_BACKOFF * (2 ** job.attempt))
+    delay = delay * random.uniform(0.5, 1.5)
+    due   = time.monotonic() + delay
+    if job.attempt >= AI_RETRY_ATTEMPTS or due >= job.deadline:
+        return False
+
+    job.attempt += 1
+    AI_RETRIES.inc()
+    logger.info("AI reply retry scheduled", extra={
+        "client_id": job.config.client.id, "attempt": job.attempt, "delay": round(delay, 3),
+    })
+
+    global _timer_thread
+    with _timer_cond:
+        heapq.heappush(_timer_heap, (due, job.seq, job))
+        _timer_cond.notify()
+        if _timer_thread is None:
+            _timer_thread = threading.Thread(target=_run_timer, name="ai-retry-timer", daemon=True)
+            _timer_thread.start()
+    return True
+
+
+def _run_timer():
+    while True:
+        with _timer_cond:
+            while not _timer_heap or _timer_heap[0][0] > time.monotonic():
+                _timer_cond.wait(_timer_heap[0][0] - time.monotonic() if _timer_heap else None)
+            job = heapq.heappop(_timer_heap)[2]
+
+        job.queued_at = time.monotonic()
+        evicted = _queue.put(job)
+        if evicted is not None:
+            AI_REJECTED.inc(reason="queue_full")
+            _deliver(evicted, None)
+
+
+def get_ai_worker_stats():
+    with _timer_cond:
+        retrying = len(_timer_heap)
+    return {"workers": AI_WORKERS, "waiting": _queue.depths(), "retrying": retrying}
+
+
+AI_QUEUE_DEPTH = GaugeCallback(
+    "botmart_ai_queue_depth",
+    "AI replies waiting for an AI worker, by plan",
+    lambda: {(plan,): depth for plan, depth in _queue.depths().items()},
+    ["plan"],
+)
@@ -0,0 +1,165 @@
+"""
+Per-tenant cache of AI answers.
+
+Customers of one business keep asking the same things ("how much is
+delivery", "where are you located"), and every one of them used to be a
+paid Claude call counted against ai_replies_used. An AI reply depends only
+on the tenant's system prompt and the question, so answers are cached per
+tenant:
+
+  • keyed by the normalized question — lowercased, punctuation and
+    whitespace folded, plural/-ing/-ed endings stripped — so "Delivery
+    prices?" and "delivery price" share an answer
+  • entries expire after AI_ANSWER_CACHE_TTL; each tenant keeps its
+    AI_ANSWER_CACHE_SIZE most recently used answers
+  • every entry belongs to a system prompt version (a hash of the business
+    description, products and rules). When the dashboard changes any of
+    them the tenant snapshot reloads with a new prompt and the tenant's
+    old answers are dropped. Prompt hashes have no order, so the snapshot
+    version decides which prompt is newer: a reply still running on an
+    older snapshot neither clears nor adds to the new prompt's answers
+  • a hit is sent without calling Claude and isn't counted as AI usage
+
+Per process, like the tenant snapshots it hangs off.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from app.metrics import Counter
+
+AI_ANSWER_CACHE_TTL       = int(os.getenv("AI_ANSWER_CACHE_TTL", 6 * 3600))   # seconds
+AI_ANSWER_CACHE_SIZE      = int(os.getenv("AI_ANSWER_CACHE_SIZE", 500))       # answers per tenant, 0 = off
+AI_ANSWER_CACHE_MAX_CHARS = int(os.getenv("AI_ANSWER_CACHE_MAX_CHARS", 200))  # longer messages are not cached
+
+ANSWER_CACHE_LOOKUPS = Counter(
+    "botmart_ai_answer_cache_total",
+    "AI answer cache lookups by tenant and result (hit = Claude call saved)",
+    ["client_id", "result"],
+)
+
+_WORD = re.compile(r"\w+")
+
+_lock    = threading.Lock()
+_tenants = {}      # client_id -> _TenantAnswers
+
+
+class _TenantAnswers:
+    __slots__ = ("snapshot", "prompt", "entries", "hits", "misses")
+
+    def __init__(self, snapshot, prompt):
+        self.snapshot = snapshot        # newest tenant snapshot version seen
+        self.prompt   = prompt          # prompt version the entries belong to
+        self.entries  = OrderedDict()   # question key -> (answer, stored_at)
+        self.hits     = 0
+        self.misses   = 0
+
+
+def _stem(word):
+    """Strip the commonest English endings — enough to match "prices" with "price"."""
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("es") and word[:-2].endswith(("s", "x", "z", "ch", "sh")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    if word.endswith("ing") and len(word) > 5:
+        return word[:-3]
+    if word.endswith("ed") and len(word) > 4:
+        return word[:-2]
+    return word
+
+
+def normalize_question(text):
+    """Cache key for a customer message, or None when it shouldn't be cached."""
+    if not text or len(text) > AI_ANSWER_CACHE_MAX_CHARS:
+        return None
+    words = _WORD.findall(text.lower())
+    return " ".join(_stem(word) for word in words) or None
+
+
+def _tenant(client_id, snapshot, prompt):
+    """
+    The tenant's answers for this prompt, or None when the prompt comes from
+    an older snapshot than the cached answers. A prompt from a newer
+    snapshot drops the old answers. Caller holds _lock.
+    """
+    tenant = _tenants.get(client_id)
+    if tenant is None:
+        tenant = _tenants[client_id] = _TenantAnswers(snapshot, prompt)
+    elif tenant.prompt != prompt:
+        if snapshot < tenant.snapshot:
+            return None
+        tenant.prompt = prompt
+        tenant.entries.clear()
+    tenant.snapshot = max(tenant.snapshot, snapshot)
+    return tenant
+
+
+def lookup(client_id, snapshot_version, prompt_version, text):
+    """Cached answer to this question, or None."""
+    key = normalize_question(text)
+    if key is None or AI_ANSWER_CACHE_SIZE <= 0:
+        return None
+
+    now = time.monotonic()
+    with _lock:
+        tenant = _tenant(client_id, snapshot_version, prompt_version)
+        entry  = tenant.entries.get(key) if tenant else None
+        if entry and now - entry[1] < AI_ANSWER_CACHE_TTL:
+            tenant.entries.move_to_end(key)
+            tenant.hits += 1
+            answer, result = entry[0], "hit"
+        else:
+            if entry:
+                del tenant.entries[key]
+            if tenant:
+                tenant.misses += 1
+            answer, result = None, "miss"
+    ANSWER_CACHE_LOOKUPS.inc(client_id=client_id, result=result)
+    return answer
+
+
+def store(client_id, snapshot_version, prompt_version, text, answer):
+    key = normalize_question(text)
+    if key is None or AI_ANSWER_CACHE_SIZE <= 0 or not answer:
+        return
+
+    with _lock:
+        tenant = _tenant(client_id, snapshot_version, prompt_version)
+        if tenant is None:
+            return  # answered on an older prompt than the cached answers
+        tenant.entries[key] = (answer, time.monotonic())
+        tenant.entries.move_to_end(key)
+        while len(tenant.entries) > AI_ANSWER_CACHE_SIZE:
+            tenant.entries.popitem(last=False)
+
+
+def forget_answers(client_id=None):
+    """Drop one tenant's answers, or everyone's."""
+    with _lock:
+        if client_id is None:
+            _tenants.clear()
+        else:
+            _tenants.pop(client_id, None)
+
+
+def get_answer_cache_stats():
+    """Per-tenant hit rate and Claude calls saved."""
+    with _lock:
+        tenants = {
+            client_id: {
+                "size":        len(tenant.entries),
+                "hits":        tenant.hits,
+                "misses":      tenant.misses,
+                "calls_saved": tenant.hits,
+                "hit_rate":    round(tenant.hits / (tenant.hits + tenant.misses), 4)
+                               if tenant.hits + tenant.misses else 0.0,
+            }
+            for client_id, tenant in _tenants.items()
+        }
+    return {"ttl": AI_ANSWER_CACHE_TTL, "max_per_tenant": AI_ANSWER_CACHE_SIZE, "tenants": tenants}
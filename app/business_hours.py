@@ -0,0 +1,90 @@
+"""
+Compiled weekly business-hours schedules.
+
+Each tenant's business_hours rows are compiled once, when the tenant
+snapshot is (re)loaded, into a 10,080-bit bitmap — one bit per minute of
+the week, Monday 00:00 first. Checking a message against it is a shift and
+a mask instead of a DB query and string comparisons.
+
+Rules, matching what the bot has always done:
+  • open_time/close_time are inclusive "HH:MM" local times
+  • a day with no open row (or no usable times) never sends the closed reply
+  • close < open is an overnight span, read as the old string comparison
+    read it: the day is open from open_time to midnight and from midnight
+    to close_time — the early hours of the same weekday, not the next one
+"""
+from functools import lru_cache
+
+import pytz
+
+from app.logging_config import get_logger
+
+DEFAULT_TIMEZONE = "Africa/Lagos"
+
+MINUTES_PER_DAY  = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+logger = get_logger("business_hours")
+
+
+@lru_cache(maxsize=None)
+def get_timezone(name):
+    """tz object for a client's timezone name, built once per name."""
+    try:
+        return pytz.timezone(name or DEFAULT_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        logger.warning("Unknown timezone, using the default", extra={"timezone": name, "default": DEFAULT_TIMEZONE})
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+
+def _parse_minute(value):
+    """'HH:MM' -> minute of the day, or None if it isn't a usable time."""
+    try:
+        hours, minutes = value.split(":")
+        minute = int(hours) * 60 + int(minutes)
+    except (AttributeError, ValueError):
+        return None
+    return minute if 0 <= minute < MINUTES_PER_DAY else None
+
+
+def _span(start, end):
+    """Bitmask with minutes start..end (inclusive) set."""
+    return ((1 << (end - start + 1)) - 1) << start
+
+
+class WeeklySchedule:
+    __slots__ = ("bitmap",)
+
+    def __init__(self, bitmap):
+        self.bitmap = bitmap
+
+    def is_open_at(self, local_now):
+        """local_now must already be in the tenant's timezone."""
+        minute = local_now.weekday() * MINUTES_PER_DAY + local_now.hour * 60 + local_now.minute
+        return bool((self.bitmap >> minute) & 1)
+
+
+def compile_schedule(business_hours):
+    """Compile a tenant's open business_hours rows into a WeeklySchedule."""
+    spans = {}
+    for hours in business_hours:
+        open_minute  = _parse_minute(hours.open_time)
+        close_minute = _parse_minute(hours.close_time)
+        if open_minute is None or close_minute is None:
+            continue
+        spans.setdefault(hours.day_of_week, (open_minute, close_minute))
+
+    bitmap = 0
+    for day in range(7):
+        if day not in spans:
+            bitmap |= _span(day * MINUTES_PER_DAY, (day + 1) * MINUTES_PER_DAY - 1)
+
+    for day, (open_minute, close_minute) in spans.items():
+        base = day * MINUTES_PER_DAY
+        if close_minute >= open_minute:
+            bitmap |= _span(base + open_minute, base + close_minute)
+        else:
+            bitmap |= _span(base + open_minute, base + MINUTES_PER_DAY - 1)
+            bitmap |= _span(base, base + close_minute)
+
+    return WeeklySchedule(bitmap)
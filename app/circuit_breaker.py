@@ -0,0 +1,168 @@
+"""
+Circuit breakers for the Graph API and Anthropic.
+
+When a dependency starts failing, every message used to wait out its
+timeouts (and, for Claude, a 2-second sleep) before falling back. A breaker
+watches the outcome of recent calls and, once too many fail, stops calling
+the dependency for a while:
+
+  • closed    — calls go through; the last CIRCUIT_WINDOW outcomes are kept
+  • open      — failure rate reached CIRCUIT_FAILURE_RATE: calls are refused
+                immediately for CIRCUIT_OPEN_SECONDS
+  • half-open — after that, one probe call is let through; success closes
+                the breaker, failure opens it again
+
+Breakers are per process — each worker finds out about an outage from its
+own calls, which takes CIRCUIT_MIN_CALLS failures at most.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from app.logging_config import get_logger
+from app.metrics import Counter, GaugeCallback
+
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", 0.5))
+CIRCUIT_WINDOW       = int(os.getenv("CIRCUIT_WINDOW", 20))        # recent calls considered
+CIRCUIT_MIN_CALLS    = int(os.getenv("CIRCUIT_MIN_CALLS", 10))     # before the rate is trusted
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30))
+
+CLOSED    = "closed"
+HALF_OPEN = "half_open"
+OPEN      = "open"
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+logger = get_logger("circuit_breaker")
+
+_breakers = {}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+    def __init__(self, name):
+        super().__init__(f"{name} circuit is open")
+        self.name = name
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_rate=CIRCUIT_FAILURE_RATE, window=CIRCUIT_WINDOW,
+                 min_calls=CIRCUIT_MIN_CALLS, open_seconds=CIRCUIT_OPEN_SECONDS):
+        self.name         = name
+        self.failure_rate = failure_rate
+        self.min_calls    = min_calls
+        self.open_seconds = open_seconds
+
+        self._lock        = threading.Lock()
+        self._outcomes    = deque(maxlen=window)   # True = success
+        self._state       = CLOSED
+        self._opened_at   = 0.0
+        self._probe_at    = None                   # start of the half-open probe in flight
+        self._stats       = {"rejected": 0, "opened": 0}
+        _breakers[name]   = self
+
+    @property
+    def state(self):
+        """Current state — an open breaker whose open_seconds are up reads half-open."""
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            return HALF_OPEN
+        return self._state
+
+    def is_open(self):
+        """True while calls would be refused outright — doesn't take the half-open probe."""
+        with self._lock:
+            return self._state == OPEN and time.monotonic() - self._opened_at < self.open_seconds
+
+    def allow(self):
+        """True if a call may go ahead. In half-open, only the probe is let through."""
+        now = time.monotonic()
+        with self._lock:
+            if self._state == OPEN:
+                if now - self._opened_at < self.open_seconds:
+                    return self._reject()
+                self._state    = HALF_OPEN
+                self._probe_at = None
+
+            if self._state == HALF_OPEN:
+                # A probe whose outcome was never recorded doesn't block forever
+                if self._probe_at is not None and now - self._probe_at < self.open_seconds:
+                    return self._reject()
+                self._probe_at = now
+            return True
+
+    def cancel(self):
+        """An allowed call that was never made — frees the half-open probe."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_at = None
+
+    def _reject(self):
+        self._stats["rejected"] += 1
+        CIRCUIT_REJECTED.inc(breaker=self.name)
+        return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info("Circuit closed", extra={"breaker": self.name})
+                self._state = CLOSED
+                self._outcomes.clear()
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            if self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._open()
+
+    def _open(self):
+        self._state     = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_at  = None
+        self._stats["opened"] += 1
+        CIRCUIT_OPENED.inc(breaker=self.name)
+        logger.warning("Circuit opened", extra={"breaker": self.name, "open_seconds": self.open_seconds})
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["state"]    = self._current_state()
+            stats["failures"] = self._outcomes.count(False)
+            stats["calls"]    = len(self._outcomes)
+        return stats
+
+
+CIRCUIT_REJECTED = Counter(
+    "botmart_circuit_rejected_total",
+    "Calls refused because the dependency's circuit was open",
+    ["breaker"],
+)
+CIRCUIT_OPENED = Counter(
+    "botmart_circuit_opened_total",
+    "Times each circuit breaker has opened",
+    ["breaker"],
+)
+CIRCUIT_STATE = GaugeCallback(
+    "botmart_circuit_state",
+    "Circuit breaker state: 0 closed, 1 half-open, 2 open",
+    lambda: {(name,): STATE_VALUES[breaker.state] for name, breaker in _breakers.items()},
+    ["breaker"],
+)
+
+GRAPH_BREAKER     = CircuitBreaker("graph")
+ANTHROPIC_BREAKER = CircuitBreaker("anthropic")
+
+
+def get_breaker_stats():
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
@@ -0,0 +1,125 @@
+"""
+Per-sender contact state cache.
+
+Every inbound message needs to know whether the sender is already a
+contact, whether they opted out and whether they have messaged before. That answer almost never changes, so
+each process keeps a small LRU of ContactState keyed by
+(client_id, phone_number) and only asks the DB about senders it hasn't
+seen recently.
+
+Invalidation:
+  • opt-out/opt-in in the webhook and the FastAPI contact endpoints call
+    invalidate_contact(), which also publishes on CONTACT_CHANNEL
+  • Django publishes on CONTACT_CHANNEL when a contact is saved or deleted
+    (see core/signals.py)
+  • entries expire after CONTACT_CACHE_TTL as a backstop
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.logging_config import get_logger
+from app.redis_client import get_redis
+from app.tenant_cache import register_invalidation_handler
+
+CONTACT_CACHE_TTL  = int(os.getenv("CONTACT_CACHE_TTL", 600))        # seconds
+CONTACT_CACHE_SIZE = int(os.getenv("CONTACT_CACHE_SIZE", 50000))     # senders per process
+CONTACT_CHANNEL    = "botmart:contacts"
+
+logger = get_logger("contact_cache")
+
+_entries = OrderedDict()   # (client_id, phone_number) -> (ContactState, loaded_at)
+_lock    = threading.Lock()
+_stats   = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+class ContactState:
+    """What the webhook needs to know about a sender."""
+    __slots__ = ("id", "opted_out", "first_seen_at", "last_seen_at", "created")
+
+    def __init__(self, id, opted_out, first_seen_at=None, last_seen_at=None, created=False):
+        self.id            = id
+        self.opted_out     = bool(opted_out)
+        self.first_seen_at = first_seen_at
+        self.last_seen_at  = last_seen_at
+        self.created       = created   # inserted by the webhook, so no message history
+
+
+def get_contacts(client_id, phone_numbers):
+    """
+    Cached states for the given senders.
+    Returns (found: {phone_number: ContactState}, missing: [phone_number]).
+    """
+    found, missing = {}, []
+    now = time.monotonic()
+    with _lock:
+        for phone_number in phone_numbers:
+            key   = (client_id, phone_number)
+            entry = _entries.get(key)
+            if entry and now - entry[1] < CONTACT_CACHE_TTL:
+                _entries.move_to_end(key)
+                found[phone_number] = entry[0]
+                _stats["hits"] += 1
+            else:
+                missing.append(phone_number)
+                _stats["misses"] += 1
+    return found, missing
+
+
+def put_contact(client_id, phone_number, state):
+    with _lock:
+        _entries[(client_id, phone_number)] = (state, time.monotonic())
+        _entries.move_to_end((client_id, phone_number))
+        while len(_entries) > CONTACT_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def forget_contact(client_id, phone_number=None):
+    """Drop a sender (or a whole tenant) from this process only."""
+    with _lock:
+        if phone_number is not None:
+            _entries.pop((client_id, phone_number), None)
+        else:
+            for key in [key for key in _entries if key[0] == client_id]:
+                del _entries[key]
+        _stats["invalidations"] += 1
+
+
+def invalidate_contact(client_id, phone_number=None):
+    """Forget one sender (or a whole tenant) here and on every other worker."""
+    forget_contact(client_id, phone_number)
+
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        r.publish(CONTACT_CHANNEL, json.dumps({
+            "client_id":    client_id,
+            "phone_number": phone_number,
+        }))
+    except Exception as e:
+        logger.warning("Could not publish contact invalidation", extra={"error": str(e)})
+
+
+def clear_contact_cache():
+    with _lock:
+        _entries.clear()
+
+
+def get_contact_cache_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["size"] = len(_entries)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    return stats
+
+
+def _handle_invalidation(payload):
+    if payload.get("client_id") is not None:
+        forget_contact(payload["client_id"], payload.get("phone_number"))
+
+
+register_invalidation_handler(CONTACT_CHANNEL, _handle_invalidation, clear_contact_cache)
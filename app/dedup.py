@@ -0,0 +1,136 @@
+"""
+Webhook deduplication store.
+
+Meta retries a webhook until it sees a 200, often in bursts, so the same
+WhatsApp message id can arrive several times — sometimes on two workers at
+once. Before processing, a worker claims the message id here:
+
+  • an in-memory LRU with a TTL answers repeats on this process without I/O
+  • with REDIS_URL set, SET NX EX makes the claim atomic across every node
+
+Only the first claimer processes the message. A claim first lasts
+DEDUP_PROCESSING_TTL and is extended to DEDUP_TTL by complete_message()
+once the message has committed, so a worker killed mid-message (SIGKILL,
+OOM) doesn't leave a 7-day claim behind and the queue's redelivery is
+processed. A claim is released straight away if processing fails. The
+unique index on message_logs.whatsapp_message_id stays as the last line
+of defence.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.logging_config import get_logger
+from app.redis_client import get_redis
+
+DEDUP_TTL            = int(os.getenv("DEDUP_TTL", 7 * 24 * 3600))   # Meta retries for up to 7 days
+DEDUP_MAX_ENTRIES    = int(os.getenv("DEDUP_MAX_ENTRIES", 100000))   # per process
+DEDUP_PROCESSING_TTL = int(os.getenv("DEDUP_PROCESSING_TTL", 120))   # claim lifetime until the message commits
+
+logger = get_logger("dedup")
+
+_seen  = OrderedDict()   # whatsapp_message_id -> expires_at (monotonic)
+_lock  = threading.Lock()
+_stats = {"claims": 0, "duplicates": 0, "local_hits": 0, "redis_hits": 0, "released": 0, "evictions": 0}
+
+
+def _redis_key(message_id):
+    return f"botmart:dedup:{message_id}"
+
+
+def _remember(message_id, now, ttl=DEDUP_TTL):
+    """Record a message id locally. Caller holds _lock."""
+    _seen[message_id] = now + ttl
+    _seen.move_to_end(message_id)
+    while len(_seen) > DEDUP_MAX_ENTRIES:
+        _seen.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def claim_message(message_id):
+    """
+    Atomically claim a WhatsApp message id for processing.
+    Returns True if the caller should process it, False if it is a duplicate.
+    Messages without an id can't be deduplicated and are always processed.
+    """
+    if not message_id:
+        return True
+
+    now = time.monotonic()
+    with _lock:
+        expires_at = _seen.get(message_id)
+        if expires_at is not None and expires_at > now:
+            _seen.move_to_end(message_id)
+            _stats["duplicates"] += 1
+            _stats["local_hits"] += 1
+            return False
+        # Reserve locally first so a second thread on this process loses
+        # the race without a Redis round trip
+        _remember(message_id, now, DEDUP_PROCESSING_TTL)
+
+    r = get_redis()
+    if r is not None:
+        try:
+            claimed = r.set(_redis_key(message_id), "1", nx=True, ex=DEDUP_PROCESSING_TTL)
+        except Exception as e:
+            logger.warning("Redis unavailable, using local dedup store only", extra={"error": str(e)})
+            claimed = True
+        if not claimed:
+            with _lock:
+                _stats["duplicates"] += 1
+                _stats["redis_hits"] += 1
+            return False
+
+    with _lock:
+        _stats["claims"] += 1
+    return True
+
+
+def complete_message(message_id):
+    """The message committed — keep its claim for the full DEDUP_TTL."""
+    if not message_id:
+        return
+
+    with _lock:
+        _remember(message_id, time.monotonic())
+
+    r = get_redis()
+    if r is not None:
+        try:
+            r.set(_redis_key(message_id), "1", ex=DEDUP_TTL)
+        except Exception as e:
+            logger.warning("Could not extend dedup claim", extra={"message_id": message_id, "error": str(e)})
+
+
+def release_message(message_id):
+    """Give up a claim after a failed attempt so the next delivery is processed."""
+    if not message_id:
+        return
+
+    with _lock:
+        _seen.pop(message_id, None)
+        _stats["released"] += 1
+
+    r = get_redis()
+    if r is not None:
+        try:
+            r.delete(_redis_key(message_id))
+        except Exception as e:
+            logger.warning("Could not release dedup claim", extra={"message_id": message_id, "error": str(e)})
+
+
+def clear_dedup_store():
+    with _lock:
+        _seen.clear()
+
+
+def get_dedup_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["size"] = len(_seen)
+    stats["max_entries"]    = DEDUP_MAX_ENTRIES
+    stats["ttl"]            = DEDUP_TTL
+    stats["processing_ttl"] = DEDUP_PROCESSING_TTL
+    stats["redis"]          = get_redis() is not None
+    return stats
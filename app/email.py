@@ -3,9 +3,12 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 from dotenv import load_dotenv
+from app.logging_config import get_logger
 
 load_dotenv()
 
+logger = get_logger("email")
+
 
 # ─────────────────────────────────────────────
 # SHARED HELPERS
@@ -14,7 +17,7 @@ load_dotenv()
 def _smtp_send(to_email, subject, body_html):
     """Core send function shared by all email helpers."""
     if not os.getenv("MAIL_USERNAME") or not os.getenv("MAIL_PASSWORD"):
-        print("Email skipped — credentials not configured")
+        logger.warning("Email skipped — credentials not configured")
         return False
 
     try:
@@ -33,7 +36,7 @@ def _smtp_send(to_email, subject, body_html):
         return True
 
     except Exception as e:
-        print(f"Email send failed: {e}")
+        logger.error("Email send failed", extra={"to": to_email, "error": str(e)})
         return False
 
 
@@ -305,7 +308,7 @@ def send_email_notification(to_email, business_name, sender_number, message_text
 
     result = _smtp_send(to_email, subject, body)
     if result:
-        print(f"✅ Handoff notification sent to {to_email}")
+        logger.info("Handoff notification sent", extra={"to": to_email})
     return result
 
 
@@ -369,7 +372,7 @@ def send_password_reset_email(to_email, business_name, reset_link):
 
     result = _smtp_send(to_email, subject, body)
     if result:
-        print(f"✅ Password reset email sent to {to_email}")
+        logger.info("Password reset email sent", extra={"to": to_email})
     return result
 
 
@@ -437,7 +440,7 @@ def send_registration_email(to_email, business_name):
 
     result = _smtp_send(to_email, subject, body)
     if result:
-        print(f"✅ Registration email sent to {to_email}")
+        logger.info("Registration email sent", extra={"to": to_email})
     return result
 
 
@@ -496,5 +499,5 @@ def send_activation_email(to_email, business_name):
 
     result = _smtp_send(to_email, subject, body)
     if result:
-        print(f"✅ Activation email sent to {to_email}")
+        logger.info("Activation email sent", extra={"to": to_email})
     return result
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+Shared HTTP client for the Meta Graph API.
+
+Every send used to call bare requests.post(), paying a fresh TCP + TLS
+handshake to graph.facebook.com and waiting forever on a hung request.
+All Graph calls now go through one pooled keep-alive client with explicit
+connect/read timeouts. HTTP/2 is used when the optional `h2` package is
+installed.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import httpx
+
+from app import rate_limiter
+from app.circuit_breaker import GRAPH_BREAKER, CircuitOpenError
+from app.rate_limiter import SendThrottled
+from app.metrics import GRAPH_ERRORS
+
+try:
+    import h2  # noqa: F401 — only needed to enable HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+GRAPH_API_URL = "https://graph.facebook.com/v19.0"
+
+GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", 5))    # seconds
+GRAPH_READ_TIMEOUT    = float(os.getenv("GRAPH_READ_TIMEOUT", 15))      # seconds
+GRAPH_POOL_SIZE       = int(os.getenv("GRAPH_POOL_SIZE", 20))           # connections to graph.facebook.com
+GRAPH_POOL_KEEPALIVE  = int(os.getenv("GRAPH_POOL_KEEPALIVE", 10))      # idle connections kept open
+
+LATENCY_WINDOW = 1000  # recent requests kept for percentiles
+
+_client      = None
+_client_lock = threading.Lock()
+
+_stats_lock  = threading.Lock()
+_latencies   = deque(maxlen=LATENCY_WINDOW)
+_stats = {
+    "requests":       0,
+    "errors":         0,
+    "in_flight":      0,
+    "peak_in_flight": 0,
+    "latency_total":  0.0,
+    "latency_max":    0.0,
+}
+
+
+def get_graph_client():
+    """Return the process-wide pooled client, creating it on first use."""
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(
+                    base_url=GRAPH_API_URL,
+                    http2=HTTP2_AVAILABLE,
+                    timeout=httpx.Timeout(GRAPH_READ_TIMEOUT, connect=GRAPH_CONNECT_TIMEOUT),
+                    limits=httpx.Limits(
+                        max_connections=GRAPH_POOL_SIZE,
+                        max_keepalive_connections=GRAPH_POOL_KEEPALIVE,
+                    ),
+                )
+    return _client
+
+
+def close_graph_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def request(method, path, access_token, **kwargs):
+    """
+    Send one Graph API request through the shared pool.
+    Raises httpx.HTTPError on timeouts and connection failures.
+    """
+    headers = kwargs.pop("headers", {})
+    headers["Authorization"] = f"Bearer {access_token}"
+
+    with _stats_lock:
+        _stats["in_flight"] += 1
+        _stats["peak_in_flight"] = max(_stats["peak_in_flight"], _stats["in_flight"])
+
+    started = time.perf_counter()
+    failed  = False
+    try:
+        response = get_graph_client().request(method, path, headers=headers, **kwargs)
+    except httpx.HTTPError:
+        failed = True
+        GRAPH_ERRORS.inc(code="transport")
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        with _stats_lock:
+            _stats["in_flight"]     -= 1
+            _stats["requests"]      += 1
+            _stats["errors"]        += failed
+            _stats["latency_total"] += elapsed
+            _stats["latency_max"]    = max(_stats["latency_max"], elapsed)
+            _latencies.append(elapsed)
+
+    if response.status_code >= 400:
+        GRAPH_ERRORS.inc(code=str(response.status_code))
+    return response
+
+
+def get(path, access_token, **kwargs):
+    return request("GET", path, access_token, **kwargs)
+
+
+def post(path, access_token, **kwargs):
+    return request("POST", path, access_token, **kwargs)
+
+
+def delete(path, access_token, **kwargs):
+    return request("DELETE", path, access_token, **kwargs)
+
+
+def post_message(phone_number_id, access_token, payload):
+    """
+    POST a message payload to /{phone_number_id}/messages, within the
+    number's send rate. Raises CircuitOpenError without calling Graph while
+    sends are failing, and SendThrottled when the send has to wait for the
+    rate limit or Graph answered with a throttling error — the caller
+    defers it (app/send_retry.py).
+    """
+    if not GRAPH_BREAKER.allow():
+        raise CircuitOpenError(GRAPH_BREAKER.name)
+
+    recipient = payload.get("to")
+    try:
+        rate_limiter.acquire(phone_number_id, recipient)
+    except SendThrottled:
+        GRAPH_BREAKER.cancel()
+        raise
+
+    try:
+        response = post(f"/{phone_number_id}/messages", access_token, json=payload)
+    except httpx.HTTPError:
+        GRAPH_BREAKER.record_failure()
+        raise
+
+    code = rate_limiter.throttle_code(response)
+    if code is not None:
+        # Graph is up — it is only asking us to slow down
+        GRAPH_BREAKER.record_success()
+        delay = rate_limiter.pause(phone_number_id, recipient if code == rate_limiter.PAIR_THROTTLE_CODE else None)
+        raise SendThrottled(phone_number_id, delay)
+
+    # 4xx answers (bad recipient, expired token) mean Graph is up
+    if response.status_code >= 500:
+        GRAPH_BREAKER.record_failure()
+    else:
+        GRAPH_BREAKER.record_success()
+    return response
+
+
+def get_graph_stats():
+    """Pool utilisation and request latency since start-up."""
+    with _stats_lock:
+        stats  = dict(_stats)
+        recent = sorted(_latencies)
+
+    def percentile(p):
+        if not recent:
+            return 0.0
+        return recent[min(len(recent) - 1, int(len(recent) * p))]
+
+    stats["pool_size"]        = GRAPH_POOL_SIZE
+    stats["pool_utilisation"] = round(stats["in_flight"] / GRAPH_POOL_SIZE, 4)
+    stats["http2"]            = HTTP2_AVAILABLE
+    stats["latency_avg"]      = stats["latency_total"] / stats["requests"] if stats["requests"] else 0.0
+    stats["latency_p50"]      = percentile(0.50)
+    stats["latency_p95"]      = percentile(0.95)
+    return stats
@@ -0,0 +1,111 @@
+"""
+Multi-pattern substring matcher for auto-reply rule triggers.
+
+The webhook used to check `rule.trigger_keyword in text` for every active
+rule, which costs O(rules × text) per message. KeywordMatcher compiles all
+trigger keywords into one Aho-Corasick automaton so a message is scanned
+once, whatever the number of rules.
+
+Semantics match the old loop exactly: when several keywords occur in the
+text, the one that came first in the list wins.
+
+For a handful of keywords CPython's `in` beats a per-character automaton
+walk, so small rule sets keep the plain scan (see benchmarks/).
+"""
+from collections import deque
+
+LINEAR_SCAN_MAX = 24  # below this many keywords the plain `in` loop is faster
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over (keyword, value) pairs, first pair wins."""
+
+    def __init__(self, pairs):
+        self._keywords = []
+        self._values   = []
+        self._goto     = [{}]      # node → {char: node}
+        self._fail     = [0]
+        self._best     = [None]    # lowest pair index ending at node (incl. fail chain)
+
+        for keyword, value in pairs:
+            index = len(self._values)
+            self._keywords.append(keyword)
+            self._values.append(value)
+            self._insert(keyword, index)
+
+        self._build_fail_links()
+        self._linear = len(self._values) <= LINEAR_SCAN_MAX
+
+    def __len__(self):
+        return len(self._values)
+
+    def _insert(self, keyword, index):
+        node = 0
+        for char in keyword:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            node = nxt
+
+        if self._best[node] is None or index < self._best[node]:
+            self._best[node] = index
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+
+                # Fold the fail chain's best match into the child so search
+                # never has to walk fail links to collect outputs
+                inherited = self._best[self._fail[child]]
+                if inherited is not None and (
+                    self._best[child] is None or inherited < self._best[child]
+                ):
+                    self._best[child] = inherited
+
+    def search(self, text):
+        """Return the value of the first pair whose keyword occurs in text, or None."""
+        if self._linear:
+            for keyword, value in zip(self._keywords, self._values):
+                if keyword in text:
+                    return value
+            return None
+
+        goto    = self._goto
+        fail    = self._fail
+        outputs = self._best
+        best    = outputs[0]  # an empty keyword matches everything
+
+        if best == 0:
+            return self._values[0]
+
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            found = outputs[node]
+            if found is not None and (best is None or found < best):
+                best = found
+                if best == 0:
+                    break
+
+        return None if best is None else self._values[best]
+
+
+def build_rule_matcher(rules):
+    """Compile a tenant's active AutoReplyRule rows into a KeywordMatcher."""
+    return KeywordMatcher((rule.trigger_keyword, rule) for rule in rules)
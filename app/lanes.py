@@ -0,0 +1,253 @@
+"""
+Per-conversation ordered lanes.
+
+Messages are sharded by hash(phone_number_id, sender) into LANE_COUNT
+lanes. Each lane is processed strictly in order by one worker at a time,
+so a customer's welcome always goes out before their menu and a STOP takes
+effect before the next reply, while different customers are processed
+concurrently.
+
+  • inline mode    — LaneExecutor runs one thread per lane inside FastAPI
+  • durable queues — each lane is its own queue (webhook:inbound:<lane>) and
+                     a worker must hold the lane's lease to consume it, so
+                     ordering holds across processes and machines
+"""
+import os
+import queue
+import threading
+import zlib
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.message_queue import INBOUND_QUEUE, MESSAGE_QUEUE_BACKEND, get_queue, queue_enabled
+from app.logging_config import get_logger
+from app.metrics import GaugeCallback
+from app.redis_client import get_redis
+
+LANE_COUNT     = int(os.getenv("LANE_COUNT", 16))
+LANE_LEASE_MS  = int(os.getenv("LANE_LEASE_MS", 60000))
+
+ADVISORY_LOCK_BASE = 0x424D0000  # "BM" — keeps lane locks clear of other advisory locks
+
+logger = get_logger("lanes")
+
+
+def lane_for(phone_number_id, sender):
+    """Stable lane number for a conversation — the same on every process."""
+    return zlib.crc32(f"{phone_number_id}:{sender}".encode()) % LANE_COUNT
+
+
+def lane_queue_name(lane):
+    return f"{INBOUND_QUEUE}:{lane}"
+
+
+def build_payload(phone_number_id, messages):
+    """Wrap messages back into the shape Meta posts, for one phone number."""
+    return {"entry": [{"changes": [{"value": {
+        "metadata": {"phone_number_id": phone_number_id},
+        "messages": messages,
+    }}]}]}
+
+
+def partition_messages(messages):
+    """
+    Group (phone_number_id, message) pairs into per-lane payloads.
+    Returns [(lane, payload), ...] with each conversation's messages in order.
+    """
+    groups = {}
+    for phone_number_id, message in messages:
+        lane = lane_for(phone_number_id, message.get("from"))
+        groups.setdefault((lane, phone_number_id), []).append(message)
+
+    return [
+        (lane, build_payload(phone_number_id, group))
+        for (lane, phone_number_id), group in groups.items()
+    ]
+
+
+# ─────────────────────────────────────────────
+# INLINE MODE — IN-PROCESS LANE THREADS
+# ─────────────────────────────────────────────
+
+class LaneExecutor:
+    """One FIFO queue and one thread per lane."""
+
+    def __init__(self, handler, lane_count=LANE_COUNT):
+        self.handler = handler
+        self.queues  = [queue.Queue() for _ in range(lane_count)]
+        self.threads = []
+        self._lock   = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self.threads:
+                return
+            for lane, lane_queue in enumerate(self.queues):
+                thread = threading.Thread(
+                    target=self._run, args=(lane_queue,), name=f"lane-{lane}", daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+
+    def _run(self, lane_queue):
+        while True:
+            payload = lane_queue.get()
+            try:
+                self.handler(payload)
+            except Exception:
+                logger.exception("Unhandled error in lane handler")
+            finally:
+                lane_queue.task_done()
+
+    def submit(self, lane, payload):
+        if not self.threads:
+            self._start()
+        self.queues[lane].put(payload)
+
+    def depths(self):
+        return [lane_queue.qsize() for lane_queue in self.queues]
+
+
+# ─────────────────────────────────────────────
+# DURABLE MODE — LANE LEASES
+# ─────────────────────────────────────────────
+
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLaneLease:
+    """
+    Expiring lease — a crashed owner loses the lane after LANE_LEASE_MS.
+    While the owner works, a heartbeat thread renews it every third of
+    that, so a slow job can't outlive it; `lost` is set when a renewal
+    fails and the owner must stop taking jobs from the lane.
+    """
+
+    def __init__(self, lane, owner):
+        self.redis      = get_redis()
+        self.key        = f"botmart:lane-lease:{lane}"
+        self.owner      = owner
+        self.lost       = threading.Event()
+        self._stop_beat = threading.Event()
+        self._beat      = None
+
+    def acquire(self):
+        got = bool(self.redis.set(self.key, self.owner, nx=True, px=LANE_LEASE_MS))
+        if got:
+            self._beat = threading.Thread(target=self._heartbeat, name=f"{self.key}-heartbeat", daemon=True)
+            self._beat.start()
+        return got
+
+    def _heartbeat(self):
+        while not self._stop_beat.wait(LANE_LEASE_MS / 3000):
+            try:
+                renewed = self.renew()
+            except Exception as e:
+                logger.warning("Lane lease renewal failed", extra={"lease": self.key, "error": str(e)})
+                renewed = False
+            if not renewed:
+                self.lost.set()
+                return
+
+    def renew(self):
+        if self.lost.is_set():
+            return False
+        return bool(self.redis.eval(_RENEW_SCRIPT, 1, self.key, self.owner, LANE_LEASE_MS))
+
+    def release(self):
+        self._stop_beat.set()
+        self.redis.eval(_RELEASE_SCRIPT, 1, self.key, self.owner)
+
+
+class PostgresLaneLease:
+    """
+    Session advisory lock — released by Postgres if the owner's connection
+    dies. The lock belongs to the connection, so the lease keeps one
+    connection checked out for its whole life and unlocks on it.
+    """
+
+    def __init__(self, lane, owner):
+        self.key  = ADVISORY_LOCK_BASE + lane
+        self.conn = None
+        self.lost = threading.Event()   # never set — the lock can't expire under us
+
+    def acquire(self):
+        self.conn = engine.connect()
+        try:
+            got = self.conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}).scalar()
+            self.conn.commit()  # the lock is session-level, don't sit idle in a transaction
+        except Exception:
+            self.conn.close()
+            self.conn = None
+            raise
+        if not got:
+            self.conn.close()
+            self.conn = None
+        return bool(got)
+
+    def renew(self):
+        return self.conn is not None and not self.conn.closed
+
+    def release(self):
+        if self.conn is None:
+            return
+        try:
+            self.conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            self.conn.commit()
+        except Exception:
+            # Never hand a connection that may still hold the lock back to the pool
+            self.conn.invalidate()
+            raise
+        finally:
+            self.conn.close()
+            self.conn = None
+
+
+def make_lane_lease(lane, owner):
+    if MESSAGE_QUEUE_BACKEND == "redis":
+        return RedisLaneLease(lane, owner)
+    return PostgresLaneLease(lane, owner)
+
+
+# ─────────────────────────────────────────────
+# METRICS
+# ─────────────────────────────────────────────
+
+_executor = None
+
+
+def get_lane_executor(handler):
+    global _executor
+    if _executor is None:
+        _executor = LaneExecutor(handler)
+    return _executor
+
+
+def get_lane_depths():
+    """Messages waiting in each lane."""
+    if queue_enabled():
+        return [get_queue(lane_queue_name(lane)).depth() for lane in range(LANE_COUNT)]
+    if _executor is None:
+        return [0] * LANE_COUNT
+    return _executor.depths()
+
+
+QUEUE_DEPTH = GaugeCallback(
+    "botmart_lane_queue_depth",
+    "Messages waiting in each lane",
+    lambda: {(str(lane),): depth for lane, depth in enumerate(get_lane_depths())},
+    ["lane"],
+)
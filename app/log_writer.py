@@ -0,0 +1,220 @@
+"""
+Write-behind MessageLog persistence.
+
+Every handled message used to add and commit two to four MessageLog rows
+one at a time — a WAL flush per row on the busiest table. The webhook now
+hands rows to a process-wide writer that buffers them and inserts them in
+one multi-row INSERT every MESSAGE_LOG_FLUSH_ROWS rows or
+MESSAGE_LOG_FLUSH_MS milliseconds, whichever comes first.
+
+  • rows carry their own timestamp, so the dashboard sees exactly what the
+    old inline commits wrote
+  • the buffer is flushed on shutdown (FastAPI shutdown, worker exit, atexit)
+  • a message's rows are staged while it is handled (begin()) and only
+    reach the buffer at sync_point(), once its transaction has committed;
+    a rolled-back message's rows are discarded, so its retry doesn't log
+    them twice
+  • MESSAGE_LOG_SYNC=1 writes a message's rows as soon as its transaction
+    commits — use it in tests and scripts that read message_logs straight
+    after a message
+"""
+import atexit
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from app import models
+from app.database import SessionLocal
+from app.logging_config import get_logger
+from app.metrics import STAGE_SECONDS
+
+MESSAGE_LOG_FLUSH_ROWS  = int(os.getenv("MESSAGE_LOG_FLUSH_ROWS", 200))
+MESSAGE_LOG_FLUSH_MS    = int(os.getenv("MESSAGE_LOG_FLUSH_MS", 250))
+MESSAGE_LOG_MAX_PENDING = int(os.getenv("MESSAGE_LOG_MAX_PENDING", 20000))  # cap while the DB is down
+MESSAGE_LOG_SYNC        = os.getenv("MESSAGE_LOG_SYNC", "0").lower() in ("1", "true", "yes")
+
+logger = get_logger("log_writer")
+
+
+class MessageLogWriter:
+    def __init__(self, flush_rows=MESSAGE_LOG_FLUSH_ROWS, flush_ms=MESSAGE_LOG_FLUSH_MS, sync=MESSAGE_LOG_SYNC):
+        self.flush_rows = flush_rows
+        self.flush_ms   = flush_ms
+        self.sync       = sync
+
+        self._buffer      = []
+        self._cond        = threading.Condition()
+        self._flush_lock  = threading.Lock()   # one flush at a time, keeps rows in order
+        self._thread      = None
+        self._closed      = False
+        self._staged      = threading.local()   # .rows — the current message's rows, until it commits
+        self._stats       = {"rows": 0, "flushes": 0, "duplicates": 0, "errors": 0, "dropped": 0, "discarded": 0}
+
+    # ── Producer side ──
+
+    def write(self, client_id, sender_number, message_text, direction, whatsapp_message_id=None):
+        row = {
+            "client_id":           client_id,
+            "sender_number":       sender_number,
+            "message_text":        message_text,
+            "direction":           direction,
+            "timestamp":           datetime.utcnow(),
+            "whatsapp_message_id": whatsapp_message_id,
+        }
+
+        staged = getattr(self._staged, "rows", None)
+        if staged is not None:
+            staged.append(row)
+        else:
+            self._enqueue([row])
+
+    def _enqueue(self, rows):
+        with self._cond:
+            self._buffer.extend(rows)
+            overflow = len(self._buffer) - MESSAGE_LOG_MAX_PENDING
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self._stats["dropped"] += overflow
+            full = len(self._buffer) >= self.flush_rows
+            if full:
+                self._cond.notify()
+
+        if self._closed:
+            self.flush()
+        elif self._thread is None and not self.sync:
+            self._start()
+
+    def begin(self):
+        """Stage this thread's rows until sync_point() or discard()."""
+        self._staged.rows = []
+
+    def sync_point(self):
+        """Called once a message has committed — its rows go to the buffer, in sync mode they are written now."""
+        staged, self._staged.rows = getattr(self._staged, "rows", None), None
+        if staged:
+            self._enqueue(staged)
+        if self.sync:
+            self.flush()
+
+    def discard(self):
+        """The message rolled back — drop its staged rows."""
+        staged, self._staged.rows = getattr(self._staged, "rows", None), None
+        if staged:
+            with self._cond:
+                self._stats["discarded"] += len(staged)
+
+    # ── Flushing ──
+
+    def flush(self):
+        """Write everything buffered so far. Safe to call from any thread."""
+        with self._flush_lock:
+            with self._cond:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+
+            try:
+                with STAGE_SECONDS.time(stage="log_write"):
+                    written = self._insert(rows)
+            except Exception as e:
+                logger.error("Message log flush failed, will retry", extra={"rows": len(rows), "error": str(e)})
+                with self._cond:
+                    self._stats["errors"] += 1
+                    self._buffer[:0] = rows
+                return 0
+
+            with self._cond:
+                self._stats["rows"]    += written
+                self._stats["flushes"] += 1
+            return written
+
+    def _insert(self, rows):
+        db = SessionLocal()
+        try:
+            try:
+                db.execute(insert(models.MessageLog), rows)
+                db.commit()
+                return len(rows)
+            except IntegrityError:
+                # A redelivered message slipped past dedup and hit the unique
+                # whatsapp_message_id index — write the batch row by row and
+                # skip the duplicates instead of losing the whole batch
+                db.rollback()
+
+            written = 0
+            for row in rows:
+                try:
+                    db.execute(insert(models.MessageLog), [row])
+                    db.commit()
+                    written += 1
+                except IntegrityError:
+                    db.rollback()
+                    with self._cond:
+                        self._stats["duplicates"] += 1
+            return written
+        finally:
+            db.close()
+
+    def _start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="message-log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.flush_rows and not self._closed:
+                    self._cond.wait(self.flush_ms / 1000)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def close(self):
+        """Flush what is left and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=10)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._buffer)
+        stats["sync"] = self.sync
+        return stats
+
+
+_writer      = None
+_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = MessageLogWriter()
+                atexit.register(_writer.close)
+    return _writer
+
+
+def log_message(client_id, sender_number, message_text, direction, whatsapp_message_id=None):
+    get_log_writer().write(client_id, sender_number, message_text, direction, whatsapp_message_id)
+
+
+def close_log_writer():
+    if _writer is not None:
+        _writer.close()
+
+
+def get_log_writer_stats():
+    return get_log_writer().stats()
@@ -0,0 +1,144 @@
+"""
+Structured, non-blocking logging for the webhook engine.
+
+Loggers hand records to an in-memory queue (QueueHandler); one background
+QueueListener thread formats them as JSON lines and writes them to stdout.
+A message handler never waits on terminal or pipe I/O.
+
+  • LOG_LEVEL            — minimum level for every botmart.* logger
+  • LOG_LEVELS           — per-logger overrides, "webhook=DEBUG,broadcast=WARNING"
+  • LOG_SEND_SAMPLE_RATE — share of verbose per-send records kept (0.0–1.0)
+  • LOG_SEND_SAMPLE_TENANTS — per-tenant rates, "12=1.0,40=0", keyed by
+                           client id or phone_number_id
+
+Verbose records opt into sampling with extra={"sample": True, "client_id": …}
+(or "phone_number_id" where the client isn't known, as in the send helpers).
+Sampling only ever drops records below WARNING.
+
+    logger = get_logger("webhook")
+    logger.info("Send response", extra={"client_id": 7, "status": 200, "sample": True})
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+LOG_LEVEL               = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS              = os.getenv("LOG_LEVELS", "")
+LOG_SEND_SAMPLE_RATE    = float(os.getenv("LOG_SEND_SAMPLE_RATE", 0.1))
+LOG_SEND_SAMPLE_TENANTS = os.getenv("LOG_SEND_SAMPLE_TENANTS", "")
+
+ROOT_LOGGER = "botmart"
+
+# Attributes every LogRecord has — anything else came in through `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample"}
+
+
+def _parse_pairs(spec):
+    pairs = {}
+    for item in spec.split(","):
+        key, sep, value = item.partition("=")
+        if sep and key.strip():
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, then any extra fields."""
+
+    def format(self, record):
+        entry = {
+            "ts":     datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level":  record.levelname,
+            "logger": record.name,
+            "msg":    record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SendSampler(logging.Filter):
+    """Keep a per-tenant share of records marked `sample`; everything else passes."""
+
+    def __init__(self, rate=LOG_SEND_SAMPLE_RATE, tenant_rates=LOG_SEND_SAMPLE_TENANTS):
+        super().__init__()
+        self.rate    = rate
+        self.tenants = {key: float(value) for key, value in _parse_pairs(tenant_rates).items()}
+
+    def filter(self, record):
+        if not getattr(record, "sample", False) or record.levelno >= logging.WARNING:
+            return True
+        rate = self.tenants.get(str(getattr(record, "client_id", "")))
+        if rate is None:
+            rate = self.tenants.get(str(getattr(record, "phone_number_id", "")), self.rate)
+        return rate >= 1 or random.random() < rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Render the message now (args may be mutable objects) but keep the
+        # record's extra fields for the JSON formatter on the listener side
+        record.msg     = record.getMessage()
+        record.args    = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.msg      = f"{record.msg}\n{record.exc_text}"
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+
+_listener   = None
+_configured = False
+_lock       = threading.Lock()
+
+
+def configure_logging():
+    """Install the queue handler and start the listener thread — once per process."""
+    global _listener, _configured
+    if _configured:
+        return
+    with _lock:
+        if _configured:
+            return
+        _configured = True
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter())
+
+        records = queue.SimpleQueue()
+        handler = _QueueHandler(records)
+        handler.addFilter(SendSampler())
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(handler)
+        root.propagate = False
+        for name, level in _parse_pairs(LOG_LEVELS).items():
+            logging.getLogger(f"{ROOT_LOGGER}.{name}").setLevel(level.upper())
+
+        _listener = logging.handlers.QueueListener(records, output)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Drain queued records and stop the listener thread."""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def get_logger(name):
+    configure_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
@@ -1,10 +1,25 @@
 from fastapi import FastAPI
+from fastapi.responses import Response
 from app.database import engine, Base
 from app import models
 from app.routers import auth, admin, webhook, broadcast
 from app.routers import payment
 from apscheduler.schedulers.background import BackgroundScheduler
 from app.subscription_checker import run_subscription_checks
+from app.tenant_cache import start_invalidation_listener, get_cache_stats
+from app.graph_client import close_graph_client, get_graph_stats
+from app.lanes import get_lane_depths
+from app.dedup import get_dedup_stats
+from app.log_writer import close_log_writer, get_log_writer_stats
+from app.metrics import render_metrics, CONTENT_TYPE
+from app.rate_limiter import get_rate_limit_stats
+from app.circuit_breaker import get_breaker_stats
+from app.send_retry import start_send_retry_worker, stop_send_retry_worker, get_retry_depth
+from app.media_cache import get_media_cache_stats
+from app.token_health import revalidate_tokens, get_token_health_stats, TOKEN_REVALIDATE_MINUTES
+from app.ai_reply import close_ai_client, get_ai_slot_stats
+from app.ai_worker import get_ai_worker_stats
+from app.answer_cache import get_answer_cache_stats
 Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="WhatsApp Automation Admin")
@@ -23,16 +38,61 @@ scheduler.add_job(
     hour=8,        # Runs every day at 8am
     minute=0
 )
+scheduler.add_job(
+    revalidate_tokens,
+    'interval',
+    minutes=TOKEN_REVALIDATE_MINUTES   # clears token flags once a token works again
+)
 scheduler.start()
 
+@app.on_event("startup")
+def start_tenant_cache_listener():
+    start_invalidation_listener()
+
+@app.on_event("startup")
+def start_graph_retry_worker():
+    start_send_retry_worker()
+
 @app.on_event("shutdown")
 def shutdown_scheduler():
     scheduler.shutdown()
+
+@app.on_event("shutdown")
+def shutdown_graph_client():
+    stop_send_retry_worker()
+    close_graph_client()
+
+@app.on_event("shutdown")
+def shutdown_ai_client():
+    close_ai_client()
+
+@app.on_event("shutdown")
+def flush_message_logs():
+    close_log_writer()
 @app.get("/test-subscription-check/")
 async def test_subscription_check():
     from app.subscription_checker import run_subscription_checks
     run_subscription_checks()
     return {"status": "check complete — see terminal for results"}
+@app.get("/stats/")
+def stats():
+    depths = get_lane_depths()
+    return {
+        "tenant_cache":     get_cache_stats(),
+        "graph_api":        get_graph_stats(),
+        "dedup":            get_dedup_stats(),
+        "message_log":      get_log_writer_stats(),
+        "lanes":            {"lanes": len(depths), "depth": depths, "total": sum(depths)},
+        "rate_limit":       get_rate_limit_stats(),
+        "circuit_breakers": {"breakers": get_breaker_stats(), "graph_retry_pending": get_retry_depth()},
+        "token_health":     get_token_health_stats(),
+        "media_cache":      get_media_cache_stats(),
+        "ai":               {"slots": get_ai_slot_stats(), "stage": get_ai_worker_stats()},
+        "ai_answer_cache":  get_answer_cache_stats(),
+    }
+@app.get("/metrics")
+def metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
 @app.get("/")
 def root():
     return {"status": "running"}
\ No newline at end of file
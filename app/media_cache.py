@@ -0,0 +1,222 @@
+"""
+WhatsApp media ids for product images.
+
+Sending an image by `link` makes Meta download it from Cloudinary for every
+single product view. Each product image is now uploaded once per phone
+number to /{phone_number_id}/media and sends use the returned media id.
+
+  • the send path never waits for an upload: an image without a cached
+    media id goes out by link once while a background thread uploads it
+  • media ids are stored in whatsapp_media with their expiry (Meta keeps
+    uploads for 30 days) so every worker and restart reuses them
+  • the key is the image URL — a product whose image changes gets a new
+    Cloudinary URL and is uploaded again; expired ids are re-uploaded
+  • a media id Graph refuses is dropped from memory at once; the row is
+    deleted by the same background thread, ahead of the re-upload
+"""
+import os
+import queue
+import re
+import threading
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy.exc import IntegrityError
+
+from app import graph_client, models
+from app.database import SessionLocal
+from app.logging_config import get_logger
+from app.metrics import Counter
+
+MEDIA_TTL_DAYS       = int(os.getenv("MEDIA_TTL_DAYS", 29))              # Meta deletes uploads after 30 days
+MEDIA_MAX_BYTES      = int(os.getenv("MEDIA_MAX_BYTES", 5 * 1024 * 1024))  # WhatsApp image limit
+MEDIA_RETRY_MINUTES  = int(os.getenv("MEDIA_RETRY_MINUTES", 10))         # after a failed upload
+MEDIA_CACHE_DISABLED = os.getenv("MEDIA_CACHE_DISABLED", "0").lower() in ("1", "true", "yes")
+
+# Graph errors meaning the media id itself is unusable
+MEDIA_ERROR_CODES = {131052, 131053}
+
+logger = get_logger("media_cache")
+
+MEDIA_LOOKUPS = Counter(
+    "botmart_media_cache_total",
+    "Product image sends by media cache result (hit, miss) and uploads (uploaded, upload_failed)",
+    ["result"],
+)
+
+_lock      = threading.Lock()
+_cache     = {}       # (phone_number_id, image_url) -> (media_id or None after a failure, expires_at)
+_queued    = set()    # keys waiting for the upload thread
+_jobs      = queue.SimpleQueue()   # (function, args) for the background thread, in order
+_thread    = None
+
+
+def whatsapp_image_url(image_url):
+    """WhatsApp rejects avif/webp — have Cloudinary serve a jpg instead."""
+    if 'cloudinary.com' in image_url:
+        return re.sub(r'\.(avif|webp|png|gif)$', '.jpg', image_url)
+    return image_url
+
+
+# ─────────────────────────────────────────────
+# SEND PATH
+# ─────────────────────────────────────────────
+
+def get_media_id(phone_number_id, access_token, image_url):
+    """
+    Cached media id for the image, or None — the caller sends the link and
+    the upload is queued.
+    """
+    if MEDIA_CACHE_DISABLED:
+        return None
+
+    key = (phone_number_id, image_url)
+    with _lock:
+        entry = _cache.get(key)
+        if entry and entry[1] > datetime.utcnow():
+            MEDIA_LOOKUPS.inc(result="hit" if entry[0] else "miss")
+            return entry[0]
+        queued = key in _queued
+        _queued.add(key)
+
+    MEDIA_LOOKUPS.inc(result="miss")
+    if not queued:
+        _jobs.put((_refresh, (phone_number_id, access_token, image_url)))
+        _start()
+    return None
+
+
+def forget_media(phone_number_id, image_url):
+    """Drop a media id Graph refused, so the next send re-uploads. The DB delete happens in the background."""
+    with _lock:
+        _cache.pop((phone_number_id, image_url), None)
+    _jobs.put((_delete, (phone_number_id, image_url)))
+    _start()
+
+
+# ─────────────────────────────────────────────
+# BACKGROUND UPLOADS
+# ─────────────────────────────────────────────
+
+def _stored(db, phone_number_id, image_url):
+    return db.query(models.WhatsAppMedia).filter(
+        models.WhatsAppMedia.phone_number_id == phone_number_id,
+        models.WhatsAppMedia.image_url == image_url,
+    ).first()
+
+
+def _upload(phone_number_id, access_token, image_url):
+    """Download the image and upload it to the number's media store. Returns the media id."""
+    download = httpx.get(
+        whatsapp_image_url(image_url), timeout=graph_client.GRAPH_READ_TIMEOUT, follow_redirects=True
+    )
+    download.raise_for_status()
+    if len(download.content) > MEDIA_MAX_BYTES:
+        raise ValueError(f"image is {len(download.content)} bytes, over the {MEDIA_MAX_BYTES} limit")
+
+    mime_type = download.headers.get("content-type", "image/jpeg").split(";")[0]
+    response  = graph_client.post(
+        f"/{phone_number_id}/media",
+        access_token,
+        data={"messaging_product": "whatsapp", "type": mime_type},
+        files={"file": ("product.jpg", download.content, mime_type)},
+    )
+    result = response.json()
+    if "id" not in result:
+        raise ValueError(f"media upload rejected: {result.get('error', result)}")
+    return result["id"]
+
+
+def _delete(phone_number_id, image_url):
+    db = SessionLocal()
+    try:
+        db.query(models.WhatsAppMedia).filter(
+            models.WhatsAppMedia.phone_number_id == phone_number_id,
+            models.WhatsAppMedia.image_url == image_url,
+        ).delete()
+        db.commit()
+    except Exception:
+        logger.exception("Could not forget media id", extra={"phone_number_id": phone_number_id})
+    finally:
+        db.close()
+
+
+def _resolve(phone_number_id, access_token, image_url):
+    now = datetime.utcnow()
+    db  = SessionLocal()
+    try:
+        row = _stored(db, phone_number_id, image_url)
+        if row and row.expires_at > now:
+            return row.media_id, row.expires_at
+
+        media_id   = _upload(phone_number_id, access_token, image_url)
+        expires_at = now + timedelta(days=MEDIA_TTL_DAYS)
+        MEDIA_LOOKUPS.inc(result="uploaded")
+
+        try:
+            if row:
+                row.media_id   = media_id
+                row.expires_at = expires_at
+            else:
+                db.add(models.WhatsAppMedia(
+                    phone_number_id=phone_number_id, image_url=image_url,
+                    media_id=media_id, expires_at=expires_at,
+                ))
+            # Ids of replaced images are never sent again
+            db.query(models.WhatsAppMedia).filter(
+                models.WhatsAppMedia.phone_number_id == phone_number_id,
+                models.WhatsAppMedia.expires_at < now,
+            ).delete()
+            db.commit()
+        except IntegrityError:
+            # Another worker uploaded it at the same time — use theirs
+            db.rollback()
+            row = _stored(db, phone_number_id, image_url)
+            return row.media_id, row.expires_at
+
+        logger.info("Uploaded product image", extra={"phone_number_id": phone_number_id, "media_id": media_id})
+        return media_id, expires_at
+    finally:
+        db.close()
+
+
+def _refresh(phone_number_id, access_token, image_url):
+    key = (phone_number_id, image_url)
+    try:
+        entry = _resolve(phone_number_id, access_token, image_url)
+        with _lock:
+            _cache[key] = entry
+    except Exception as e:
+        MEDIA_LOOKUPS.inc(result="upload_failed")
+        with _lock:
+            _cache[key] = (None, datetime.utcnow() + timedelta(minutes=MEDIA_RETRY_MINUTES))
+        logger.warning("Product image upload failed, sending by link",
+                       extra={"phone_number_id": phone_number_id, "image_url": image_url, "error": str(e)})
+    finally:
+        with _lock:
+            _queued.discard(key)
+
+
+def _run():
+    while True:
+        job, args = _jobs.get()
+        try:
+            job(*args)
+        except Exception:
+            logger.exception("Media cache job failed")
+
+
+def _start():
+    global _thread
+    if _thread is not None:
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_run, name="media-uploader", daemon=True)
+        _thread.start()
+
+
+def get_media_cache_stats():
+    with _lock:
+        return {"cached": len(_cache), "uploading": len(_queued)}
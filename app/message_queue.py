@@ -0,0 +1,295 @@
+"""
+Durable queue between the webhook ingress and the processing workers.
+
+The webhook appends the raw Meta payload and returns 200; `python -m
+app.worker` processes it. The backend is picked with
+MESSAGE_QUEUE_BACKEND:
+
+  • "redis"    — a Redis stream with a consumer group (needs REDIS_URL)
+  • "postgres" — the webhook_queue table, claimed with FOR UPDATE SKIP LOCKED
+  • "inline"   — no queue, the web process runs the payload on its lane threads (default)
+
+Both durable backends give each claimed job a visibility timeout: a job
+that is not acked in time (worker crashed, node lost) becomes claimable
+again. Jobs that fail MESSAGE_QUEUE_MAX_ATTEMPTS times are dead-lettered
+instead of retried forever.
+"""
+import json
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from app import models
+from app.database import SessionLocal
+from app.logging_config import get_logger
+from app.redis_client import get_redis
+
+MESSAGE_QUEUE_BACKEND      = os.getenv("MESSAGE_QUEUE_BACKEND", "inline").lower()
+MESSAGE_QUEUE_VISIBILITY   = int(os.getenv("MESSAGE_QUEUE_VISIBILITY", 60))   # seconds
+MESSAGE_QUEUE_MAX_ATTEMPTS = int(os.getenv("MESSAGE_QUEUE_MAX_ATTEMPTS", 5))
+
+INBOUND_QUEUE = "webhook:inbound"
+
+logger = get_logger("message_queue")
+
+
+class QueueJob:
+    def __init__(self, id, payload, attempts):
+        self.id       = id
+        self.payload  = payload
+        self.attempts = attempts
+
+
+# ─────────────────────────────────────────────
+# REDIS STREAM BACKEND
+# ─────────────────────────────────────────────
+
+class RedisStreamQueue:
+    GROUP         = "webhook-workers"
+    LANE_CONSUMER = "lane-owner"
+
+    def __init__(self, name, redis_client):
+        self.stream   = f"botmart:{name}"
+        self.dead     = f"botmart:{name}:dead"
+        self.redis    = redis_client
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        try:
+            self.redis.xgroup_create(self.stream, self.GROUP, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def enqueue(self, payload):
+        return self.redis.xadd(self.stream, {"payload": json.dumps(payload)})
+
+    def claim(self, count=10, block_ms=2000):
+        jobs = []
+
+        # Jobs another consumer took but never acked within the visibility timeout
+        stale = self.redis.xautoclaim(
+            self.stream, self.GROUP, self.consumer,
+            min_idle_time=MESSAGE_QUEUE_VISIBILITY * 1000,
+            start_id="0-0", count=count,
+        )[1]
+        for entry_id, fields in stale:
+            if not fields:
+                continue  # trimmed while pending
+            pending  = self.redis.xpending_range(self.stream, self.GROUP, entry_id, entry_id, 1)
+            attempts = pending[0]["times_delivered"] if pending else 1
+            jobs.append(QueueJob(entry_id, json.loads(fields["payload"]), attempts))
+
+        if len(jobs) < count:
+            fresh = self.redis.xreadgroup(
+                self.GROUP, self.consumer, {self.stream: ">"},
+                count=count - len(jobs), block=block_ms if not jobs else None,
+            )
+            for _, entries in fresh or []:
+                for entry_id, fields in entries:
+                    jobs.append(QueueJob(entry_id, json.loads(fields["payload"]), 1))
+
+        return self._drop_exhausted(jobs)
+
+    def _drop_exhausted(self, jobs):
+        live = []
+        for job in jobs:
+            if job.attempts > MESSAGE_QUEUE_MAX_ATTEMPTS:
+                self.dead_letter(job)
+            else:
+                live.append(job)
+        return live
+
+    def claim_head(self, block_ms=1000):
+        """
+        Next job in stream order, redelivering an un-acked head first.
+        Only call while holding the lane lease — all lane owners share one
+        consumer name so a new owner picks up where a crashed one stopped.
+        A head delivered more than MESSAGE_QUEUE_MAX_ATTEMPTS times (its
+        workers died on it) is dead-lettered instead of wedging the lane.
+        """
+        while True:
+            job = self._read_head(block_ms)
+            if job is None or job.attempts <= MESSAGE_QUEUE_MAX_ATTEMPTS:
+                return job
+            self.dead_letter(job)
+
+    def _read_head(self, block_ms):
+        for start in ("0", ">"):
+            entries = self.redis.xreadgroup(
+                self.GROUP, self.LANE_CONSUMER, {self.stream: start},
+                count=1, block=block_ms if start == ">" else None,
+            )
+            for _, items in entries or []:
+                for entry_id, fields in items:
+                    if not fields:
+                        # Pending entry that no longer exists in the stream
+                        self.redis.xack(self.stream, self.GROUP, entry_id)
+                        continue
+                    attempts = 1
+                    if start == "0":
+                        # Reading the pending history counts as another delivery
+                        pending  = self.redis.xpending_range(self.stream, self.GROUP, entry_id, entry_id, 1)
+                        attempts = pending[0]["times_delivered"] if pending else 1
+                    return QueueJob(entry_id, json.loads(fields["payload"]), attempts)
+        return None
+
+    def dead_letter(self, job):
+        logger.error("Dead-lettering job", extra={"job_id": job.id, "queue": self.stream})
+        self.redis.xadd(self.dead, {"payload": json.dumps(job.payload)})
+        self.ack(job)
+
+    def ack(self, job):
+        pipe = self.redis.pipeline()
+        pipe.xack(self.stream, self.GROUP, job.id)
+        pipe.xdel(self.stream, job.id)
+        pipe.execute()
+
+    def fail(self, job):
+        # Leave it pending — xautoclaim hands it out again after the timeout
+        pass
+
+    def depth(self):
+        return self.redis.xlen(self.stream)
+
+
+# ─────────────────────────────────────────────
+# POSTGRES SKIP LOCKED BACKEND
+# ─────────────────────────────────────────────
+
+class PostgresQueue:
+    def __init__(self, name):
+        self.name = name
+
+    def enqueue(self, payload):
+        db = SessionLocal()
+        try:
+            job = models.QueuedWebhook(queue=self.name, payload=json.dumps(payload))
+            db.add(job)
+            db.commit()
+            return job.id
+        finally:
+            db.close()
+
+    def claim(self, count=10, block_ms=None):
+        db = SessionLocal()
+        try:
+            now  = datetime.utcnow()
+            rows = db.query(models.QueuedWebhook).filter(
+                models.QueuedWebhook.queue == self.name,
+                models.QueuedWebhook.dead_at == None,
+                models.QueuedWebhook.visible_at <= now
+            ).order_by(models.QueuedWebhook.id).limit(count).with_for_update(skip_locked=True).all()
+
+            jobs = []
+            for row in rows:
+                row.attempts += 1
+                if row.attempts > MESSAGE_QUEUE_MAX_ATTEMPTS:
+                    logger.error("Dead-lettering job", extra={
+                        "job_id": row.id, "queue": self.name, "attempts": row.attempts - 1,
+                    })
+                    row.dead_at = now
+                    continue
+                # Hidden from other workers until acked or the timeout passes
+                row.visible_at = now + timedelta(seconds=MESSAGE_QUEUE_VISIBILITY)
+                jobs.append(QueueJob(row.id, json.loads(row.payload), row.attempts))
+            db.commit()
+            return jobs
+        finally:
+            db.close()
+
+    def claim_head(self, block_ms=None):
+        """
+        Oldest live job, whatever its visibility. Only call while holding the
+        lane lease. A head claimed more than MESSAGE_QUEUE_MAX_ATTEMPTS times
+        (its workers died on it) is dead-lettered instead of wedging the lane.
+        """
+        db = SessionLocal()
+        try:
+            while True:
+                row = db.query(models.QueuedWebhook).filter(
+                    models.QueuedWebhook.queue == self.name,
+                    models.QueuedWebhook.dead_at == None
+                ).order_by(models.QueuedWebhook.id).first()
+                if not row:
+                    return None
+                row.attempts += 1
+                if row.attempts > MESSAGE_QUEUE_MAX_ATTEMPTS:
+                    logger.error("Dead-lettering job", extra={
+                        "job_id": row.id, "queue": self.name, "attempts": row.attempts - 1,
+                    })
+                    row.dead_at = datetime.utcnow()
+                    db.commit()
+                    continue
+                db.commit()
+                return QueueJob(row.id, json.loads(row.payload), row.attempts)
+        finally:
+            db.close()
+
+    def dead_letter(self, job):
+        logger.error("Dead-lettering job", extra={"job_id": job.id, "queue": self.name})
+        db = SessionLocal()
+        try:
+            db.query(models.QueuedWebhook).filter(models.QueuedWebhook.id == job.id).update({
+                models.QueuedWebhook.dead_at: datetime.utcnow()
+            })
+            db.commit()
+        finally:
+            db.close()
+
+    def ack(self, job):
+        db = SessionLocal()
+        try:
+            db.query(models.QueuedWebhook).filter(models.QueuedWebhook.id == job.id).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def fail(self, job):
+        # Retry with a linear backoff instead of waiting out the full timeout
+        db = SessionLocal()
+        try:
+            db.query(models.QueuedWebhook).filter(models.QueuedWebhook.id == job.id).update({
+                models.QueuedWebhook.visible_at: datetime.utcnow() + timedelta(seconds=5 * job.attempts)
+            })
+            db.commit()
+        finally:
+            db.close()
+
+    def depth(self):
+        db = SessionLocal()
+        try:
+            return db.query(models.QueuedWebhook).filter(
+                models.QueuedWebhook.queue == self.name,
+                models.QueuedWebhook.dead_at == None
+            ).count()
+        finally:
+            db.close()
+
+
+# ─────────────────────────────────────────────
+# FACTORY
+# ─────────────────────────────────────────────
+
+_queues      = {}
+_queues_lock = threading.Lock()
+
+
+def queue_enabled():
+    return MESSAGE_QUEUE_BACKEND in ("redis", "postgres")
+
+
+def get_queue(name=INBOUND_QUEUE):
+    """Return the configured durable queue, or None in inline mode."""
+    if not queue_enabled():
+        return None
+
+    with _queues_lock:
+        if name not in _queues:
+            if MESSAGE_QUEUE_BACKEND == "redis":
+                r = get_redis()
+                if r is None:
+                    raise RuntimeError("MESSAGE_QUEUE_BACKEND=redis needs REDIS_URL")
+                _queues[name] = RedisStreamQueue(name, r)
+            else:
+                _queues[name] = PostgresQueue(name)
+        return _queues[name]
@@ -0,0 +1,144 @@
+"""
+Prometheus metrics for the webhook engine.
+
+Metrics live in prometheus_client's default registry and are served in the
+Prometheus text format at GET /metrics (FastAPI) or on METRICS_PORT
+(app.worker). The classes here are thin wrappers that take label values as
+keyword arguments, so a sample is recorded in one call:
+
+    with STAGE_SECONDS.time(stage="dedup"):
+        ...
+    MESSAGES_TOTAL.inc(client_id=client.id)
+
+GaugeCallback reads its value when Prometheus scrapes, for queue depths
+and other state that is cheaper to look at than to keep updated.
+"""
+import os
+
+import prometheus_client
+from prometheus_client.core import GaugeMetricFamily
+
+from app.logging_config import get_logger
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # app.worker only; 0 = disabled
+
+# Seconds — spans cache hits (µs) up to slow Claude replies
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+REGISTRY     = prometheus_client.REGISTRY
+
+# *_created series double the output and nothing here reads them
+prometheus_client.disable_created_metrics()
+
+logger = get_logger("metrics")
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name    = name
+        self._metric = prometheus_client.Counter(name, documentation, labelnames, registry=REGISTRY)
+
+    def inc(self, amount=1, **labels):
+        (self._metric.labels(**labels) if labels else self._metric).inc(amount)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name    = name
+        self._metric = prometheus_client.Histogram(
+            name, documentation, labelnames, buckets=buckets, registry=REGISTRY
+        )
+
+    def _series(self, labels):
+        return self._metric.labels(**labels) if labels else self._metric
+
+    def observe(self, value, **labels):
+        self._series(labels).observe(value)
+
+    def time(self, **labels):
+        """Context manager observing the seconds spent inside it."""
+        return self._series(labels).time()
+
+
+class GaugeCallback:
+    """
+    Gauge read at scrape time. `fn` returns a number, or a dict mapping
+    label-value tuples to numbers when the gauge has labels.
+    """
+
+    def __init__(self, name, documentation, fn, labelnames=()):
+        self.name       = name
+        self.doc        = documentation
+        self.fn         = fn
+        self.labelnames = list(labelnames)
+        REGISTRY.register(self)
+
+    def describe(self):
+        # Lets the registry check names without calling fn at import time
+        return [GaugeMetricFamily(self.name, self.doc, labels=self.labelnames)]
+
+    def collect(self):
+        try:
+            values = self.fn()
+        except Exception:
+            logger.exception("Could not collect metric", extra={"metric": self.name})
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        family = GaugeMetricFamily(self.name, self.doc, labels=self.labelnames)
+        for key, value in sorted(values.items()):
+            family.add_metric([str(part) for part in key], value)
+        yield family
+
+
+def render_metrics():
+    return prometheus_client.generate_latest(REGISTRY).decode()
+
+
+# ─────────────────────────────────────────────
+# WEBHOOK ENGINE METRICS
+# ─────────────────────────────────────────────
+
+STAGE_SECONDS = Histogram(
+    "botmart_message_stage_seconds",
+    "Time spent in each stage of inbound message processing",
+    ["stage"],
+)
+MESSAGES_TOTAL = Counter(
+    "botmart_messages_total",
+    "Inbound messages processed, per tenant",
+    ["client_id"],
+)
+GRAPH_ERRORS = Counter(
+    "botmart_graph_errors_total",
+    "Failed Graph API calls by HTTP status, or 'transport' for timeouts and connection errors",
+    ["code"],
+)
+ANTHROPIC_ERRORS = Counter(
+    "botmart_anthropic_errors_total",
+    "Failed Anthropic API calls by HTTP status, 'timeout', 'connection' or 'exception'",
+    ["code"],
+)
+GRAPH_THROTTLED = Counter(
+    "botmart_graph_throttled_total",
+    "Graph throttling errors that paused a phone number's sends",
+    ["phone_number_id"],
+)
+RATE_LIMIT_WAIT = Histogram(
+    "botmart_graph_rate_limit_wait_seconds",
+    "Time a send waited for its phone number's rate-limit token",
+)
+
+
+# ─────────────────────────────────────────────
+# STANDALONE EXPORTER (app.worker)
+# ─────────────────────────────────────────────
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics from a daemon thread. No-op when port is 0."""
+    if not port:
+        return None
+    server, _ = prometheus_client.start_http_server(port, registry=REGISTRY)
+    logger.info("Serving /metrics", extra={"port": port})
+    return server
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text, Index, Sequence, func
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -23,6 +23,7 @@ class Client(Base):
     messages = relationship("MessageLog", back_populates="client")
     message_template = relationship("MessageTemplate", back_populates="client", uselist=False)
     token_valid = Column(Boolean, default=True)
+    token_error_code = Column(Integer, nullable=True)  # Graph error code that set token_valid=False
     plan = Column(String, default="starter")
     payment_status = Column(String, default="unpaid")  # unpaid, paid, failed
     payment_reference = Column(String, nullable=True)
@@ -36,6 +37,7 @@ class Client(Base):
     ai_replies_used = Column(Integer, default=0)
     ai_replies_reset_date = Column(Date, nullable=True)
     business_description = Column(Text, nullable=True)
+    timezone = Column(String, default="Africa/Lagos")  # business hours are in this zone
 class AutoReplyRule(Base):
     __tablename__ = "auto_reply_rules"
 
@@ -70,9 +72,17 @@ class Contact(Base):
     phone_number = Column(String, nullable=False)
     opted_out = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    first_seen_at = Column(DateTime, nullable=True)  # first logged inbound message
+    last_seen_at = Column(DateTime, nullable=True)
 
     client = relationship("Client", back_populates="contacts")
 
+# Mirrors core/migrations/0007 — target of the webhook's ON CONFLICT upsert
+Index("contacts_client_phone_uniq", Contact.client_id, Contact.phone_number, unique=True)
+
+# Mirrors core/migrations/0013 — numbers for auto-named contacts, shared by all tenants
+CONTACT_NAME_SEQ = Sequence("contact_name_seq", metadata=Base.metadata)
+
 class Broadcast(Base):
     __tablename__ = "broadcasts"
 
@@ -117,6 +127,13 @@ class Product(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     client = relationship("Client", back_populates="products")
+
+
+# Mirrors core/migrations/0005 — category lookups are case-insensitive
+Index("products_client_lower_cat_idx", Product.client_id, func.lower(Product.category))
+Index("products_client_keyword_idx", Product.client_id, Product.keyword)
+
+
 class MessageTemplate(Base):
     __tablename__ = "message_templates"
 
@@ -146,3 +163,51 @@ class SubscriptionPlan(Base):
     discount_3_months  = Column(Integer, default=10)   # 10% off
     discount_6_months  = Column(Integer, default=15)   # 15% off  
     discount_12_months = Column(Integer, default=20)   # 20% off
+
+
+
+class QueuedWebhook(Base):
+    """Inbound webhook payload waiting for a worker (MESSAGE_QUEUE_BACKEND=postgres)."""
+    __tablename__ = "webhook_queue"
+
+    id         = Column(Integer, primary_key=True)
+    queue      = Column(String, nullable=False, default="webhook:inbound")
+    payload    = Column(Text, nullable=False)
+    attempts   = Column(Integer, default=0, nullable=False)
+    visible_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    dead_at    = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+Index("webhook_queue_claim_idx", QueuedWebhook.queue, QueuedWebhook.visible_at, QueuedWebhook.id)
+
+
+class WhatsAppMedia(Base):
+    """
+    A product image uploaded to a phone number's WhatsApp media store, so
+    sends can reference its media id instead of making Meta fetch the link.
+    """
+    __tablename__ = "whatsapp_media"
+
+    id              = Column(Integer, primary_key=True)
+    phone_number_id = Column(String, nullable=False)
+    image_url       = Column(Text, nullable=False)
+    media_id        = Column(String, nullable=False)
+    expires_at      = Column(DateTime, nullable=False)
+    created_at      = Column(DateTime, default=datetime.utcnow)
+
+
+Index("whatsapp_media_number_url_uniq", WhatsAppMedia.phone_number_id, WhatsAppMedia.image_url, unique=True)
+
+
+class AIUsageDaily(Base):
+    """AI replies per tenant per day — the plan limit is checked against today's row."""
+    __tablename__ = "ai_usage_daily"
+
+    id        = Column(Integer, primary_key=True)
+    client_id = Column(Integer, ForeignKey("clients.id"), nullable=False)
+    day       = Column(Date, nullable=False)
+    replies   = Column(Integer, nullable=False, default=0)
+
+
+Index("ai_usage_daily_client_day_uniq", AIUsageDaily.client_id, AIUsageDaily.day, unique=True)
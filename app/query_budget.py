@@ -0,0 +1,93 @@
+"""
+Per-message SQL query budget.
+
+Counts the statements a code path sends through the engine and compares
+them with a declared budget, so an extra lookup sneaking into the webhook
+hot path shows up straight away instead of as a slow dashboard weeks later.
+
+QUERY_BUDGET_MODE:
+  • "off"    — nothing is counted (default, no overhead)
+  • "warn"   — over-budget paths are logged
+  • "strict" — over-budget paths raise QueryBudgetExceeded; use in tests
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app.database import engine
+from app.logging_config import get_logger
+
+QUERY_BUDGET_MODE    = os.getenv("QUERY_BUDGET_MODE", "off").lower()
+MESSAGE_QUERY_BUDGET = int(os.getenv("MESSAGE_QUERY_BUDGET", 12))  # statements per inbound message
+
+logger = get_logger("query_budget")
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counters = getattr(_local, "counters", None)
+    if counters:
+        for counter in counters:
+            counter.queries += 1
+            counter.statements.append(statement)
+
+
+if QUERY_BUDGET_MODE != "off":
+    event.listen(engine, "before_cursor_execute", _count_statement)
+
+
+class QueryCounter:
+    """Statements counted inside a query_budget block."""
+
+    def __init__(self, limit, label):
+        self.limit      = limit
+        self.label      = label
+        self.queries    = 0
+        self.statements = []
+        self.checked    = False
+
+    def check(self):
+        """
+        Enforce the budget now. Call it before committing, so a strict-mode
+        failure rolls the work back instead of surfacing after the commit.
+        """
+        self.checked = True
+        if QUERY_BUDGET_MODE == "off" or self.queries <= self.limit:
+            return
+        if QUERY_BUDGET_MODE == "strict":
+            raise QueryBudgetExceeded(
+                f"{self.label} ran {self.queries} queries (budget {self.limit}):\n" + "\n".join(self.statements)
+            )
+        logger.warning("Query budget exceeded", extra={"label": self.label, "queries": self.queries, "budget": self.limit})
+
+
+@contextmanager
+def query_budget(limit, label):
+    """
+    Count SQL statements issued on this thread inside the block.
+    Yields the QueryCounter; the budget is enforced by counter.check(), or
+    when the block exits if it wasn't checked inside it.
+    """
+    counter = QueryCounter(limit, label)
+    if QUERY_BUDGET_MODE == "off":
+        yield counter
+        return
+
+    counters = getattr(_local, "counters", None)
+    if counters is None:
+        counters = _local.counters = []
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+    if not counter.checked:
+        counter.check()
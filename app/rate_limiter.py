@@ -0,0 +1,290 @@
+"""
+Outbound send rate limiting per WhatsApp phone number.
+
+Meta caps how many messages a business number may send per second (its
+throughput tier) and answers anything above that with throttling errors.
+Every POST to /{phone_number_id}/messages first takes a token from that
+number's bucket:
+
+  • buckets live in Redis (one Lua call per send) so web processes and
+    app.worker processes share the budget; without Redis, or if Redis is
+    unreachable, each process keeps its own bucket
+  • a send that finds the bucket empty waits for its token, but only up
+    to GRAPH_SEND_MAX_WAIT — lane and worker threads never sleep through
+    a long wait. A send that can't go out in time raises SendThrottled
+    and the caller hands it to the deferred-send queue (app/send_retry.py)
+  • when Graph still answers with a throttling code, sends are paused
+    with exponential backoff and the throttled send is deferred. Error
+    131056 is the business→user pair limit, so it pauses sends to that
+    one recipient; the other codes pause the whole number
+"""
+import os
+import random
+import threading
+import time
+
+from app.logging_config import get_logger
+from app.metrics import GRAPH_THROTTLED, RATE_LIMIT_WAIT
+from app.redis_client import get_redis
+
+GRAPH_SEND_RATE          = float(os.getenv("GRAPH_SEND_RATE", 80))        # messages/second per number (Meta default tier)
+GRAPH_SEND_BURST         = float(os.getenv("GRAPH_SEND_BURST", 0)) or None  # bucket size, defaults to one second of rate
+GRAPH_SEND_RATES         = os.getenv("GRAPH_SEND_RATES", "")              # per-number tiers, "PNID=250,PNID2=1000"
+GRAPH_SEND_MAX_WAIT      = float(os.getenv("GRAPH_SEND_MAX_WAIT", 1))      # seconds a send may wait for a token before it is deferred
+GRAPH_THROTTLE_BACKOFF   = float(os.getenv("GRAPH_THROTTLE_BACKOFF", 1))   # first pause after a throttling error
+GRAPH_THROTTLE_MAX_PAUSE = float(os.getenv("GRAPH_THROTTLE_MAX_PAUSE", 60))
+
+# Graph error codes that mean "slow down" rather than "this send is wrong"
+#   4       application request limit      80007  WABA rate limit
+#   130429  throughput reached             131056 pair (business→user) rate limit
+#   613     calls per hour exceeded
+THROTTLE_CODES    = {4, 613, 80007, 130429, 131056}
+PAIR_THROTTLE_CODE = 131056
+
+logger = get_logger("rate_limiter")
+
+
+class SendThrottled(Exception):
+    """Raised instead of sending when the number (or recipient) can't send for `wait` seconds."""
+
+    def __init__(self, phone_number_id, wait):
+        super().__init__(f"sends from {phone_number_id} throttled for {wait:.3f}s")
+        self.phone_number_id = phone_number_id
+        self.wait            = wait
+
+
+def _parse_rates(spec):
+    rates = {}
+    for item in spec.split(","):
+        key, sep, value = item.partition("=")
+        if sep and key.strip():
+            rates[key.strip()] = float(value)
+    return rates
+
+
+_tier_rates = _parse_rates(GRAPH_SEND_RATES)
+
+
+def rate_for(phone_number_id):
+    """(rate per second, burst) for a number."""
+    rate = _tier_rates.get(str(phone_number_id), GRAPH_SEND_RATE)
+    return rate, GRAPH_SEND_BURST or max(rate, 1)
+
+
+# ─────────────────────────────────────────────
+# SHARED BUCKETS (REDIS)
+# ─────────────────────────────────────────────
+
+# Returns 0 when a token was taken, otherwise milliseconds to wait.
+# KEYS[2] pauses the number, KEYS[3] the number's sends to one recipient.
+# Uses the Redis clock so every worker refills the bucket the same way.
+_TAKE_SCRIPT = """
+local paused = math.max(redis.call('pttl', KEYS[2]), redis.call('pttl', KEYS[3]))
+if paused > 0 then
+    return paused
+end
+
+local rate  = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('time')
+local now   = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts     = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('pexpire', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+
+def _bucket_key(phone_number_id):
+    return f"botmart:graph-rate:{phone_number_id}"
+
+
+def _pause_key(phone_number_id, recipient=None):
+    if recipient:
+        return f"botmart:graph-rate:{phone_number_id}:paused:{recipient}"
+    return f"botmart:graph-rate:{phone_number_id}:paused"
+
+
+def _strikes_key(phone_number_id, recipient=None):
+    return _pause_key(phone_number_id, recipient) + ":strikes"
+
+
+# ─────────────────────────────────────────────
+# LOCAL BUCKETS (NO REDIS)
+# ─────────────────────────────────────────────
+
+class _LocalBucket:
+    __slots__ = ("tokens", "ts", "paused_until")
+
+    def __init__(self, burst):
+        self.tokens       = burst
+        self.ts           = time.monotonic()
+        self.paused_until = 0.0
+
+
+_local         = {}
+_local_paused  = {}   # (phone_number_id, recipient) -> paused until (monotonic)
+_local_strikes = {}   # (phone_number_id, recipient) -> (throttling errors in a row, last at)
+_local_lock    = threading.Lock()
+
+
+def _take_local(phone_number_id, recipient, rate, burst):
+    now = time.monotonic()
+    with _local_lock:
+        bucket = _local.get(phone_number_id)
+        if bucket is None:
+            bucket = _local[phone_number_id] = _LocalBucket(burst)
+        paused_until = max(bucket.paused_until, _local_paused.get((phone_number_id, recipient), 0.0))
+        if paused_until > now:
+            return paused_until - now
+
+        bucket.tokens = min(burst, bucket.tokens + (now - bucket.ts) * rate)
+        bucket.ts     = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / rate
+
+
+def _take(phone_number_id, recipient=None):
+    """Take a token, or return the seconds to wait before trying again."""
+    rate, burst = rate_for(phone_number_id)
+    r = get_redis()
+    if r is not None:
+        try:
+            wait_ms = r.eval(
+                _TAKE_SCRIPT, 3,
+                _bucket_key(phone_number_id), _pause_key(phone_number_id), _pause_key(phone_number_id, recipient or "-"),
+                rate, burst,
+            )
+            return int(wait_ms) / 1000
+        except Exception as e:
+            logger.warning("Redis rate limiter unavailable, using local bucket", extra={"error": str(e)})
+    return _take_local(phone_number_id, recipient, rate, burst)
+
+
+def _strike(phone_number_id, recipient):
+    """Count a throttling error. Returns how many came in a row — the count resets after a quiet spell."""
+    quiet = int(GRAPH_THROTTLE_MAX_PAUSE * 2)
+    r = get_redis()
+    if r is not None:
+        try:
+            key  = _strikes_key(phone_number_id, recipient)
+            pipe = r.pipeline()
+            pipe.incr(key)
+            pipe.expire(key, quiet)
+            return int(pipe.execute()[0])
+        except Exception as e:
+            logger.warning("Redis rate limiter unavailable, counting locally", extra={"error": str(e)})
+
+    now = time.monotonic()
+    with _local_lock:
+        for key in [key for key, (_, last) in _local_strikes.items() if now - last >= quiet]:
+            del _local_strikes[key]
+        strikes, last = _local_strikes.get((phone_number_id, recipient), (0, now))
+        strikes = strikes + 1 if now - last < quiet else 1
+        _local_strikes[(phone_number_id, recipient)] = (strikes, now)
+    return strikes
+
+
+# ─────────────────────────────────────────────
+# PUBLIC API
+# ─────────────────────────────────────────────
+
+def acquire(phone_number_id, recipient=None, max_wait=GRAPH_SEND_MAX_WAIT):
+    """
+    Take a send token for the number, waiting at most max_wait for it.
+    Returns the seconds spent waiting. Raises SendThrottled, without
+    waiting, when the token (or the end of a pause) is further off than
+    that — the caller defers the send.
+    """
+    started  = time.monotonic()
+    deadline = started + max_wait
+    while True:
+        wait = _take(phone_number_id, recipient)
+        if wait <= 0:
+            break
+        if time.monotonic() + wait > deadline:
+            RATE_LIMIT_WAIT.observe(time.monotonic() - started)
+            raise SendThrottled(phone_number_id, wait)
+        time.sleep(wait)
+
+    waited = time.monotonic() - started
+    RATE_LIMIT_WAIT.observe(waited)
+    return waited
+
+
+def pause(phone_number_id, recipient=None):
+    """
+    Stop sends for a while after a throttling error: to one recipient when
+    `recipient` is given, otherwise all sends from the number. The pause
+    doubles with each throttling error in a row.
+    """
+    strikes = _strike(phone_number_id, recipient)
+    delay   = min(GRAPH_THROTTLE_MAX_PAUSE, GRAPH_THROTTLE_BACKOFF * (2 ** (strikes - 1)))
+    delay   = delay * random.uniform(0.8, 1.2)
+    GRAPH_THROTTLED.inc(phone_number_id=str(phone_number_id))
+    logger.warning("Graph throttled sends, pausing", extra={
+        "phone_number_id": phone_number_id, "recipient": recipient, "pause": round(delay, 3), "strikes": strikes,
+    })
+
+    r = get_redis()
+    if r is not None:
+        try:
+            r.set(_pause_key(phone_number_id, recipient), 1, px=max(1, int(delay * 1000)))
+            return delay
+        except Exception as e:
+            logger.warning("Redis rate limiter unavailable, pausing locally", extra={"error": str(e)})
+
+    rate, burst = rate_for(phone_number_id)
+    now   = time.monotonic()
+    until = now + delay
+    with _local_lock:
+        for key in [key for key, paused_until in _local_paused.items() if paused_until <= now]:
+            del _local_paused[key]
+        if recipient:
+            _local_paused[(phone_number_id, recipient)] = max(_local_paused.get((phone_number_id, recipient), 0.0), until)
+        else:
+            bucket = _local.setdefault(phone_number_id, _LocalBucket(burst))
+            bucket.paused_until = max(bucket.paused_until, until)
+    return delay
+
+
+def throttle_code(response):
+    """The Graph throttling code of a response (429 for a bare HTTP 429), or None when it isn't throttled."""
+    if response.status_code < 400:
+        return None
+    try:
+        code = response.json().get("error", {}).get("code")
+    except ValueError:
+        code = None
+    if code in THROTTLE_CODES:
+        return code
+    return 429 if response.status_code == 429 else None
+
+
+def get_rate_limit_stats():
+    with _local_lock:
+        local = {
+            pid: {"tokens": round(bucket.tokens, 2), "paused": bucket.paused_until > time.monotonic()}
+            for pid, bucket in _local.items()
+        }
+        paused_recipients = sum(until > time.monotonic() for until in _local_paused.values())
+    return {
+        "backend":      "redis" if get_redis() is not None else "local",
+        "default_rate": GRAPH_SEND_RATE,
+        "tier_rates":   _tier_rates,
+        "local":        local,
+        "local_paused_recipients": paused_recipients,
+    }
@@ -0,0 +1,28 @@
+import os
+import threading
+
+# Redis is optional for the FastAPI side — everything that uses it
+# falls back to in-process state when REDIS_URL is not set.
+try:
+    import redis
+except ImportError:
+    redis = None
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+_client      = None
+_client_lock = threading.Lock()
+
+
+def get_redis():
+    """Return a shared Redis client, or None if Redis is not configured."""
+    global _client
+
+    if not REDIS_URL or redis is None:
+        return None
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _client
@@ -0,0 +1,180 @@
+"""
+Pre-rendered bot replies.
+
+The welcome, menu, category listings and product details only change when
+the tenant's catalog, rules or MessageTemplate change, so they are rendered
+once per tenant snapshot (render_replies, called from TenantConfig) and the
+webhook sends the ready-made text. Anything that changes them already
+invalidates the snapshot, which renders a fresh ReplySet.
+"""
+
+
+# ─────────────────────────────────────────────
+# MESSAGE BUILDERS
+# ─────────────────────────────────────────────
+
+def get_greeting(business_name, products=None, rules=None):
+    categories = {}
+    if products:
+        for product in products:
+            cat = product.category or "Products"
+            if cat not in categories:
+                categories[cat] = cat
+
+    menu_items = ""
+    item_num   = 1
+
+    if categories:
+        for cat in categories.values():
+            menu_items += f"{item_num}️⃣ Type *{cat.lower()}* - Browse {cat}\n"
+            item_num += 1
+
+    if rules:
+        for rule in rules:
+            menu_items += f"{item_num}️⃣ Type *{rule.trigger_keyword}* - {rule.response_text[:30]}\n"
+            item_num += 1
+
+    menu_items += f"{item_num}️⃣ Type *menu* - See all options\n"
+    item_num   += 1
+    menu_items += f"{item_num}️⃣ Type *human* - Talk to an agent\n"
+
+    return (
+        f"👋 Welcome to *{business_name}*!\n\n"
+        f"We're glad you reached out. Here's what we offer:\n\n"
+        f"{menu_items}\n"
+        f"Just type any keyword above to get started! 😊"
+    )
+
+
+def get_menu(business_name, products=None, rules=None):
+    categories = {}
+    if products:
+        for product in products:
+            cat = product.category or "Products"
+            if cat not in categories:
+                categories[cat] = cat
+
+    menu_items = ""
+    item_num   = 1
+
+    if categories:
+        for cat in categories.values():
+            menu_items += f"{item_num}️⃣ Type *{cat.lower()}* - Browse {cat}\n"
+            item_num += 1
+
+    if rules:
+        for rule in rules:
+            menu_items += f"{item_num}️⃣ Type *{rule.trigger_keyword}* - Info\n"
+            item_num += 1
+
+    menu_items += f"{item_num}️⃣ Type *human* - Talk to an agent\n"
+
+    return (
+        f"📋 *{business_name} Menu*\n\n"
+        f"{menu_items}\n"
+        f"Type *menu* anytime to see this again."
+    )
+
+
+def get_fallback():
+    return (
+        "🤔 Sorry, I didn't quite understand that.\n\n"
+        "Type *menu* to see available options or *human* to speak with our team directly."
+    )
+
+
+def build_welcome(template, business_name, active_products, active_rules):
+    if template and template.welcome_message:
+        return template.welcome_message.replace("{business_name}", business_name)
+    return get_greeting(business_name, active_products, active_rules)
+
+
+def build_menu(template, business_name, active_products, active_rules):
+    if template and template.menu_message:
+        return template.menu_message.replace("{business_name}", business_name)
+    return get_menu(business_name, active_products, active_rules)
+
+
+def build_closed(template):
+    if template and template.closed_message:
+        return template.closed_message
+    return (
+        "🕐 *We're currently closed.*\n\n"
+        "Our team is not available right now but we'll get back to you "
+        "as soon as we open.\n\n"
+        "Type *hours* to see our working hours."
+    )
+
+
+def build_handoff(template):
+    if template and template.handoff_message:
+        return template.handoff_message
+    return (
+        "👤 *Connecting you to an agent...*\n\n"
+        "Please hold on, someone from our team will respond shortly.\n"
+        "Our working hours are Mon-Fri, 9am - 6pm."
+    )
+
+
+def build_fallback(template):
+    if template and template.fallback_message:
+        return template.fallback_message
+    return get_fallback()
+
+
+def get_category_listing(products):
+    category_name = products[0].category
+    product_list  = f"🛍️ *{category_name}*\n\n"
+    product_list += "Here are our available products:\n\n"
+    for p in products:
+        product_list += (
+            f"▪️ *{p.name}*\n"
+            f"   💰 {p.price}\n"
+            f"   Type *{p.keyword}* for details\n\n"
+        )
+    product_list += "Type the keyword next to any product to see full details!"
+    return product_list
+
+
+def get_product_detail(product):
+    return (
+        f"*{product.name}*\n\n"
+        f"{product.description}\n\n"
+        f"💰 {product.price}\n\n"
+        f"Type *order* to place an order or *menu* to see more options."
+    )
+
+
+# ─────────────────────────────────────────────
+# PER-SNAPSHOT REPLY SET
+# ─────────────────────────────────────────────
+
+class ReplySet:
+    """Ready-to-send replies for one tenant snapshot."""
+
+    def __init__(self, welcome, menu, closed, handoff, fallback, categories, products):
+        self.welcome    = welcome
+        self.menu       = menu
+        self.closed     = closed
+        self.handoff    = handoff
+        self.fallback   = fallback
+        self.categories = categories   # lowercased category -> listing text
+        self.products   = products     # keyword -> detail text (also the image caption)
+
+
+def render_replies(business_name, products, rules, template, products_by_category, products_by_keyword):
+    return ReplySet(
+        welcome    = build_welcome(template, business_name, products, rules),
+        menu       = build_menu(template, business_name, products, rules),
+        closed     = build_closed(template),
+        handoff    = build_handoff(template),
+        fallback   = build_fallback(template),
+        categories = {
+            category: get_category_listing(category_products)
+            for category, category_products in products_by_category.items()
+        },
+        products   = {
+            keyword: get_product_detail(product)
+            for keyword, product in products_by_keyword.items()
+        },
+    )
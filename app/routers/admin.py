@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from jose import jwt, JWTError
 from app.database import get_db
 from app import models
+from app.tenant_cache import invalidate_tenant
 import os
 
 router = APIRouter()
@@ -53,6 +54,7 @@ def add_rule(
     db.add(rule)
     db.commit()
     db.refresh(rule)
+    invalidate_tenant(current_client.phone_number_id, current_client.id)
     return {"message": "Rule added successfully", "rule_id": rule.id}
 
 
@@ -74,6 +76,7 @@ def delete_rule(rule_id: int, db: Session = Depends(get_db), current_client=Depe
         raise HTTPException(status_code=404, detail="Rule not found")
     db.delete(rule)
     db.commit()
+    invalidate_tenant(current_client.phone_number_id, current_client.id)
     return {"message": "Rule deleted"}
 
 
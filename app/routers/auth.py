@@ -6,6 +6,7 @@ from jose import jwt
 from datetime import datetime, timedelta
 from app.database import get_db
 from app import models
+from app.tenant_cache import invalidate_tenant
 import os
 
 router = APIRouter()
@@ -57,6 +58,8 @@ def register_client(
     db.add(client)
     db.commit()
     db.refresh(client)
+    # Clears any cached "unknown number" entry for this phone_number_id
+    invalidate_tenant(client.phone_number_id, client.id)
     return {"message": f"Client '{business_name}' registered successfully", "client_id": client.id}
 
 
@@ -3,9 +3,17 @@ from sqlalchemy.orm import Session
 from app.database import SessionLocal
 from app import models
 from app.routers.admin import get_current_client
-import requests
+from app import graph_client
+from app.contact_cache import invalidate_contact
+from app.logging_config import get_logger
+from app.circuit_breaker import CircuitOpenError
+from app.rate_limiter import SendThrottled
+from app.send_retry import defer_send
+from app import token_health
+import httpx
 
 router = APIRouter()
+logger = get_logger("broadcast")
 
 
 def get_db():
@@ -16,12 +24,14 @@ def get_db():
         pass
 
 
+# ── Outcomes of one broadcast send ──
+SENT     = "sent"
+DEFERRED = "deferred"   # handed to the retry worker — not sent yet
+FAILED   = "failed"
+
+
 def send_whatsapp_template(phone_number_id, access_token, recipient, template_name):
-    url = f"https://graph.facebook.com/v19.0/{phone_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    """Send one broadcast template. Returns SENT, DEFERRED or FAILED."""
     payload = {
         "messaging_product": "whatsapp",
         "to": recipient,
@@ -31,9 +41,27 @@ def send_whatsapp_template(phone_number_id, access_token, recipient, template_na
             "language": {"code": "en_US"}
         }
     }
-    response = requests.post(url, headers=headers, json=payload)
-    print(f"Broadcast send to {recipient}: {response.status_code}")
-    return response.status_code == 200
+    if token_health.is_blocked(phone_number_id, access_token):
+        return FAILED
+    try:
+        response = graph_client.post_message(phone_number_id, access_token, payload)
+    except (CircuitOpenError, SendThrottled):
+        # Graph is down or throttling — the retry worker sends it later
+        defer_send(phone_number_id, payload)
+        return DEFERRED
+    except httpx.HTTPError as e:
+        logger.error("Broadcast send failed", extra={"phone_number_id": phone_number_id, "recipient": recipient, "error": str(e)})
+        return FAILED
+
+    if response.status_code != 200:
+        logger.warning("Broadcast send rejected", extra={
+            "phone_number_id": phone_number_id, "recipient": recipient, "status": response.status_code,
+        })
+    else:
+        logger.info("Broadcast send", extra={
+            "phone_number_id": phone_number_id, "recipient": recipient, "status": response.status_code, "sample": True,
+        })
+    return SENT if response.status_code == 200 else FAILED
 
 
 def run_broadcast(broadcast_id: int):
@@ -47,19 +75,26 @@ def run_broadcast(broadcast_id: int):
         client = db.query(models.Client).filter(models.Client.id == broadcast.client_id).first()
         contacts = db.query(models.Contact).filter(models.Contact.client_id == broadcast.client_id).all()
 
+        token_health.observe(client)
+
         broadcast.status = "running"
         broadcast.total = len(contacts)
         db.commit()
 
+        deferred = 0
         for contact in contacts:
-            success = send_whatsapp_template(
+            outcome = send_whatsapp_template(
                 client.phone_number_id,
                 client.access_token,
                 contact.phone_number,
                 broadcast.template_name
             )
 
-            if success:
+            if outcome == DEFERRED:
+                # Not sent or failed yet — the retry worker sends it when Graph lets it
+                deferred += 1
+                continue
+            if outcome == SENT:
                 broadcast.sent += 1
                 db.add(models.MessageLog(
                     client_id=client.id,
@@ -74,10 +109,17 @@ def run_broadcast(broadcast_id: int):
 
         broadcast.status = "completed"
         db.commit()
-        print(f"Broadcast {broadcast_id} completed. Sent: {broadcast.sent}, Failed: {broadcast.failed}")
-
-    except Exception as e:
-        print(f"Broadcast error: {e}")
+        logger.info("Broadcast completed", extra={
+            "client_id": client.id, "broadcast_id": broadcast_id,
+            "sent": broadcast.sent, "failed": broadcast.failed, "deferred": deferred,
+        })
+        if deferred:
+            logger.warning("Broadcast sends deferred to the retry worker", extra={
+                "client_id": client.id, "broadcast_id": broadcast_id, "deferred": deferred,
+            })
+
+    except Exception:
+        logger.exception("Broadcast error", extra={"broadcast_id": broadcast_id})
     finally:
         db.close()
 
@@ -124,8 +166,10 @@ def delete_contact(contact_id: int, db: Session = Depends(get_db), current_clien
     ).first()
     if not contact:
         raise HTTPException(status_code=404, detail="Contact not found")
+    phone_number = contact.phone_number
     db.delete(contact)
     db.commit()
+    invalidate_contact(current_client.id, phone_number)
     return {"message": "Contact deleted"}
 
 
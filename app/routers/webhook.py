@@ -1,18 +1,41 @@
-from fastapi import APIRouter, Request, Query, BackgroundTasks
+from fastapi import APIRouter, Request, Query
 from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from app.database import SessionLocal
 from app import models
 from app.email import send_email_notification
-import requests
+from app.tenant_cache import get_tenant_config
+from app.dedup import claim_message, complete_message, release_message
+from app.log_writer import log_message, get_log_writer
+from app.query_budget import query_budget, MESSAGE_QUERY_BUDGET
+from app.contact_cache import ContactState, get_contacts, put_contact, forget_contact, invalidate_contact, CONTACT_CACHE_SIZE
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import graph_client
+from app.message_queue import get_queue
+from app.lanes import partition_messages, lane_queue_name, get_lane_executor
+from app.metrics import STAGE_SECONDS, MESSAGES_TOTAL
+from app.logging_config import get_logger
+from app.circuit_breaker import CircuitOpenError
+from app.rate_limiter import SendThrottled
+from app.send_retry import defer_send
+from app import token_health
+from app.media_cache import get_media_id, forget_media, whatsapp_image_url, MEDIA_ERROR_CODES
+from app import ai_worker
+import httpx
+import itertools
 import os
-import re
-import time
+import threading
+from collections import OrderedDict
 from datetime import datetime, date
-import pytz
+from functools import partial
 
 router = APIRouter()
+logger = get_logger("webhook")
 
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
+CONTACT_SEEN_RESOLUTION = int(os.getenv("CONTACT_SEEN_RESOLUTION", 300))  # seconds between last_seen_at writes
 
 
 # ─────────────────────────────────────────────
@@ -20,303 +43,352 @@ VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
 # ─────────────────────────────────────────────
 
 def send_whatsapp_message(phone_number_id, access_token, recipient, message):
-    url = f"https://graph.facebook.com/v19.0/{phone_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
     payload = {
         "messaging_product": "whatsapp",
         "to": recipient,
         "type": "text",
         "text": {"body": message}
     }
-    response = requests.post(url, headers=headers, json=payload)
+    if token_health.is_blocked(phone_number_id, access_token):
+        return None
+    try:
+        with STAGE_SECONDS.time(stage="graph_send"):
+            response = graph_client.post_message(phone_number_id, access_token, payload)
+    except (CircuitOpenError, SendThrottled):
+        defer_send(phone_number_id, payload)
+        return None
+    except httpx.HTTPError as e:
+        logger.error("Send failed", extra={"phone_number_id": phone_number_id, "recipient": recipient, "error": str(e)})
+        return None
+
     result = response.json()
-    print(f"Send response: {response.status_code} - {result}")
 
     if "error" in result:
         error_code = result["error"].get("code")
-        if error_code in [190, 102, 10]:
-            print(f"TOKEN ERROR detected for phone_number_id {phone_number_id}")
-            flag_client_token_error(phone_number_id)
+        logger.warning("Send rejected", extra={
+            "phone_number_id": phone_number_id, "recipient": recipient,
+            "status": response.status_code, "error": result["error"],
+        })
+        if error_code in token_health.TOKEN_ERROR_CODES:
+            token_health.flag_token_error(phone_number_id, access_token, error_code)
+    else:
+        logger.info("Send response", extra={
+            "phone_number_id": phone_number_id, "recipient": recipient,
+            "status": response.status_code, "sample": True,
+        })
 
     return response
 
 
 def send_whatsapp_image(phone_number_id, access_token, recipient, image_url, caption):
-    if 'cloudinary.com' in image_url:
-        image_url = re.sub(r'\.(avif|webp|png|gif)$', '.jpg', image_url)
-        print(f"Converted image URL to: {image_url}")
-
-    url = f"https://graph.facebook.com/v19.0/{phone_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    # Uploaded once per number and sent by media id; by link until the upload lands
+    media_id = get_media_id(phone_number_id, access_token, image_url)
+    if media_id:
+        image = {"id": media_id, "caption": caption}
+    else:
+        image = {"link": whatsapp_image_url(image_url), "caption": caption}
+
     payload = {
         "messaging_product": "whatsapp",
         "to": recipient,
         "type": "image",
-        "image": {
-            "link": image_url,
-            "caption": caption
-        }
+        "image": image
     }
-    response = requests.post(url, headers=headers, json=payload)
+    if token_health.is_blocked(phone_number_id, access_token):
+        return None
+    try:
+        with STAGE_SECONDS.time(stage="graph_send"):
+            response = graph_client.post_message(phone_number_id, access_token, payload)
+    except (CircuitOpenError, SendThrottled):
+        defer_send(phone_number_id, payload)
+        return None
+    except httpx.HTTPError as e:
+        logger.error("Image send failed", extra={"phone_number_id": phone_number_id, "recipient": recipient, "error": str(e)})
+        return None
+
     result = response.json()
-    print(f"Image send response: {response.status_code} - {result}")
     if "error" in result:
-        print(f"IMAGE SEND ERROR: {result['error']}")
+        logger.warning("Image send rejected", extra={
+            "phone_number_id": phone_number_id, "recipient": recipient,
+            "status": response.status_code, "error": result["error"],
+        })
+        if result["error"].get("code") in token_health.TOKEN_ERROR_CODES:
+            token_health.flag_token_error(phone_number_id, access_token, result["error"]["code"])
+        elif media_id and result["error"].get("code") in MEDIA_ERROR_CODES:
+            forget_media(phone_number_id, image_url)
+    else:
+        logger.info("Image send response", extra={
+            "phone_number_id": phone_number_id, "recipient": recipient,
+            "status": response.status_code, "sample": True,
+        })
     return response
 
 
-def flag_client_token_error(phone_number_id):
-    db = SessionLocal()
-    try:
-        client = db.query(models.Client).filter(
-            models.Client.phone_number_id == phone_number_id
-        ).first()
-        if client:
-            client.token_valid = False
-            db.commit()
-            print(f"Flagged token error for client: {client.business_name}")
-    except Exception as e:
-        print(f"Error flagging token: {e}")
-    finally:
-        db.close()
-
-
 # ─────────────────────────────────────────────
 # CONTACT & USER HELPERS
 # ─────────────────────────────────────────────
 
-def is_new_user(db, client_id, sender):
-    previous = db.query(models.MessageLog).filter(
+def is_new_user(db, client_id, sender, contact):
+    """
+    True until the sender's first inbound message has been logged.
+    Answered from contacts.first_seen_at; only contacts that predate that
+    column and haven't been backfilled (manage.py backfill_contact_seen)
+    fall back to searching message_logs, once.
+    """
+    if contact.first_seen_at is not None:
+        return False
+    if contact.created:
+        return True
+    previous = db.query(models.MessageLog.id).filter(
         models.MessageLog.client_id == client_id,
         models.MessageLog.sender_number == sender,
         models.MessageLog.direction == "inbound"
     ).first()
-    return previous is None
+    if previous is None:
+        return True
+    # Has history from before first_seen_at existed — record it now
+    mark_seen(db, client_id, sender, contact)
+    return False
+
+
+def mark_seen(db, client_id, sender, contact):
+    """Keep first_seen_at/last_seen_at current, writing at most once per CONTACT_SEEN_RESOLUTION."""
+    now    = datetime.utcnow()
+    values = {}
+    if contact.first_seen_at is None:
+        values[models.Contact.first_seen_at] = now
+    if contact.last_seen_at is None or (now - contact.last_seen_at).total_seconds() >= CONTACT_SEEN_RESOLUTION:
+        values[models.Contact.last_seen_at] = now
+    if not values:
+        return
+
+    db.query(models.Contact).filter(models.Contact.id == contact.id).update(values)
+    first_seen = contact.first_seen_at is None
+    contact.first_seen_at = contact.first_seen_at or now
+    contact.last_seen_at  = now
+    if first_seen:
+        # Other workers must not welcome this sender again from a stale cache
+        invalidate_contact(client_id, sender)
+
+
+def load_contacts(db, client_id, senders):
+    """
+    Contact state for every sender in a batch — from the contact cache,
+    with one query for the senders it doesn't know yet.
+    """
+    contacts, missing = get_contacts(client_id, set(senders))
+    if not missing:
+        return contacts
+
+    rows = db.query(
+        models.Contact.id, models.Contact.phone_number, models.Contact.opted_out,
+        models.Contact.first_seen_at, models.Contact.last_seen_at
+    ).filter(
+        models.Contact.client_id == client_id,
+        models.Contact.phone_number.in_(missing)
+    ).all()
+    for row in rows:
+        state = ContactState(row.id, row.opted_out, row.first_seen_at, row.last_seen_at)
+        contacts[row.phone_number] = state
+        put_contact(client_id, row.phone_number, state)
+    return contacts
+
+
+def next_contact_number(db, client_id):
+    """
+    Number for an auto-named contact, from the contact_name_seq sequence.
+    nextval() takes no row lock and is not rolled back, so numbers can skip
+    but new senders never wait on each other's transactions. SQLite (tests)
+    has no sequences and counts the tenant's contacts instead.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        count = db.query(func.count(models.Contact.id)).filter(models.Contact.client_id == client_id).scalar()
+        return count + 1
+    return db.scalar(select(models.CONTACT_NAME_SEQ.next_value()))
+
+
+def contact_insert(db):
+    """INSERT … ON CONFLICT builder for the session's database."""
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite_insert(models.Contact)
+    return pg_insert(models.Contact)
+
+
+def auto_save_contact(db, client, sender, contacts):
+    """
+    Return the sender's ContactState from the batch's `contacts`, saving
+    them on their first message. The insert is an ON CONFLICT DO NOTHING
+    upsert on (client_id, phone_number), so two workers racing on the same
+    new sender both end up with the one row. It commits with the message.
+    """
+    existing = contacts.get(sender)
+    if existing:
+        return existing
+
+    business_slug = client.business_name.lower().replace(" ", "_")
+    auto_name     = f"{business_slug}_client_{next_contact_number(db, client.id)}"
+
+    contact_id = db.execute(
+        contact_insert(db)
+        .values(client_id=client.id, name=auto_name, phone_number=sender, opted_out=False)
+        .on_conflict_do_nothing(index_elements=["client_id", "phone_number"])
+        .returning(models.Contact.id)
+    ).scalar()
+
+    if contact_id is None:
+        # Saved by someone else between the lookup and the insert
+        row = db.query(
+            models.Contact.id, models.Contact.opted_out,
+            models.Contact.first_seen_at, models.Contact.last_seen_at
+        ).filter(
+            models.Contact.client_id == client.id,
+            models.Contact.phone_number == sender
+        ).one()
+        state = ContactState(row.id, row.opted_out, row.first_seen_at, row.last_seen_at)
+    else:
+        state = ContactState(contact_id, False, created=True)
+        logger.info("Auto-saved contact", extra={"client_id": client.id, "contact": auto_name, "sender": sender})
 
+    contacts[sender] = state
+    put_contact(client.id, sender, state)
+    return state
 
-def auto_save_contact(db, client, sender):
-    existing = db.query(models.Contact).filter(
-        models.Contact.client_id == client.id,
-        models.Contact.phone_number == sender
-    ).first()
 
-    if not existing:
-        business_slug = client.business_name.lower().replace(" ", "_")
-        contact_count = db.query(models.Contact).filter(
-            models.Contact.client_id == client.id
-        ).count()
-        auto_name = f"{business_slug}_client_{contact_count + 1}"
-        new_contact = models.Contact(
-            client_id=client.id,
-            name=auto_name,
-            phone_number=sender
-        )
-        db.add(new_contact)
-        db.commit()
-        print(f"Auto-saved contact: {auto_name} - {sender}")
+def set_opted_out(db, client_id, sender, contact, opted_out):
+    db.query(models.Contact).filter(models.Contact.id == contact.id).update({
+        models.Contact.opted_out: opted_out
+    })
+    contact.opted_out = opted_out
+    # Other workers may hold the old state for this sender
+    invalidate_contact(client_id, sender)
 
 
 # ─────────────────────────────────────────────
 # BUSINESS HOURS
 # ─────────────────────────────────────────────
 
-def is_within_business_hours(db, client_id):
-    nigeria_tz   = pytz.timezone("Africa/Lagos")
-    now          = datetime.now(nigeria_tz)
-    day          = now.weekday()
-    current_time = now.strftime("%H:%M")
-
-    print(f"Current Nigeria time: {current_time}, Day: {day}")
-
-    hours = db.query(models.BusinessHours).filter(
-        models.BusinessHours.client_id == client_id,
-        models.BusinessHours.day_of_week == day,
-        models.BusinessHours.is_open == True
-    ).first()
-
-    if not hours:
-        return True
-
-    if not hours.open_time or not hours.close_time:
-        return True
-
-    print(f"Business hours: {hours.open_time} - {hours.close_time}")
-
-    if hours.close_time < hours.open_time:
-        return current_time >= hours.open_time or current_time <= hours.close_time
-    else:
-        return hours.open_time <= current_time <= hours.close_time
+def is_within_business_hours(config):
+    # The tenant's week is precompiled into a minute bitmap (app/business_hours.py)
+    now = datetime.now(config.timezone)
+    return config.schedule.is_open_at(now)
 
 
 # ─────────────────────────────────────────────
-# MESSAGE BUILDERS
+# REPLY ORDERING
 # ─────────────────────────────────────────────
 
-def get_greeting(business_name, products=None, rules=None):
-    categories = {}
-    if products:
-        for product in products:
-            cat = product.category or "Products"
-            if cat not in categories:
-                categories[cat] = cat
-
-    menu_items = ""
-    item_num   = 1
-
-    if categories:
-        for cat in categories.values():
-            menu_items += f"{item_num}️⃣ Type *{cat.lower()}* - Browse {cat}\n"
-            item_num += 1
-
-    if rules:
-        for rule in rules:
-            menu_items += f"{item_num}️⃣ Type *{rule.trigger_keyword}* - {rule.response_text[:30]}\n"
-            item_num += 1
-
-    menu_items += f"{item_num}️⃣ Type *menu* - See all options\n"
-    item_num   += 1
-    menu_items += f"{item_num}️⃣ Type *human* - Talk to an agent\n"
-
-    return (
-        f"👋 Welcome to *{business_name}*!\n\n"
-        f"We're glad you reached out. Here's what we offer:\n\n"
-        f"{menu_items}\n"
-        f"Just type any keyword above to get started! 😊"
-    )
-
-
-def get_menu(business_name, products=None, rules=None):
-    categories = {}
-    if products:
-        for product in products:
-            cat = product.category or "Products"
-            if cat not in categories:
-                categories[cat] = cat
-
-    menu_items = ""
-    item_num   = 1
-
-    if categories:
-        for cat in categories.values():
-            menu_items += f"{item_num}️⃣ Type *{cat.lower()}* - Browse {cat}\n"
-            item_num += 1
-
-    if rules:
-        for rule in rules:
-            menu_items += f"{item_num}️⃣ Type *{rule.trigger_keyword}* - Info\n"
-            item_num += 1
-
-    menu_items += f"{item_num}️⃣ Type *human* - Talk to an agent\n"
-
-    return (
-        f"📋 *{business_name} Menu*\n\n"
-        f"{menu_items}\n"
-        f"Type *menu* anytime to see this again."
-    )
-
-
-def get_fallback():
-    return (
-        "🤔 Sorry, I didn't quite understand that.\n\n"
-        "Type *menu* to see available options or *human* to speak with our team directly."
-    )
-
-
-def get_client_templates(db, client):
-    return db.query(models.MessageTemplate).filter(
-        models.MessageTemplate.client_id == client.id
-    ).first()
-
+# Every handled message gets a number; a sender's entry holds the newest
+# one this process has answered, so an AI reply that finishes after a newer
+# message was answered is dropped instead of arriving out of order
+_message_seq   = itertools.count(1)
+_answered      = OrderedDict()   # (client_id, sender) -> seq
+_answered_lock = threading.Lock()
 
-def build_welcome(template, business_name, active_products, active_rules):
-    if template and template.welcome_message:
-        return template.welcome_message.replace("{business_name}", business_name)
-    return get_greeting(business_name, active_products, active_rules)
 
+def mark_answered(client_id, sender, seq):
+    key = (client_id, sender)
+    with _answered_lock:
+        if _answered.get(key, 0) < seq:
+            _answered[key] = seq
+        _answered.move_to_end(key)
+        while len(_answered) > CONTACT_CACHE_SIZE:
+            _answered.popitem(last=False)
 
-def build_menu(template, business_name, active_products, active_rules):
-    if template and template.menu_message:
-        return template.menu_message.replace("{business_name}", business_name)
-    return get_menu(business_name, active_products, active_rules)
 
+def answered_since(client_id, sender, seq):
+    """True when a message newer than `seq` from this sender has been answered."""
+    with _answered_lock:
+        return _answered.get((client_id, sender), 0) > seq
 
-def build_closed(template):
-    if template and template.closed_message:
-        return template.closed_message
-    return (
-        "🕐 *We're currently closed.*\n\n"
-        "Our team is not available right now but we'll get back to you "
-        "as soon as we open.\n\n"
-        "Type *hours* to see our working hours."
-    )
 
+def send_reply(config, sender, reply, seq):
+    """Post-commit send of a message's reply."""
+    client = config.client
+    send_whatsapp_message(client.phone_number_id, client.access_token, sender, reply)
+    mark_answered(client.id, sender, seq)
 
-def build_handoff(template):
-    if template and template.handoff_message:
-        return template.handoff_message
-    return (
-        "👤 *Connecting you to an agent...*\n\n"
-        "Please hold on, someone from our team will respond shortly.\n"
-        "Our working hours are Mon-Fri, 9am - 6pm."
-    )
 
-
-def build_fallback(template):
-    if template and template.fallback_message:
-        return template.fallback_message
-    return get_fallback()
+def is_opted_out(client_id, sender):
+    """Current opt-out state, for replies sent after their message's transaction."""
+    db = SessionLocal()
+    try:
+        contact = load_contacts(db, client_id, [sender]).get(sender)
+    finally:
+        db.close()
+    return contact is not None and contact.opted_out
 
 
 # ─────────────────────────────────────────────
-# AI REPLY WITH RETRY
+# AI REPLY
 # ─────────────────────────────────────────────
 
-def get_ai_reply_with_retry(client, text, db):
-    """Call AI reply with one retry on overload (529)"""
+def try_ai_reply(config, text):
+    """
+    Inline AI reply (AI_WORKERS=0), or None so the caller sends the fallback.
+    Overload and outages are not retried inline — they count against the
+    Anthropic circuit breaker, which skips the call entirely while it is open.
+    """
     try:
         from app.ai_reply import get_ai_reply
     except ImportError:
         return None
 
-    for attempt in range(2):
-        try:
-            ai_response = get_ai_reply(client, text, db)
-            return ai_response
-        except Exception as e:
-            error_str = str(e)
-            if '529' in error_str or 'overloaded' in error_str.lower():
-                if attempt == 0:
-                    print(f"⚠️ Claude overloaded, retrying in 2s...")
-                    time.sleep(2)
-                    continue
-                else:
-                    print(f"❌ Claude still overloaded after retry — using fallback")
-                    return None
-            else:
-                print(f"❌ AI reply error: {e}")
-                return None
+    try:
+        return get_ai_reply(config, text)
+    except Exception as e:
+        logger.error("AI reply error", extra={"client_id": config.client.id, "error": str(e)})
+        return None
 
-    return None
 
+def try_cached_ai_reply(config, text):
+    """Cached AI answer for a repeated question, or None."""
+    try:
+        from app.ai_reply import cached_ai_reply
+        return cached_ai_reply(config, text)
+    except Exception as e:
+        logger.error("AI answer cache error", extra={"client_id": config.client.id, "error": str(e)})
+        return None
 
-# ─────────────────────────────────────────────
-# DEDUPLICATION CHECK
-# ─────────────────────────────────────────────
 
-def is_duplicate_message(db, whatsapp_message_id):
-    """Check if this exact message was already processed"""
-    if not whatsapp_message_id:
-        return False
-    existing = db.query(models.MessageLog).filter(
-        models.MessageLog.whatsapp_message_id == whatsapp_message_id
-    ).first()
-    return existing is not None
+def deliver_ai_reply(config, sender, reply, seq):
+    """
+    AI stage callback — sends the AI reply, or the fallback when there is
+    none. Nothing is sent when the sender has opted out since asking (a STOP
+    commits while the reply is generated) or a newer message of theirs has
+    already been answered.
+    """
+    client = config.client
+    if answered_since(client.id, sender, seq):
+        logger.info("AI reply dropped, a newer message was answered", extra={"client_id": client.id, "sender": sender})
+        return
+    if is_opted_out(client.id, sender):
+        logger.info("AI reply dropped, sender opted out", extra={"client_id": client.id, "sender": sender})
+        return
+
+    if reply:
+        logger.info("AI reply sent", extra={"client_id": client.id, "sender": sender, "sample": True})
+    else:
+        reply = config.replies.fallback
+
+    if reply:
+        send_whatsapp_message(client.phone_number_id, client.access_token, sender, reply)
+        log_message(client.id, sender, reply, "outbound")
+        get_log_writer().sync_point()
+        mark_answered(client.id, sender, seq)
+
+
+def submit_ai_reply(config, sender, text, seq):
+    """
+    Hand a committed message's question to the AI stage, or generate the
+    reply inline when the stage isn't taking the tenant's jobs — AI_WORKERS
+    is 0, the plan has no AI, or Anthropic's circuit is open.
+    """
+    deliver = partial(deliver_ai_reply, seq=seq)
+    if ai_worker.submit(config, sender, text, deliver):
+        return
+    with STAGE_SECONDS.time(stage="ai_call"):
+        reply = try_ai_reply(config, text)
+    deliver(config, sender, reply)
 
 
 # ─────────────────────────────────────────────
@@ -324,295 +396,250 @@ def is_duplicate_message(db, whatsapp_message_id):
 # ─────────────────────────────────────────────
 
 def process_message(data: dict):
+    """Lane thread entry point — never raises."""
+    try:
+        handle_payload(data)
+    except Exception:
+        logger.exception("Unexpected error in process_message")
+
+
+def iter_messages(data: dict):
+    """
+    Yield (phone_number_id, message) for every message in a webhook payload.
+    Meta may batch several entries, changes and phone numbers in one POST.
+    """
+    for entry in data["entry"]:
+        for change in entry.get("changes", []):
+            value           = change.get("value", {})
+            phone_number_id = value.get("metadata", {}).get("phone_number_id")
+
+            for message in value.get("messages", []):
+                yield phone_number_id, message
+
+
+def group_messages(data: dict):
+    """Group a payload's messages by phone_number_id, keeping arrival order."""
+    groups = {}
+    for phone_number_id, message in iter_messages(data):
+        groups.setdefault(phone_number_id, []).append(message)
+    return groups
+
+
+def handle_payload(data: dict):
+    """
+    Process one webhook payload. Malformed payloads are logged and dropped;
+    anything else propagates so queue workers can retry the job.
+    """
     db = SessionLocal()
 
     try:
-        value                    = data["entry"][0]["changes"][0]["value"]
-        messages_list            = value.get("messages", [])
-        metadata                 = value.get("metadata", {})
-        incoming_phone_number_id = metadata.get("phone_number_id")
-
-        for message in messages_list:
-            sender = message["from"]
-            if message["type"] != "text":
+        with STAGE_SECONDS.time(stage="parse"):
+            groups = group_messages(data)
+
+        for incoming_phone_number_id, messages in groups.items():
+            # ── Find client once per phone number in the batch (cached) ──
+            with STAGE_SECONDS.time(stage="tenant_load"):
+                config = get_tenant_config(db, incoming_phone_number_id)
+
+            if not config:
+                logger.warning("No client found for this phone number ID", extra={"phone_number_id": incoming_phone_number_id})
                 continue
 
-            text               = message["text"]["body"].lower().strip()
-            whatsapp_message_id = message.get("id")
+            # ── Known-bad token: sends for this tenant are skipped until it's fixed ──
+            token_health.observe(config.client)
 
-            print(f"Incoming from {sender}: {text}")
+            # ── Shared lookups for every sender in the batch ──
+            with STAGE_SECONDS.time(stage="contact_upsert"):
+                contacts = load_contacts(db, config.client.id, [m.get("from") for m in messages])
 
-            # ── Deduplication — skip if already processed ──
-            if is_duplicate_message(db, whatsapp_message_id):
-                print(f"⚠️ Duplicate webhook ignored: {whatsapp_message_id}")
-                continue
+            for message in messages:
+                # ── Deduplication — claim the message id before processing ──
+                whatsapp_message_id = message.get("id")
+                with STAGE_SECONDS.time(stage="dedup"):
+                    claimed = claim_message(whatsapp_message_id)
+                if not claimed:
+                    logger.info("Duplicate webhook ignored", extra={"client_id": config.client.id, "message_id": whatsapp_message_id})
+                    continue
+                MESSAGES_TOTAL.inc(client_id=config.client.id)
+
+                # ── One transaction per message: every write lands in a single commit ──
+                log_writer = get_log_writer()
+                log_writer.begin()
+                outbox     = []   # (fn, args) sends and AI hand-offs for after the commit
+                try:
+                    with query_budget(MESSAGE_QUERY_BUDGET, f"message {whatsapp_message_id}") as budget:
+                        handle_message(db, config, contacts, message, outbox)
+                        budget.check()   # before the commit — an over-budget message is rolled back, not re-run
+                        db.commit()
+                    complete_message(whatsapp_message_id)
+                    log_writer.sync_point()
+                except Exception:
+                    db.rollback()
+                    log_writer.discard()
+                    # The cached contact state may describe writes that were just rolled back
+                    forget_contact(config.client.id, message.get("from"))
+                    release_message(whatsapp_message_id)
+                    raise
+
+                # ── Replies go out only once the message is committed, so no
+                #    row lock is held across a Graph, SMTP or Claude round trip ──
+                for fn, args in outbox:
+                    fn(*args)
 
-            # ── Find client ──
-            client = db.query(models.Client).filter(
-                models.Client.phone_number_id == incoming_phone_number_id,
-                models.Client.is_active == True
-            ).first()
+    except (KeyError, IndexError) as e:
+        logger.warning("Webhook parse error", extra={"error": repr(e)})
+    finally:
+        db.close()
 
-            if not client:
-                print("No client found for this phone number ID")
-                continue
 
-            # ── Check subscription ──
-            today = date.today()
-            if client.grace_period_end and today > client.grace_period_end:
-                print(f"❌ Subscription expired for {client.business_name} — bot paused")
-                continue
+def handle_message(db, config, contacts, message, outbox):
+    """
+    Run one inbound message through the reply pipeline. Database writes go
+    into the caller's transaction; replies, e-mails and AI hand-offs are
+    appended to `outbox` as (fn, args) for the caller to run after the commit.
+    """
+    sender = message["from"]
+    if message["type"] != "text":
+        return
 
-            # ── Auto-save contact ──
-            auto_save_contact(db, client, sender)
-
-            # ── Handle opt-out ──
-            if text == "stop":
-                contact = db.query(models.Contact).filter(
-                    models.Contact.client_id == client.id,
-                    models.Contact.phone_number == sender
-                ).first()
-                if contact:
-                    contact.opted_out = True
-                    db.commit()
-
-                reply = (
-                    "✅ You have been unsubscribed successfully.\n\n"
-                    "You will no longer receive messages from us.\n"
-                    "Type *START* anytime to resubscribe."
-                )
-                send_whatsapp_message(client.phone_number_id, client.access_token, sender, reply)
-                db.add(models.MessageLog(
-                    client_id=client.id,
-                    sender_number=sender,
-                    message_text=reply,
-                    direction="outbound",
-                    whatsapp_message_id=whatsapp_message_id
-                ))
-                db.commit()
-                continue
+    text               = message["text"]["body"].lower().strip()
+    whatsapp_message_id = message.get("id")
 
-            # ── Handle opt-in ──
-            if text == "start":
-                contact = db.query(models.Contact).filter(
-                    models.Contact.client_id == client.id,
-                    models.Contact.phone_number == sender
-                ).first()
-                if contact:
-                    contact.opted_out = False
-                    db.commit()
-
-                reply = (
-                    "✅ You have been resubscribed successfully.\n\n"
-                    "You will now receive messages from us again.\n"
-                    "Type *STOP* anytime to unsubscribe."
-                )
-                send_whatsapp_message(client.phone_number_id, client.access_token, sender, reply)
-                db.add(models.MessageLog(
-                    client_id=client.id,
-                    sender_number=sender,
-                    message_text=reply,
-                    direction="outbound",
-                    whatsapp_message_id=whatsapp_message_id
-                ))
-                db.commit()
-                continue
+    logger.info("Incoming message", extra={"client_id": config.client.id, "sender": sender, "text": text, "sample": True})
 
-            # ── Block opted-out contacts ──
-            contact = db.query(models.Contact).filter(
-                models.Contact.client_id == client.id,
-                models.Contact.phone_number == sender
-            ).first()
+    client = config.client
+    seq    = next(_message_seq)
 
-            if contact and contact.opted_out:
-                print(f"Skipping opted-out contact: {sender}")
-                continue
+    def send(reply):
+        outbox.append((send_reply, (config, sender, reply, seq)))
 
-            # ── Fetch active products, rules, templates ──
-            active_products = db.query(models.Product).filter(
-                models.Product.client_id == client.id,
-                models.Product.is_active == True
-            ).all()
-
-            active_rules = db.query(models.AutoReplyRule).filter(
-                models.AutoReplyRule.client_id == client.id,
-                models.AutoReplyRule.is_active == True
-            ).all()
-
-            template = get_client_templates(db, client)
-
-            # ── Check business hours ──
-            if not is_within_business_hours(db, client.id):
-                reply = build_closed(template)
-                send_whatsapp_message(client.phone_number_id, client.access_token, sender, reply)
-                db.add(models.MessageLog(
-                    client_id=client.id,
-                    sender_number=sender,
-                    message_text=reply,
-                    direction="outbound",
-                    whatsapp_message_id=whatsapp_message_id
-                ))
-                db.commit()
-                continue
+    # ── Check subscription ──
+    today = date.today()
+    if client.grace_period_end and today > client.grace_period_end:
+        logger.info("Subscription expired — bot paused", extra={"client_id": client.id, "business": client.business_name})
+        return
 
-            # ── New user — send welcome ──
-            if is_new_user(db, client.id, sender):
-                reply = build_welcome(template, client.business_name, active_products, active_rules)
-
-                db.add(models.MessageLog(
-                    client_id=client.id,
-                    sender_number=sender,
-                    message_text=text,
-                    direction="inbound",
-                    whatsapp_message_id=whatsapp_message_id
-                ))
-                db.commit()
-
-                send_whatsapp_message(client.phone_number_id, client.access_token, sender, reply)
-                db.add(models.MessageLog(
-                    client_id=client.id,
-                    sender_number=sender,
-                    message_text=reply,
-                    direction="outbound"
-                ))
-                db.commit()
-                continue
+    # ── Load (or auto-save) the contact once for the whole message ──
+    with STAGE_SECONDS.time(stage="contact_upsert"):
+        contact = auto_save_contact(db, client, sender, contacts)
 
-            # ── Log inbound message ──
-            db.add(models.MessageLog(
-                client_id=client.id,
-                sender_number=sender,
-                message_text=text,
-                direction="inbound",
-                whatsapp_message_id=whatsapp_message_id
-            ))
-            db.commit()
-
-            # ── Menu ──
-            if text == "menu":
-                reply = build_menu(template, client.business_name, active_products, active_rules)
-                send_whatsapp_message(client.phone_number_id, client.access_token, sender, reply)
-                db.add(models.MessageLog(
-                    client_id=client.id,
-                    sender_number=sender,
-                    message_text=reply,
-                    direction="outbound"
-                ))
-                db.commit()
-                continue
+    # ── Handle opt-out ──
+    if text == "stop":
+        set_opted_out(db, client.id, sender, contact, True)
 
-            # ── Human handoff ──
-            elif "human" in text or "agent" in text:
-                reply = build_handoff(template)
-                send_email_notification(client.email, client.business_name, sender, text)
-                send_whatsapp_message(client.phone_number_id, client.access_token, sender, reply)
-                db.add(models.MessageLog(
-                    client_id=client.id,
-                    sender_number=sender,
-                    message_text=reply,
-                    direction="outbound"
-                ))
-                db.commit()
-                continue
+        reply = (
+            "✅ You have been unsubscribed successfully.\n\n"
+            "You will no longer receive messages from us.\n"
+            "Type *START* anytime to resubscribe."
+        )
+        send(reply)
+        log_message(client.id, sender, reply, "outbound", whatsapp_message_id)
+        return
+
+    # ── Handle opt-in ──
+    if text == "start":
+        set_opted_out(db, client.id, sender, contact, False)
+
+        reply = (
+            "✅ You have been resubscribed successfully.\n\n"
+            "You will now receive messages from us again.\n"
+            "Type *STOP* anytime to unsubscribe."
+        )
+        send(reply)
+        log_message(client.id, sender, reply, "outbound", whatsapp_message_id)
+        return
+
+    # ── Block opted-out contacts ──
+    if contact.opted_out:
+        logger.info("Skipping opted-out contact", extra={"client_id": client.id, "sender": sender, "sample": True})
+        return
+
+    # ── Check business hours ──
+    if not is_within_business_hours(config):
+        reply = config.replies.closed
+        send(reply)
+        log_message(client.id, sender, reply, "outbound", whatsapp_message_id)
+        return
+
+    # ── New user — send welcome ──
+    if is_new_user(db, client.id, sender, contact):
+        reply = config.replies.welcome
+
+        log_message(client.id, sender, text, "inbound", whatsapp_message_id)
+        mark_seen(db, client.id, sender, contact)
+
+        send(reply)
+        log_message(client.id, sender, reply, "outbound")
+        return
+
+    # ── Log inbound message ──
+    log_message(client.id, sender, text, "inbound", whatsapp_message_id)
+    mark_seen(db, client.id, sender, contact)
+
+    # ── Menu ──
+    if text == "menu":
+        reply = config.replies.menu
+        send(reply)
+        log_message(client.id, sender, reply, "outbound")
+        return
+
+    # ── Human handoff ──
+    elif "human" in text or "agent" in text:
+        reply = config.replies.handoff
+        outbox.append((send_email_notification, (client.email, client.business_name, sender, text)))
+        send(reply)
+        log_message(client.id, sender, reply, "outbound")
+        return
 
+    else:
+        reply = None
+
+        product = None
+
+        with STAGE_SECONDS.time(stage="matching"):
+            # ── 1. Auto-reply rules (compiled matcher, first rule wins) ──
+            rule = config.rule_matcher.search(text)
+            if rule:
+                reply = rule.response_text
+
+            # ── 2. Category match (listing pre-rendered per snapshot) ──
+            if not reply:
+                reply = config.replies.categories.get(text)
+
+            # ── 3. Individual product keyword ──
+            if not reply:
+                product = config.products_by_keyword.get(text)
+
+        if product:
+            detail = config.replies.products[product.keyword]
+            if product.image_url:
+                outbox.append((send_whatsapp_image, (
+                    client.phone_number_id,
+                    client.access_token,
+                    sender,
+                    product.image_url,
+                    detail
+                )))
+                outbox.append((mark_answered, (client.id, sender, seq)))
+                log_message(client.id, sender, f"[PRODUCT] {product.name}", "outbound")
+                return
             else:
-                reply = None
-
-                # ── 1. Auto-reply rules ──
-                for rule in active_rules:
-                    if rule.trigger_keyword in text:
-                        reply = rule.response_text
-                        break
-
-                # ── 2. Category match ──
-                if not reply:
-                    matching_category_products = db.query(models.Product).filter(
-                        models.Product.client_id == client.id,
-                        models.Product.is_active == True,
-                        models.Product.category.ilike(text)
-                    ).all()
-
-                    if matching_category_products:
-                        category_name = matching_category_products[0].category
-                        product_list  = f"🛍️ *{category_name}*\n\n"
-                        product_list += "Here are our available products:\n\n"
-                        for p in matching_category_products:
-                            product_list += (
-                                f"▪️ *{p.name}*\n"
-                                f"   💰 {p.price}\n"
-                                f"   Type *{p.keyword}* for details\n\n"
-                            )
-                        product_list += "Type the keyword next to any product to see full details!"
-                        reply = product_list
-
-                # ── 3. Individual product keyword ──
-                if not reply:
-                    product = db.query(models.Product).filter(
-                        models.Product.client_id == client.id,
-                        models.Product.keyword == text,
-                        models.Product.is_active == True
-                    ).first()
-
-                    if product:
-                        if product.image_url:
-                            send_whatsapp_image(
-                                client.phone_number_id,
-                                client.access_token,
-                                sender,
-                                product.image_url,
-                                f"*{product.name}*\n\n"
-                                f"{product.description}\n\n"
-                                f"💰 {product.price}\n\n"
-                                f"Type *order* to place an order or *menu* to see more options."
-                            )
-                            db.add(models.MessageLog(
-                                client_id=client.id,
-                                sender_number=sender,
-                                message_text=f"[PRODUCT] {product.name}",
-                                direction="outbound"
-                            ))
-                            db.commit()
-                            continue
-                        else:
-                            reply = (
-                                f"*{product.name}*\n\n"
-                                f"{product.description}\n\n"
-                                f"💰 {product.price}\n\n"
-                                f"Type *order* to place an order or *menu* to see more options."
-                            )
-
-                # ── 4. AI reply (Growth & Pro) with retry ──
-                if not reply:
-                    reply = get_ai_reply_with_retry(client, text, db)
-                    if reply:
-                        print(f"🤖 AI reply sent to {sender}")
-
-                # ── 5. Final fallback ──
-                if not reply:
-                    reply = build_fallback(template)
-
-                # ── Send reply ──
-                if reply:
-                    send_whatsapp_message(
-                        client.phone_number_id,
-                        client.access_token,
-                        sender,
-                        reply
-                    )
-                    db.add(models.MessageLog(
-                        client_id=client.id,
-                        sender_number=sender,
-                        message_text=reply,
-                        direction="outbound"
-                    ))
-                    db.commit()
+                reply = detail
 
-    except (KeyError, IndexError) as e:
-        print(f"Webhook parse error: {e}")
-    except Exception as e:
-        print(f"Unexpected error in process_message: {e}")
-    finally:
-        db.close()
+        # ── 4. AI reply (Growth & Pro), skipped while Anthropic is failing ──
+        if not reply:
+            reply = try_cached_ai_reply(config, text)   # repeated question — no Claude call
+            if reply:
+                logger.info("AI reply sent from answer cache", extra={"client_id": client.id, "sender": sender, "sample": True})
+        if not reply:
+            # ── 5. The AI stage — or an inline call when it isn't running —
+            #    sends the reply, or the final fallback, after the commit ──
+            outbox.append((submit_ai_reply, (config, sender, text, seq)))
+            return
+
+        # ── Send reply ──
+        send(reply)
+        log_message(client.id, sender, reply, "outbound")
 
 
 # ─────────────────────────────────────────────
@@ -631,11 +658,25 @@ def verify_webhook(
 
 
 @router.post("/")
-async def receive_message(request: Request, background_tasks: BackgroundTasks):
+async def receive_message(request: Request):
     data = await request.json()
 
-    # ── Return 200 to Meta IMMEDIATELY ──
-    # Processing happens in background so Meta never retries
-    background_tasks.add_task(process_message, data)
+    try:
+        partitions = partition_messages(iter_messages(data))
+    except (KeyError, IndexError) as e:
+        logger.warning("Webhook parse error", extra={"error": repr(e)})
+        return {"status": "ok"}
 
-    return {"status": "ok"}
\ No newline at end of file
+    # ── Return 200 to Meta IMMEDIATELY ──
+    # Messages are split into per-sender lanes so each conversation is
+    # handled in order while different customers run in parallel. With a
+    # durable queue configured, app.worker processes the lanes; otherwise
+    # they run on this process's lane threads
+    for lane, payload in partitions:
+        queue = get_queue(lane_queue_name(lane))
+        if queue:
+            await run_in_threadpool(queue.enqueue, payload)
+        else:
+            get_lane_executor(process_message).submit(lane, payload)
+
+    return {"status": "ok"}
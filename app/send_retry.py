@@ -0,0 +1,173 @@
+"""
+Deferred Graph sends.
+
+While the Graph circuit is open, or a number is over its send rate,
+replies and broadcast messages are not dropped: the send helpers hand them
+to defer_send() and a background thread sends them once the breaker lets
+calls through again and the number has send tokens. A throttled send is
+put back at the end of the queue without using up an attempt.
+
+  • durable queue backends keep them on the "graph:retry" queue, with the
+    queue's attempt counting and dead-lettering
+  • inline mode keeps up to GRAPH_RETRY_MAX_PENDING of them in memory
+
+Jobs carry the phone_number_id and message payload, not the access token —
+the token is read from the tenant cache when the send is retried, so a
+reconnected number uses its new token.
+"""
+import os
+import threading
+from collections import deque
+
+import httpx
+
+from app import graph_client
+from app.circuit_breaker import GRAPH_BREAKER, CircuitOpenError
+from app.database import SessionLocal
+from app.logging_config import get_logger
+from app.message_queue import get_queue, MESSAGE_QUEUE_MAX_ATTEMPTS
+from app.metrics import GaugeCallback
+from app.rate_limiter import SendThrottled
+from app.tenant_cache import get_tenant_config
+
+GRAPH_RETRY_QUEUE       = "graph:retry"
+GRAPH_RETRY_INTERVAL    = float(os.getenv("GRAPH_RETRY_INTERVAL", 5))        # seconds between drain passes
+GRAPH_RETRY_MAX_PENDING = int(os.getenv("GRAPH_RETRY_MAX_PENDING", 10000))   # inline mode only
+
+logger = get_logger("send_retry")
+
+_pending = deque(maxlen=GRAPH_RETRY_MAX_PENDING)   # [job dict, attempts]
+_lock    = threading.Lock()
+_thread  = None
+_stop    = threading.Event()
+
+
+def defer_send(phone_number_id, payload):
+    """Queue a message for sending once Graph is reachable and the number may send again."""
+    job   = {"phone_number_id": phone_number_id, "payload": payload}
+    queue = get_queue(GRAPH_RETRY_QUEUE)
+    if queue:
+        queue.enqueue(job)
+    else:
+        with _lock:
+            if len(_pending) == _pending.maxlen:
+                logger.error("Graph retry buffer full, dropping oldest send",
+                             extra={"phone_number_id": _pending[0][0]["phone_number_id"]})
+            _pending.append([job, 0])
+    logger.warning("Graph send deferred", extra={"phone_number_id": phone_number_id, "to": payload.get("to")})
+    start_send_retry_worker()
+
+
+def _send(db, job):
+    """
+    True when the job is done with (sent, or rejected by Graph for good),
+    False to keep it for a later pass. CircuitOpenError and SendThrottled
+    propagate.
+    """
+    config = get_tenant_config(db, job["phone_number_id"])
+    if not config:
+        logger.warning("Dropping deferred send for unknown number", extra={"phone_number_id": job["phone_number_id"]})
+        return True
+    try:
+        response = graph_client.post_message(job["phone_number_id"], config.client.access_token, job["payload"])
+    except httpx.HTTPError:
+        return False
+    return response.status_code < 500
+
+
+def drain_once(count=50):
+    """Send up to `count` deferred messages. Returns how many were done."""
+    if GRAPH_BREAKER.is_open():
+        return 0
+
+    db   = SessionLocal()
+    done = 0
+    try:
+        queue = get_queue(GRAPH_RETRY_QUEUE)
+        if queue:
+            jobs = queue.claim(count=count, block_ms=None)
+            for index, job in enumerate(jobs):
+                try:
+                    finished = _send(db, job.payload)
+                except SendThrottled:
+                    queue.enqueue(job.payload)
+                    queue.ack(job)
+                    continue
+                except CircuitOpenError:
+                    finished = False
+                if not finished:
+                    # Graph is still failing — leave this and the rest for the next pass
+                    for rest in jobs[index:]:
+                        queue.fail(rest)
+                    break
+                queue.ack(job)
+                done += 1
+            return done
+
+        for _ in range(count):
+            with _lock:
+                if not _pending:
+                    break
+                entry = _pending.popleft()
+            try:
+                finished = _send(db, entry[0])
+            except SendThrottled:
+                with _lock:
+                    _pending.append(entry)
+                continue
+            except CircuitOpenError:
+                finished   = False
+                entry[1]  -= 1   # never reached Graph, doesn't count as an attempt
+            if finished:
+                done += 1
+                continue
+            entry[1] += 1
+            if entry[1] >= MESSAGE_QUEUE_MAX_ATTEMPTS:
+                logger.error("Deferred send failed too often, dropping", extra=entry[0])
+                continue
+            with _lock:
+                _pending.appendleft(entry)
+            break   # Graph is still failing — wait for the next pass
+        return done
+    finally:
+        db.close()
+
+
+def _run():
+    while not _stop.wait(GRAPH_RETRY_INTERVAL):
+        try:
+            while drain_once():
+                pass
+        except Exception:
+            logger.exception("Graph retry pass failed")
+
+
+def start_send_retry_worker():
+    """Start the background drain thread once per process."""
+    global _thread
+    if _thread is not None:
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_run, name="graph-retry", daemon=True)
+        _thread.start()
+
+
+def stop_send_retry_worker():
+    _stop.set()
+
+
+def get_retry_depth():
+    queue = get_queue(GRAPH_RETRY_QUEUE)
+    if queue:
+        return queue.depth()
+    with _lock:
+        return len(_pending)
+
+
+RETRY_DEPTH = GaugeCallback(
+    "botmart_graph_retry_queue_depth",
+    "Sends deferred while the Graph circuit was open or the number was throttled",
+    get_retry_depth,
+)
@@ -1,6 +1,8 @@
 from datetime import date
 from app.database import SessionLocal
 from app.models import Client
+from app.logging_config import get_logger
+from app.tenant_cache import invalidate_tenant
 
 # ── Import Django's email helper via direct SMTP call ──
 # FastAPI doesn't use Django, so we send emails directly with smtplib
@@ -9,6 +11,8 @@ import os
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+logger = get_logger("subscription_checker")
+
 
 def send_reminder_email(to_email: str, business_name: str, days_left: int, plan: str):
     """Send a subscription expiry reminder email."""
@@ -125,9 +129,9 @@ def send_reminder_email(to_email: str, business_name: str, days_left: int, plan:
             server.login(smtp_user, smtp_pass)
             server.sendmail(from_email, to_email, msg.as_string())
 
-        print(f"[subscription_checker] Reminder sent to {to_email} ({days_left}d left)")
+        logger.info("Reminder sent", extra={"email": to_email, "days_left": days_left})
     except Exception as e:
-        print(f"[subscription_checker] Failed to send email to {to_email}: {e}")
+        logger.error("Failed to send reminder email", extra={"email": to_email, "error": str(e)})
 
 
 def send_expired_bot_paused_email(to_email: str, business_name: str, plan: str):
@@ -214,9 +218,9 @@ def send_expired_bot_paused_email(to_email: str, business_name: str, plan: str):
             server.login(smtp_user, smtp_pass)
             server.sendmail(from_email, to_email, msg.as_string())
 
-        print(f"[subscription_checker] Bot-paused email sent to {to_email}")
+        logger.info("Bot-paused email sent", extra={"email": to_email})
     except Exception as e:
-        print(f"[subscription_checker] Failed to send paused email to {to_email}: {e}")
+        logger.error("Failed to send paused email", extra={"email": to_email, "error": str(e)})
 
 
 def run_subscription_checks():
@@ -249,7 +253,7 @@ def run_subscription_checks():
                 )
                 client.reminder_7_sent = True
                 db.commit()
-                print(f"[checker] 7-day reminder → {client.business_name}")
+                logger.info("7-day reminder", extra={"client_id": client.id, "business": client.business_name})
 
             # ── 3-day reminder ──
             elif days_left == 3 and not client.reminder_3_sent:
@@ -259,16 +263,18 @@ def run_subscription_checks():
                 )
                 client.reminder_3_sent = True
                 db.commit()
-                print(f"[checker] 3-day reminder → {client.business_name}")
+                logger.info("3-day reminder", extra={"client_id": client.id, "business": client.business_name})
 
             # ── Expired today — pause bot ──
             elif days_left <= 0 and client.payment_status == "paid":
                 client.payment_status = "expired"
                 db.commit()
+                # Every worker's snapshot caches the tenant's status — reload it now, not after the TTL
+                invalidate_tenant(client.phone_number_id, client.id)
                 send_expired_bot_paused_email(
                     client.email, client.business_name, client.plan
                 )
-                print(f"[checker] Bot paused → {client.business_name}")
+                logger.info("Bot paused", extra={"client_id": client.id, "business": client.business_name})
 
         # ── Grace period over — deactivate ──
         expired_clients = db.query(Client).filter(
@@ -281,9 +287,10 @@ def run_subscription_checks():
         for client in expired_clients:
             client.is_active = False
             db.commit()
-            print(f"[checker] Deactivated (grace over) → {client.business_name}")
+            invalidate_tenant(client.phone_number_id, client.id)
+            logger.info("Deactivated (grace over)", extra={"client_id": client.id, "business": client.business_name})
 
-    except Exception as e:
-        print(f"[subscription_checker] Error: {e}")
+    except Exception:
+        logger.exception("Subscription check failed")
     finally:
         db.close()
\ No newline at end of file
@@ -0,0 +1,304 @@
+"""
+Per-tenant bot configuration cache.
+
+process_message needs the client, its active products and rules, its
+message templates and its business hours for every inbound text. Those
+rows change rarely, so we keep one read-only snapshot per tenant keyed by
+phone_number_id and only go back to the DB when the snapshot expires or is
+invalidated.
+
+Invalidation comes from two places:
+  • FastAPI routers call invalidate_tenant() directly
+  • Django views publish on INVALIDATION_CHANNEL (see core/signals.py) and
+    the listener thread started from main.py drops the local snapshot
+"""
+import json
+import os
+import threading
+import time
+from itertools import count
+from types import SimpleNamespace
+
+from app import models
+from app.business_hours import compile_schedule, get_timezone
+from app.keyword_matcher import build_rule_matcher
+from app.logging_config import get_logger
+from app.replies import render_replies
+from app.redis_client import get_redis
+
+TENANT_CACHE_TTL     = int(os.getenv("TENANT_CACHE_TTL", 300))  # seconds
+INVALIDATION_CHANNEL = "botmart:tenant_config"
+
+logger = get_logger("tenant_cache")
+
+CLIENT_FIELDS = (
+    "id", "business_name", "email", "phone_number_id", "access_token",
+    "token_valid", "plan", "grace_period_end", "business_description",
+    "timezone",
+)
+PRODUCT_FIELDS = (
+    "id", "name", "description", "price", "image_url", "category", "keyword",
+)
+RULE_FIELDS = ("id", "trigger_keyword", "response_text")
+TEMPLATE_FIELDS = (
+    "welcome_message", "menu_message", "closed_message",
+    "handoff_message", "fallback_message",
+)
+HOURS_FIELDS = ("day_of_week", "open_time", "close_time")
+
+
+class TenantConfig:
+    """Read-only snapshot of one tenant's bot configuration."""
+
+    def __init__(self, version, client, products, rules, template, business_hours):
+        self.version        = version
+        self.client         = client
+        self.products       = products
+        self.rules          = rules
+        self.template       = template
+        self.business_hours = business_hours
+        self.rule_matcher   = build_rule_matcher(rules)
+        self.schedule       = compile_schedule(business_hours)
+        self.timezone       = get_timezone(client.timezone)
+        self.loaded_at      = time.monotonic()
+
+        # Product index — replaces the per-message category ILIKE and
+        # keyword queries. Products are in id order, so the first product
+        # for a keyword is the one `.first()` used to return.
+        self.products_by_category = {}
+        self.products_by_keyword  = {}
+        for product in products:
+            if product.category:
+                self.products_by_category.setdefault(product.category.lower(), []).append(product)
+            self.products_by_keyword.setdefault(product.keyword, product)
+
+        # Welcome/menu/listing text, rendered once for this snapshot
+        self.replies = render_replies(
+            client.business_name, products, rules, template,
+            self.products_by_category, self.products_by_keyword,
+        )
+
+
+class _Flight:
+    """One in-progress load that concurrent misses wait on."""
+
+    def __init__(self):
+        self.done   = threading.Event()
+        self.config = None
+        self.failed = False
+
+
+_MISSING = object()
+
+_lock        = threading.Lock()
+_entries     = {}   # phone_number_id → (TenantConfig | None, loaded_at)
+_generations = {}   # phone_number_id → bumped on every invalidation
+_client_keys = {}   # client_id → phone_number_id
+_in_flight   = {}   # phone_number_id → _Flight
+_versions    = count(1)
+
+_stats = {
+    "hits":          0,
+    "misses":        0,
+    "loads":         0,
+    "coalesced":     0,
+    "invalidations": 0,
+}
+
+
+def _snapshot(row, fields):
+    return SimpleNamespace(**{field: getattr(row, field) for field in fields})
+
+
+def load_tenant_config(db, phone_number_id):
+    """Load a fresh snapshot straight from the DB. Returns None for unknown numbers."""
+    client = db.query(models.Client).filter(
+        models.Client.phone_number_id == phone_number_id,
+        models.Client.is_active == True
+    ).first()
+
+    if not client:
+        return None
+
+    products = db.query(models.Product).filter(
+        models.Product.client_id == client.id,
+        models.Product.is_active == True
+    ).order_by(models.Product.id).all()
+
+    rules = db.query(models.AutoReplyRule).filter(
+        models.AutoReplyRule.client_id == client.id,
+        models.AutoReplyRule.is_active == True
+    ).order_by(models.AutoReplyRule.id).all()
+
+    template = db.query(models.MessageTemplate).filter(
+        models.MessageTemplate.client_id == client.id
+    ).first()
+
+    hours = db.query(models.BusinessHours).filter(
+        models.BusinessHours.client_id == client.id,
+        models.BusinessHours.is_open == True
+    ).order_by(models.BusinessHours.id).all()
+
+    return TenantConfig(
+        version        = next(_versions),
+        client         = _snapshot(client, CLIENT_FIELDS),
+        products       = [_snapshot(p, PRODUCT_FIELDS) for p in products],
+        rules          = [_snapshot(r, RULE_FIELDS) for r in rules],
+        template       = _snapshot(template, TEMPLATE_FIELDS) if template else None,
+        business_hours = [_snapshot(h, HOURS_FIELDS) for h in hours],
+    )
+
+
+def get_tenant_config(db, phone_number_id):
+    """
+    Return the cached TenantConfig for phone_number_id, loading it if needed.
+    Concurrent misses for the same tenant share a single DB load.
+    """
+    with _lock:
+        entry = _entries.get(phone_number_id, _MISSING)
+        if entry is not _MISSING and time.monotonic() - entry[1] < TENANT_CACHE_TTL:
+            _stats["hits"] += 1
+            return entry[0]
+
+        _stats["misses"] += 1
+        flight = _in_flight.get(phone_number_id)
+        if flight:
+            _stats["coalesced"] += 1
+            leader = False
+        else:
+            flight     = _Flight()
+            generation = _generations.get(phone_number_id, 0)
+            _in_flight[phone_number_id] = flight
+            leader = True
+
+    if not leader:
+        flight.done.wait()
+        if not flight.failed:
+            return flight.config
+        # The leader's load blew up — fall through and try ourselves
+        return load_tenant_config(db, phone_number_id)
+
+    try:
+        config = load_tenant_config(db, phone_number_id)
+    except Exception:
+        flight.failed = True
+        raise
+    else:
+        flight.config = config
+        with _lock:
+            _stats["loads"] += 1
+            # Only cache if nothing was invalidated while we were loading
+            if _generations.get(phone_number_id, 0) == generation:
+                _entries[phone_number_id] = (config, time.monotonic())
+                if config:
+                    _client_keys[config.client.id] = phone_number_id
+        return config
+    finally:
+        with _lock:
+            _in_flight.pop(phone_number_id, None)
+        flight.done.set()
+
+
+def _drop(phone_number_id=None, client_id=None):
+    with _lock:
+        keys = set()
+        if phone_number_id:
+            keys.add(phone_number_id)
+        if client_id is not None and client_id in _client_keys:
+            keys.add(_client_keys.pop(client_id))
+
+        for key in keys:
+            _entries.pop(key, None)
+            _generations[key] = _generations.get(key, 0) + 1
+        _stats["invalidations"] += 1
+
+
+def invalidate_tenant(phone_number_id=None, client_id=None):
+    """Drop a tenant's snapshot here and tell every other worker to do the same."""
+    _drop(phone_number_id, client_id)
+
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        r.publish(INVALIDATION_CHANNEL, json.dumps({
+            "phone_number_id": phone_number_id,
+            "client_id":       client_id,
+        }))
+    except Exception as e:
+        logger.warning("Could not publish tenant invalidation", extra={"error": str(e)})
+
+
+def clear_tenant_cache():
+    with _lock:
+        for key in set(_entries) | set(_in_flight):
+            _generations[key] = _generations.get(key, 0) + 1
+        _entries.clear()
+        _client_keys.clear()
+
+
+def get_cache_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["size"] = len(_entries)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    return stats
+
+
+# ─────────────────────────────────────────────
+# CROSS-PROCESS INVALIDATION LISTENER
+# ─────────────────────────────────────────────
+
+# Other in-process caches (e.g. contact_cache) ride on the same listener
+# thread: channel -> (handler(payload), on_reconnect())
+_channel_handlers = {}
+
+
+def register_invalidation_handler(channel, handler, on_reconnect):
+    """Have the listener thread also dispatch `channel` messages to `handler`."""
+    _channel_handlers[channel] = (handler, on_reconnect)
+
+
+def _handle_tenant_invalidation(payload):
+    _drop(payload.get("phone_number_id"), payload.get("client_id"))
+
+
+register_invalidation_handler(INVALIDATION_CHANNEL, _handle_tenant_invalidation, clear_tenant_cache)
+
+
+def _listen_for_invalidations():
+    while True:
+        r = get_redis()
+        try:
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(*_channel_handlers)
+            for message in pubsub.listen():
+                try:
+                    payload = json.loads(message["data"])
+                except (TypeError, ValueError):
+                    continue
+                handler, _ = _channel_handlers.get(message["channel"], (None, None))
+                if handler:
+                    handler(payload)
+        except Exception as e:
+            logger.warning("Invalidation listener error, reconnecting in 5s", extra={"error": str(e)})
+            # Anything published while we were disconnected is lost
+            for _, on_reconnect in _channel_handlers.values():
+                on_reconnect()
+            time.sleep(5)
+
+
+def start_invalidation_listener():
+    """Subscribe to invalidations published by Django. No-op without Redis."""
+    if get_redis() is None:
+        logger.info("REDIS_URL not set, relying on TTL for cross-process updates")
+        return None
+
+    thread = threading.Thread(
+        target=_listen_for_invalidations,
+        name="tenant-cache-invalidation",
+        daemon=True,
+    )
+    thread.start()
+    return thread
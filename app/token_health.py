@@ -0,0 +1,198 @@
+"""
+Per-tenant WhatsApp token health.
+
+A tenant whose access token Graph rejected (codes 190, 102, 10) used to
+keep making doomed send calls for every message, and each rejection opened
+a fresh DB session inside the send path to flag the token. Now:
+
+  • sends for a number with a known-bad token are skipped without calling
+    Graph — the state comes from the tenant snapshot's token_valid, plus
+    flags this process raised that haven't reached the DB yet
+  • flagging is asynchronous: the send path only marks the number and
+    queues the write; one background thread sets clients.token_valid and
+    invalidates the tenant, once per number (deduplicated across workers
+    through Redis)
+  • the flag clears when the token is fixed — update_token saves a
+    verified token with token_valid=True and the dashboard's save signal
+    reloads every worker's snapshot; revalidate_tokens() (scheduled every
+    TOKEN_REVALIDATE_MINUTES) also re-tests tokens flagged for an expired
+    or revoked token (code 190, kept in clients.token_error_code) and
+    clears the ones that work again. A permission error (code 10) isn't
+    re-tested: GET /{phone_number_id} succeeds without the messaging
+    permission, so only a token update clears it
+"""
+import os
+import queue
+import threading
+
+from app import graph_client, models
+from app.database import SessionLocal
+from app.logging_config import get_logger
+from app.metrics import Counter
+from app.redis_client import get_redis
+from app.tenant_cache import invalidate_tenant
+
+TOKEN_ERROR_CODES        = {190, 102, 10}
+REVALIDATE_CODES         = {190}   # errors a successful GET /{phone_number_id} proves gone
+TOKEN_FLAG_DEDUP_SECONDS = int(os.getenv("TOKEN_FLAG_DEDUP_SECONDS", 60))
+TOKEN_REVALIDATE_MINUTES = int(os.getenv("TOKEN_REVALIDATE_MINUTES", 15))
+
+logger = get_logger("token_health")
+
+TOKEN_SKIPPED_SENDS = Counter(
+    "botmart_token_skipped_sends_total",
+    "Sends skipped because the tenant's access token is known to be invalid",
+    ["phone_number_id"],
+)
+
+_lock     = threading.Lock()
+_blocked  = {}      # phone_number_id -> access token known to be bad
+_pending  = set()   # flagged here, DB write not done yet
+_flags    = queue.SimpleQueue()
+_thread   = None
+
+
+# ─────────────────────────────────────────────
+# SEND-PATH CHECKS
+# ─────────────────────────────────────────────
+
+def observe(client):
+    """
+    Sync the local state with a tenant snapshot — called whenever a
+    message's tenant config is loaded.
+    """
+    pid = client.phone_number_id
+    with _lock:
+        if not client.token_valid:
+            _blocked[pid] = client.access_token
+        elif pid in _blocked and pid not in _pending:
+            # Token replaced, or re-verified (update_token / revalidation)
+            del _blocked[pid]
+
+
+def is_blocked(phone_number_id, access_token):
+    """True if this token is known to be bad — the send would only fail."""
+    with _lock:
+        blocked = _blocked.get(phone_number_id) == access_token
+    if blocked:
+        TOKEN_SKIPPED_SENDS.inc(phone_number_id=str(phone_number_id))
+    return blocked
+
+
+def flag_token_error(phone_number_id, access_token, error_code):
+    """Mark a number's token bad now; the DB write happens in the background."""
+    with _lock:
+        if _blocked.get(phone_number_id) == access_token:
+            return   # already known
+        _blocked[phone_number_id] = access_token
+        _pending.add(phone_number_id)
+    logger.error("Token error detected", extra={"phone_number_id": phone_number_id, "code": error_code})
+    _flags.put((phone_number_id, access_token, error_code))
+    _start()
+
+
+# ─────────────────────────────────────────────
+# BACKGROUND FLAG WRITER
+# ─────────────────────────────────────────────
+
+def _claim_flag(phone_number_id):
+    """One worker writes the flag; the others learn it from the tenant invalidation."""
+    r = get_redis()
+    if r is None:
+        return True
+    try:
+        return bool(r.set(f"botmart:token-flag:{phone_number_id}", 1, nx=True, ex=TOKEN_FLAG_DEDUP_SECONDS))
+    except Exception as e:
+        logger.warning("Could not dedupe token flag through Redis", extra={"error": str(e)})
+        return True
+
+
+def _write_flag(phone_number_id, access_token, error_code):
+    db = SessionLocal()
+    try:
+        client = db.query(models.Client).filter(
+            models.Client.phone_number_id == phone_number_id
+        ).first()
+        # Skip if the token was replaced since the failed send
+        if client and client.token_valid and client.access_token == access_token:
+            client.token_valid      = False
+            client.token_error_code = error_code
+            db.commit()
+            logger.warning("Flagged token error", extra={
+                "client_id": client.id, "business": client.business_name, "code": error_code,
+            })
+            # Only now — a snapshot reloaded before the commit would still say token_valid
+            invalidate_tenant(phone_number_id, client.id)
+    finally:
+        db.close()
+
+
+def _handle_flag(phone_number_id, access_token, error_code):
+    try:
+        # Losers don't invalidate: the winner may not have committed yet,
+        # and its invalidation reaches every worker once it has
+        if _claim_flag(phone_number_id):
+            _write_flag(phone_number_id, access_token, error_code)
+    except Exception:
+        logger.exception("Error flagging token", extra={"phone_number_id": phone_number_id})
+    finally:
+        with _lock:
+            _pending.discard(phone_number_id)
+
+
+def _run():
+    while True:
+        _handle_flag(*_flags.get())
+
+
+def _start():
+    global _thread
+    if _thread is not None:
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_run, name="token-flagger", daemon=True)
+        _thread.start()
+
+
+# ─────────────────────────────────────────────
+# RE-VALIDATION
+# ─────────────────────────────────────────────
+
+def revalidate_tokens():
+    """Re-test tokens flagged as expired or revoked and clear the ones that work again."""
+    db = SessionLocal()
+    try:
+        clients = db.query(models.Client).filter(
+            models.Client.token_valid == False,
+            models.Client.token_error_code.in_(REVALIDATE_CODES),
+            models.Client.is_active == True,
+            models.Client.phone_number_id != None,
+            models.Client.access_token != None,
+        ).all()
+
+        for client in clients:
+            try:
+                response = graph_client.get(f"/{client.phone_number_id}", client.access_token)
+                result   = response.json()
+            except Exception as e:
+                logger.warning("Token re-validation failed", extra={"client_id": client.id, "error": str(e)})
+                continue
+            if response.status_code != 200 or "error" in result:
+                continue
+
+            client.token_valid      = True
+            client.token_error_code = None
+            db.commit()
+            invalidate_tenant(client.phone_number_id, client.id)
+            logger.info("Token valid again, flag cleared", extra={"client_id": client.id})
+    except Exception:
+        logger.exception("Token re-validation pass failed")
+    finally:
+        db.close()
+
+
+def get_token_health_stats():
+    with _lock:
+        return {"blocked": sorted(_blocked), "pending": sorted(_pending)}
@@ -0,0 +1,158 @@
+"""
+Webhook processing worker.
+
+Consumes the durable per-lane queues filled by POST /webhook/ and runs each
+payload through the same pipeline the inline lane threads use. Each worker
+thread takes the lease on a lane, drains it in order, and lets it go when
+it has been idle for a moment, so every conversation is handled by one
+worker at a time while different lanes run in parallel. Run as many of
+these as you need, on as many machines as you need:
+
+    MESSAGE_QUEUE_BACKEND=redis python -m app.worker
+"""
+import os
+import random
+import signal
+import socket
+import threading
+import time
+
+from app.lanes import LANE_COUNT, lane_queue_name, make_lane_lease
+from app.log_writer import close_log_writer
+from app.logging_config import get_logger
+from app.message_queue import get_queue, queue_enabled, MESSAGE_QUEUE_BACKEND, MESSAGE_QUEUE_MAX_ATTEMPTS
+from app.metrics import start_metrics_server
+from app.routers.webhook import handle_payload
+from app.send_retry import start_send_retry_worker
+from app.tenant_cache import start_invalidation_listener
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 4))  # threads per process
+WORKER_IDLE_SLEEP  = float(os.getenv("WORKER_IDLE_SLEEP", 0.5))  # seconds between lane sweeps
+LANE_IDLE_RELEASE  = float(os.getenv("LANE_IDLE_RELEASE", 1.0))  # give a lane up after this long empty
+
+RETRY_BACKOFF_MAX = 30  # seconds
+
+logger = get_logger("worker")
+
+_stopping = threading.Event()
+
+
+def run_head(queue, lease, job):
+    """
+    Process the head of a lane until it succeeds or runs out of attempts.
+    The head is retried in place rather than skipped, so later messages
+    from the same customer never overtake it. job.attempts starts from the
+    queue's delivery count, so claims by workers that died count too.
+    """
+    attempts = job.attempts
+    while True:
+        # The heartbeat couldn't renew the lease — another worker may own the lane now
+        if lease.lost.is_set():
+            logger.warning("Lost lane lease before job", extra={"job_id": job.id})
+            return False
+        try:
+            handle_payload(job.payload)
+        except Exception as e:
+            logger.warning("Job failed", extra={"job_id": job.id, "attempt": attempts, "error": str(e)})
+        else:
+            queue.ack(job)
+            return True
+
+        if attempts >= MESSAGE_QUEUE_MAX_ATTEMPTS:
+            queue.dead_letter(job)
+            return True
+
+        if _stopping.wait(min(2 ** attempts, RETRY_BACKOFF_MAX)):
+            return False  # left on the queue for the next owner
+        if not lease.renew():
+            logger.warning("Lost lane lease while retrying job", extra={"job_id": job.id})
+            return False
+        attempts += 1
+
+
+def drain_lane(lane, lease):
+    queue = get_queue(lane_queue_name(lane))
+    idle_since = time.monotonic()
+
+    while not _stopping.is_set():
+        job = queue.claim_head(block_ms=int(WORKER_IDLE_SLEEP * 1000))
+        if job is None:
+            if time.monotonic() - idle_since >= LANE_IDLE_RELEASE:
+                return
+            _stopping.wait(WORKER_IDLE_SLEEP / 5)
+            continue
+
+        if not run_head(queue, lease, job):
+            return
+        if not lease.renew():
+            logger.warning("Lost lane lease", extra={"lane": lane})
+            return
+        idle_since = time.monotonic()
+
+
+def consume(owner):
+    lanes = list(range(LANE_COUNT))
+    while not _stopping.is_set():
+        # Start each sweep somewhere different so threads don't all fight over lane 0
+        start  = random.randrange(LANE_COUNT)
+        worked = False
+
+        for lane in lanes[start:] + lanes[:start]:
+            if _stopping.is_set():
+                break
+
+            lease = make_lane_lease(lane, owner)
+            try:
+                if not lease.acquire():
+                    continue
+            except Exception as e:
+                logger.error("Could not acquire lane", extra={"lane": lane, "error": str(e)})
+                _stopping.wait(5)
+                continue
+
+            worked = True
+            try:
+                drain_lane(lane, lease)
+            except Exception:
+                logger.exception("Lane error", extra={"lane": lane})
+                _stopping.wait(5)
+            finally:
+                lease.release()
+
+        if not worked:
+            _stopping.wait(WORKER_IDLE_SLEEP)
+
+
+def main():
+    if not queue_enabled():
+        raise SystemExit(
+            f"MESSAGE_QUEUE_BACKEND is '{MESSAGE_QUEUE_BACKEND}' — set it to 'redis' or 'postgres' to run workers"
+        )
+
+    start_invalidation_listener()
+    start_metrics_server()
+    start_send_retry_worker()
+
+    # Finish the jobs in hand on SIGTERM/SIGINT, leave the rest on the queue
+    signal.signal(signal.SIGTERM, lambda *_: _stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: _stopping.set())
+
+    host    = f"{socket.gethostname()}-{os.getpid()}"
+    threads = [
+        threading.Thread(target=consume, args=(f"{host}-{i}",), name=f"worker-{i}")
+        for i in range(WORKER_CONCURRENCY)
+    ]
+    for thread in threads:
+        thread.start()
+
+    logger.info("Worker started", extra={
+        "consumers": WORKER_CONCURRENCY, "lanes": LANE_COUNT, "backend": MESSAGE_QUEUE_BACKEND,
+    })
+    while any(thread.is_alive() for thread in threads):
+        time.sleep(0.5)
+    close_log_writer()
+    logger.info("Worker stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Micro-benchmark: compiled KeywordMatcher vs the old linear rule scan.
+
+Run from the project root:
+    python -m benchmarks.bench_keyword_matcher
+"""
+import random
+import string
+import timeit
+from types import SimpleNamespace
+
+from app.keyword_matcher import build_rule_matcher
+
+RULE_COUNTS = (10, 100, 1000)
+MESSAGES    = 200
+REPEAT      = 5
+
+
+def make_rules(n, rng):
+    keywords = set()
+    while len(keywords) < n:
+        keywords.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))))
+    return [
+        SimpleNamespace(trigger_keyword=kw, response_text=f"reply {i}")
+        for i, kw in enumerate(sorted(keywords))
+    ]
+
+
+def make_messages(rules, rng):
+    words = ["hello", "how", "much", "is", "delivery", "to", "lekki", "please", "thanks"]
+    messages = []
+    for _ in range(MESSAGES):
+        text = " ".join(rng.choices(words, k=rng.randint(3, 12)))
+        # Roughly a third of customers type something that hits a rule
+        if rng.random() < 0.33:
+            text += " " + rng.choice(rules).trigger_keyword
+        messages.append(text)
+    return messages
+
+
+def linear_scan(rules, text):
+    for rule in rules:
+        if rule.trigger_keyword in text:
+            return rule
+    return None
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'rules':>6} {'linear µs/msg':>15} {'matcher µs/msg':>15} {'speed-up':>9}")
+
+    for n in RULE_COUNTS:
+        rules    = make_rules(n, rng)
+        messages = make_messages(rules, rng)
+        matcher  = build_rule_matcher(rules)
+
+        for text in messages:
+            assert matcher.search(text) is linear_scan(rules, text)
+
+        linear = min(timeit.repeat(
+            lambda: [linear_scan(rules, t) for t in messages], number=1, repeat=REPEAT
+        ))
+        compiled = min(timeit.repeat(
+            lambda: [matcher.search(t) for t in messages], number=1, repeat=REPEAT
+        ))
+
+        print(
+            f"{n:>6} {linear / MESSAGES * 1e6:>15.2f} "
+            f"{compiled / MESSAGES * 1e6:>15.2f} {linear / compiled:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
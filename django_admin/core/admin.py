@@ -11,7 +11,7 @@ from passlib.context import CryptContext
 from .models import (
     Client, AutoReplyRule, MessageLog, BusinessHours,
     Product, MessageTemplate, PasswordResetToken,
-    SubscriptionPlan, EmailCampaign, CampaignLog, PaymentLog
+    SubscriptionPlan, EmailCampaign, CampaignLog, PaymentLog, AIUsageDaily
 )
 from .email_helper import send_activation_email
 
@@ -343,6 +343,21 @@ class MessageLogAdmin(admin.ModelAdmin):
         return False
 
 
+# ─────────────────────────────────────────────
+# AI USAGE ADMIN
+# ─────────────────────────────────────────────
+
+@admin.register(AIUsageDaily)
+class AIUsageDailyAdmin(admin.ModelAdmin):
+    list_display  = ['client', 'day', 'replies']
+    list_filter   = ['client', ('day', admin.DateFieldListFilter)]
+    search_fields = ['client__business_name']
+    readonly_fields = ['client', 'day', 'replies']
+
+    def has_add_permission(self, request):
+        return False   # rows are written by the webhook
+
+
 # ─────────────────────────────────────────────
 # PRODUCT ADMIN
 # ─────────────────────────────────────────────
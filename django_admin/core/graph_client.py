@@ -0,0 +1,66 @@
+# core/graph_client.py
+#
+# Pooled keep-alive client for Meta Graph API calls made by the dashboard
+# (Meta setup, token checks, webhook unsubscribe). Mirrors app/graph_client.py
+# on the FastAPI side so both apps reuse connections to graph.facebook.com
+# and never wait on Meta without a timeout.
+
+import logging
+import os
+import threading
+import time
+
+import httpx
+
+try:
+    import h2  # noqa: F401 — only needed to enable HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+GRAPH_API_URL         = 'https://graph.facebook.com/v19.0'
+GRAPH_CONNECT_TIMEOUT = float(os.getenv('GRAPH_CONNECT_TIMEOUT', 5))
+GRAPH_READ_TIMEOUT    = float(os.getenv('GRAPH_READ_TIMEOUT', 10))
+GRAPH_POOL_SIZE       = int(os.getenv('GRAPH_POOL_SIZE', 10))
+
+_client      = None
+_client_lock = threading.Lock()
+
+
+def get_graph_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(
+                    base_url=GRAPH_API_URL,
+                    http2=HTTP2_AVAILABLE,
+                    timeout=httpx.Timeout(GRAPH_READ_TIMEOUT, connect=GRAPH_CONNECT_TIMEOUT),
+                    limits=httpx.Limits(
+                        max_connections=GRAPH_POOL_SIZE,
+                        max_keepalive_connections=GRAPH_POOL_SIZE,
+                    ),
+                )
+    return _client
+
+
+def request(method, path, access_token, **kwargs):
+    """Send one Graph API request. Raises httpx.HTTPError on network failure."""
+    headers = kwargs.pop('headers', {})
+    headers['Authorization'] = f'Bearer {access_token}'
+
+    started = time.perf_counter()
+    try:
+        return get_graph_client().request(method, path, headers=headers, **kwargs)
+    finally:
+        logger.debug(f"Graph {method} {path} took {(time.perf_counter() - started) * 1000:.0f}ms")
+
+
+def get(path, access_token, **kwargs):
+    return request('GET', path, access_token, **kwargs)
+
+
+def delete(path, access_token, **kwargs):
+    return request('DELETE', path, access_token, **kwargs)
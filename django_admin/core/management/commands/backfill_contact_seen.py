@@ -0,0 +1,70 @@
+# core/management/commands/backfill_contact_seen.py
+#
+# Populates contacts.first_seen_at / last_seen_at from existing inbound
+# message_logs, so the webhook's new-user check never has to search the
+# log for those contacts. Safe to re-run: it only moves first_seen_at
+# earlier and last_seen_at later.
+#
+#   python manage.py backfill_contact_seen
+#   python manage.py backfill_contact_seen --client 42
+
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min, Max
+
+from core.models import Client, Contact, MessageLog
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Fill contacts.first_seen_at/last_seen_at from inbound message logs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', type=int, help='Only backfill this client id')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        clients = Client.objects.all().order_by('id')
+        if options['client']:
+            clients = clients.filter(id=options['client'])
+
+        total = 0
+        for client in clients:
+            updated = self.backfill_client(client, options['batch_size'])
+            total  += updated
+            if updated:
+                self.stdout.write(f'{client.business_name}: {updated} contacts updated')
+
+        self.stdout.write(self.style.SUCCESS(f'Done — {total} contacts updated'))
+
+    def backfill_client(self, client, batch_size):
+        seen = {
+            row['sender_number']: (row['first'], row['last'])
+            for row in MessageLog.objects.filter(client=client, direction='inbound')
+            .values('sender_number')
+            .annotate(first=Min('timestamp'), last=Max('timestamp'))
+        }
+        if not seen:
+            return 0
+
+        changed  = []
+        contacts = Contact.objects.filter(client=client, phone_number__in=list(seen))
+        for contact in contacts.iterator(chunk_size=batch_size):
+            first, last = seen[contact.phone_number]
+            dirty = False
+            if contact.first_seen_at is None or first < contact.first_seen_at:
+                contact.first_seen_at = first
+                dirty = True
+            if contact.last_seen_at is None or last > contact.last_seen_at:
+                contact.last_seen_at = last
+                dirty = True
+            if dirty:
+                changed.append(contact)
+
+        # bulk_update skips post_save, so webhook workers pick this up when
+        # their contact cache entries expire (CONTACT_CACHE_TTL)
+        Contact.objects.bulk_update(changed, ['first_seen_at', 'last_seen_at'], batch_size=batch_size)
+        logger.info(f"Backfilled seen timestamps for {len(changed)} contacts of client {client.id}")
+        return len(changed)
@@ -0,0 +1,51 @@
+import datetime
+
+from django.db import migrations, models
+
+# The FastAPI app creates webhook_queue with create_all() on start-up, so a
+# database may already have it — create it only where it is missing.
+CREATE_WEBHOOK_QUEUE = """
+CREATE TABLE IF NOT EXISTS webhook_queue (
+    id         serial PRIMARY KEY,
+    queue      varchar NOT NULL,
+    payload    text NOT NULL,
+    attempts   integer NOT NULL,
+    visible_at timestamp NOT NULL,
+    dead_at    timestamp NULL,
+    created_at timestamp NULL
+);
+CREATE INDEX IF NOT EXISTS webhook_queue_claim_idx ON webhook_queue (queue, visible_at, id);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_product_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_WEBHOOK_QUEUE, 'DROP TABLE IF EXISTS webhook_queue;'),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='QueuedWebhook',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('queue', models.CharField(default='webhook:inbound', max_length=255)),
+                        ('payload', models.TextField()),
+                        ('attempts', models.IntegerField(default=0)),
+                        ('visible_at', models.DateTimeField(default=datetime.datetime.utcnow)),
+                        ('dead_at', models.DateTimeField(blank=True, null=True)),
+                        ('created_at', models.DateTimeField(default=datetime.datetime.utcnow, null=True)),
+                    ],
+                    options={
+                        'db_table': 'webhook_queue',
+                        'indexes': [models.Index(fields=['queue', 'visible_at', 'id'], name='webhook_queue_claim_idx')],
+                    },
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def dedupe_contacts(apps, schema_editor):
+    """Keep the oldest row per (client, phone_number) so the unique constraint can be added."""
+    Contact = apps.get_model('core', 'Contact')
+
+    duplicates = (
+        Contact.objects.values('client_id', 'phone_number')
+        .annotate(n=Count('id'), keep=Min('id'))
+        .filter(n__gt=1)
+    )
+    for dup in duplicates:
+        rows = Contact.objects.filter(client_id=dup['client_id'], phone_number=dup['phone_number'])
+        # An opt-out on any copy must survive the merge
+        if rows.filter(opted_out=True).exists():
+            rows.filter(id=dup['keep']).update(opted_out=True)
+        rows.exclude(id=dup['keep']).delete()
+
+
+def seed_contact_seq(apps, schema_editor):
+    """Start each tenant's sequence where the old COUNT(*) naming left off."""
+    Client  = apps.get_model('core', 'Client')
+    Contact = apps.get_model('core', 'Contact')
+
+    counts = Contact.objects.values('client_id').annotate(n=Count('id'))
+    for row in counts:
+        Client.objects.filter(id=row['client_id']).update(contact_seq=row['n'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_queuedwebhook'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_contacts, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='client',
+            name='contact_seq',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(seed_contact_seq, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='contact',
+            constraint=models.UniqueConstraint(fields=('client', 'phone_number'), name='contacts_client_phone_uniq'),
+        ),
+    ]
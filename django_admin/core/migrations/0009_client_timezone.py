@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_contact_seen_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='timezone',
+            field=models.CharField(default='Africa/Lagos', max_length=64),
+        ),
+    ]
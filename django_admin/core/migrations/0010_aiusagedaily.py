@@ -0,0 +1,39 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def seed_today_usage(apps, schema_editor):
+    """Carry each client's running daily counter into the ledger so today's limit still holds."""
+    Client       = apps.get_model('core', 'Client')
+    AIUsageDaily = apps.get_model('core', 'AIUsageDaily')
+
+    rows = Client.objects.filter(ai_replies_reset_date__isnull=False, ai_replies_used__gt=0)
+    AIUsageDaily.objects.bulk_create([
+        AIUsageDaily(client_id=client.id, day=client.ai_replies_reset_date, replies=client.ai_replies_used)
+        for client in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_client_timezone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('replies', models.IntegerField(default=0)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ai_usage', to='core.client')),
+            ],
+            options={
+                'db_table': 'ai_usage_daily',
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('client', 'day'), name='ai_usage_daily_client_day_uniq')],
+            },
+        ),
+        migrations.RunPython(seed_today_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_aiusagedaily'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='token_error_code',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,49 @@
+import datetime
+
+from django.db import migrations, models
+
+# The FastAPI app creates whatsapp_media with create_all() on start-up, so a
+# database may already have it — create it only where it is missing.
+CREATE_WHATSAPP_MEDIA = """
+CREATE TABLE IF NOT EXISTS whatsapp_media (
+    id              serial PRIMARY KEY,
+    phone_number_id varchar NOT NULL,
+    image_url       text NOT NULL,
+    media_id        varchar NOT NULL,
+    expires_at      timestamp NOT NULL,
+    created_at      timestamp NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS whatsapp_media_number_url_uniq ON whatsapp_media (phone_number_id, image_url);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_client_token_error_code'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_WHATSAPP_MEDIA, 'DROP TABLE IF EXISTS whatsapp_media;'),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='WhatsAppMedia',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('phone_number_id', models.CharField(max_length=255)),
+                        ('image_url', models.TextField()),
+                        ('media_id', models.CharField(max_length=255)),
+                        ('expires_at', models.DateTimeField()),
+                        ('created_at', models.DateTimeField(default=datetime.datetime.utcnow, null=True)),
+                    ],
+                    options={
+                        'db_table': 'whatsapp_media',
+                        'constraints': [models.UniqueConstraint(fields=('phone_number_id', 'image_url'), name='whatsapp_media_number_url_uniq')],
+                    },
+                ),
+            ],
+        ),
+    ]
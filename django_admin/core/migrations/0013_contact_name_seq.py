@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+def create_contact_name_seq(apps, schema_editor):
+    """
+    Auto-named contacts are numbered from one sequence shared by all tenants.
+    It starts above every tenant's contact_seq, so no auto-name is reused.
+    SQLite (tests) has no sequences; the webhook counts contacts there.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # The FastAPI app's create_all() may have made it already
+    schema_editor.execute("CREATE SEQUENCE IF NOT EXISTS contact_name_seq")
+    schema_editor.execute(
+        "SELECT setval('contact_name_seq', GREATEST("
+        "(SELECT last_value FROM contact_name_seq), "
+        "(SELECT COALESCE(MAX(contact_seq), 0) + 1 FROM clients)))"
+    )
+
+
+def drop_contact_name_seq(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP SEQUENCE IF EXISTS contact_name_seq")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_whatsappmedia'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_contact_name_seq, drop_contact_name_seq),
+        migrations.RemoveField(
+            model_name='client',
+            name='contact_seq',
+        ),
+    ]
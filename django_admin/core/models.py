@@ -1,8 +1,10 @@
 from django.db import models
+from django.db.models.functions import Lower
 import secrets
 from django.utils import timezone
 from datetime import timedelta
 from datetime import datetime
+from datetime import date
 
 def is_valid(self):
     now = datetime.now()  # naive datetime to match database
@@ -17,6 +19,7 @@ class Client(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     token_valid = models.BooleanField(default=True)
+    token_error_code = models.IntegerField(null=True, blank=True)  # Graph error code that set token_valid=False
     plan = models.CharField(max_length=20, default='starter')
     payment_status = models.CharField(max_length=20, default='unpaid')
     payment_reference = models.CharField(max_length=100, blank=True, null=True)
@@ -29,12 +32,18 @@ class Client(models.Model):
     ai_replies_used = models.IntegerField(default=0)
     ai_replies_reset_date = models.DateField(null=True, blank=True)
     business_description = models.TextField(blank=True, null=True)
+    timezone = models.CharField(max_length=64, default='Africa/Lagos')  # business hours are in this zone
     class Meta:
         db_table = 'clients'  # reuse existing table
 
     def __str__(self):
         return self.business_name
 
+    def ai_replies_today(self):
+        """Today's AI replies from the ai_usage_daily ledger (ai_replies_used is no longer updated)."""
+        usage = self.ai_usage.filter(day=date.today()).first()
+        return usage.replies if usage else 0
+
 
 class AutoReplyRule(models.Model):
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='rules')
@@ -69,15 +78,15 @@ class Contact(models.Model):
     phone_number = models.CharField(max_length=50)
     opted_out = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    first_seen_at = models.DateTimeField(null=True, blank=True)  # first inbound message
+    last_seen_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = 'contacts'
-
-    def __str__(self):
-        return f"{self.name} - {self.phone_number}"
-
-    class Meta:
-        db_table = 'contacts'
+        constraints = [
+            # Lets the webhook save contacts with INSERT … ON CONFLICT DO NOTHING
+            models.UniqueConstraint(fields=['client', 'phone_number'], name='contacts_client_phone_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.phone_number}"
@@ -133,6 +142,11 @@ class Product(models.Model):
 
     class Meta:
         db_table = 'products'
+        indexes = [
+            # The webhook matches category case-insensitively and keyword exactly
+            models.Index('client', Lower('category'), name='products_client_lower_cat_idx'),
+            models.Index(fields=['client', 'keyword'], name='products_client_keyword_idx'),
+        ]
 
     def __str__(self):
         return f"{self.client.business_name} - {self.name}"
@@ -338,4 +352,60 @@ class ErrorLog(models.Model):
         ordering = ['-occurred_at']
 
     def __str__(self):
-        return f"[{self.level.upper()}] {self.exception_type} — {self.occurred_at:%d %b %Y %H:%M}"
\ No newline at end of file
+        return f"[{self.level.upper()}] {self.exception_type} — {self.occurred_at:%d %b %Y %H:%M}"
+
+
+class QueuedWebhook(models.Model):
+    """Inbound webhook payload waiting for a worker (MESSAGE_QUEUE_BACKEND=postgres)."""
+    id         = models.AutoField(primary_key=True)
+    queue      = models.CharField(max_length=255, default='webhook:inbound')
+    payload    = models.TextField()
+    attempts   = models.IntegerField(default=0)
+    visible_at = models.DateTimeField(default=datetime.utcnow)
+    dead_at    = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(null=True, default=datetime.utcnow)
+
+    class Meta:
+        db_table = 'webhook_queue'
+        indexes = [
+            models.Index(fields=['queue', 'visible_at', 'id'], name='webhook_queue_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.queue} #{self.id}"
+
+
+class AIUsageDaily(models.Model):
+    """AI replies per client per day, written by the webhook's atomic upsert."""
+    client  = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='ai_usage')
+    day     = models.DateField()
+    replies = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'ai_usage_daily'
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=('client', 'day'), name='ai_usage_daily_client_day_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.client.business_name} — {self.day}: {self.replies}"
+
+
+class WhatsAppMedia(models.Model):
+    """A product image uploaded to a phone number's WhatsApp media store (see app/media_cache.py)."""
+    id              = models.AutoField(primary_key=True)
+    phone_number_id = models.CharField(max_length=255)
+    image_url       = models.TextField()
+    media_id        = models.CharField(max_length=255)
+    expires_at      = models.DateTimeField()
+    created_at      = models.DateTimeField(null=True, default=datetime.utcnow)
+
+    class Meta:
+        db_table = 'whatsapp_media'
+        constraints = [
+            models.UniqueConstraint(fields=('phone_number_id', 'image_url'), name='whatsapp_media_number_url_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.phone_number_id} — {self.media_id}"
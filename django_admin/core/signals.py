@@ -0,0 +1,77 @@
+# core/signals.py
+#
+# The FastAPI webhook keeps an in-process snapshot of each tenant's bot
+# configuration (app/tenant_cache.py). Whenever the dashboard changes
+# something that snapshot depends on, publish an invalidation over Redis
+# so every webhook worker reloads it on the next message. Contact edits are
+# published on their own channel for the webhook's per-sender contact cache.
+
+import json
+import logging
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Client, Product, AutoReplyRule, MessageTemplate, BusinessHours, Contact
+
+logger = logging.getLogger(__name__)
+
+TENANT_CONFIG_CHANNEL = 'botmart:tenant_config'
+CONTACT_CHANNEL       = 'botmart:contacts'
+
+_redis = None
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.TENANT_CACHE_REDIS_URL)
+    return _redis
+
+
+def _publish_on_commit(channel, payload, client_id):
+    payload = json.dumps(payload)
+
+    def _publish():
+        try:
+            _get_redis().publish(channel, payload)
+        except Exception as e:
+            # The webhook's TTL still picks the change up, just later
+            logger.warning(f"Cache invalidation on {channel} failed for client {client_id}: {e}")
+
+    # Publish only once the change is visible to other DB connections
+    transaction.on_commit(_publish)
+
+
+def publish_tenant_invalidation(client_id, phone_number_id=None):
+    _publish_on_commit(
+        TENANT_CONFIG_CHANNEL,
+        {'client_id': client_id, 'phone_number_id': phone_number_id},
+        client_id,
+    )
+
+
+def publish_contact_invalidation(client_id, phone_number):
+    _publish_on_commit(CONTACT_CHANNEL, {'client_id': client_id, 'phone_number': phone_number}, client_id)
+
+
+@receiver([post_save, post_delete], sender=Client)
+def client_changed(sender, instance, **kwargs):
+    publish_tenant_invalidation(instance.id, instance.phone_number_id)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=AutoReplyRule)
+@receiver([post_save, post_delete], sender=MessageTemplate)
+@receiver([post_save, post_delete], sender=BusinessHours)
+def tenant_config_changed(sender, instance, **kwargs):
+    publish_tenant_invalidation(instance.client_id)
+
+
+@receiver([post_save, post_delete], sender=Contact)
+def contact_changed(sender, instance, **kwargs):
+    # The webhook caches each sender's contact state (app/contact_cache.py)
+    publish_contact_invalidation(instance.client_id, instance.phone_number)
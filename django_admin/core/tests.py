@@ -1,3 +1,24 @@
+from datetime import date, timedelta
+
 from django.test import TestCase
 
-# Create your tests here.
+from .models import AIUsageDaily, Client
+
+
+class AIRepliesTodayTests(TestCase):
+    def setUp(self):
+        self.client_obj = Client.objects.create(
+            business_name='Test Shop', email='shop@example.com', hashed_password='x',
+            phone_number_id='PN1', whatsapp_number='1', access_token='tok', plan='growth',
+            # The old counter is no longer updated — it must not be read
+            ai_replies_used=99, ai_replies_reset_date=date.today(),
+        )
+
+    def test_no_usage_row_means_zero(self):
+        self.assertEqual(self.client_obj.ai_replies_today(), 0)
+
+    def test_reads_todays_ledger_row_only(self):
+        AIUsageDaily.objects.create(client=self.client_obj, day=date.today() - timedelta(days=1), replies=40)
+        AIUsageDaily.objects.create(client=self.client_obj, day=date.today(), replies=7)
+
+        self.assertEqual(self.client_obj.ai_replies_today(), 7)
@@ -20,6 +20,7 @@ from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 
 # ── Third party ──
+import pytz
 import requests as http_requests
 from passlib.context import CryptContext
 from reportlab.lib.pagesizes import A4
@@ -36,6 +37,7 @@ from .models import (
     PasswordResetToken, SubscriptionPlan, PaymentLog, ErrorLog,
 )
 from .cloudinary_helper import upload_image, delete_image
+from . import graph_client
 from .email_helper import (
     send_password_reset_email,
     send_new_client_notification,
@@ -350,9 +352,7 @@ def meta_setup(request):
             })
 
         try:
-            url      = f"https://graph.facebook.com/v19.0/{phone_number_id}"
-            headers  = {"Authorization": f"Bearer {access_token}"}
-            response = http_requests.get(url, headers=headers, timeout=10)
+            response = graph_client.get(f"/{phone_number_id}", access_token)
             result   = response.json()
 
             if "error" in result:
@@ -668,7 +668,7 @@ def dashboard(request):
 
     limits   = get_plan_limits(client.plan)
     ai_limit = limits["ai_replies"]
-    ai_used  = client.ai_replies_used or 0
+    ai_used  = client.ai_replies_today()
 
     return render(request, 'core/dashboard.html', {
         'client':               client,
@@ -793,9 +793,7 @@ def update_token(request):
             return redirect('profile')
 
         try:
-            url      = f"https://graph.facebook.com/v19.0/{phone_number_id or client.phone_number_id}"
-            headers  = {"Authorization": f"Bearer {access_token}"}
-            response = http_requests.get(url, headers=headers, timeout=10)
+            response = graph_client.get(f"/{phone_number_id or client.phone_number_id}", access_token)
             result   = response.json()
 
             if "error" in result:
@@ -823,6 +821,7 @@ def update_token(request):
             if phone_number_id:
                 client.phone_number_id = phone_number_id
             client.token_valid = True
+            client.token_error_code = None
             client.save()
             messages.success(request, '✅ Token updated and verified successfully!')
 
@@ -837,13 +836,12 @@ def test_connection(request):
     if request.method == 'POST':
         client = Client.objects.get(id=request.session['client_id'])
         try:
-            url      = f"https://graph.facebook.com/v19.0/{client.phone_number_id}"
-            headers  = {"Authorization": f"Bearer {client.access_token}"}
-            response = http_requests.get(url, headers=headers, timeout=10)
+            response = graph_client.get(f"/{client.phone_number_id}", client.access_token)
             result   = response.json()
 
             if "error" in result:
                 client.token_valid = False
+                client.token_error_code = result['error'].get('code')
                 client.save()
                 return JsonResponse({
                     'success': False,
@@ -851,6 +849,7 @@ def test_connection(request):
                 })
 
             client.token_valid = True
+            client.token_error_code = None
             client.save()
             return JsonResponse({'success': True})
 
@@ -1058,6 +1057,15 @@ def business_hours(request):
         BusinessHours.objects.filter(client=client).delete()
         has_error = False
 
+        tz_name = request.POST.get('timezone', '').strip()
+        if tz_name and tz_name != client.timezone:
+            if tz_name in pytz.all_timezones_set:
+                client.timezone = tz_name
+                client.save(update_fields=['timezone'])
+            else:
+                messages.error(request, f'Unknown timezone: {tz_name}')
+                has_error = True
+
         for day_num, day_name in days:
             is_open    = request.POST.get(f'is_open_{day_num}') == 'on'
             is_allday  = request.POST.get(f'is_allday_{day_num}') == 'on'
@@ -1110,7 +1118,8 @@ def business_hours(request):
 
     return render(request, 'core/business_hours.html', {
         'client':    client,
-        'days_data': days_data
+        'days_data': days_data,
+        'timezones': pytz.common_timezones,
     })
 
 
@@ -1473,9 +1482,7 @@ def _unsubscribe_meta_webhook(client):
             )
             return
 
-        url      = f"https://graph.facebook.com/v19.0/{client.waba_id}/subscribed_apps"
-        headers  = {"Authorization": f"Bearer {client.access_token}"}
-        response = http_requests.delete(url, headers=headers, timeout=10)
+        response = graph_client.delete(f"/{client.waba_id}/subscribed_apps", client.access_token)
         result   = response.json()
 
         if result.get("success"):
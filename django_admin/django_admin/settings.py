@@ -146,6 +146,9 @@ CELERY_TASK_SERIALIZER    = 'json'
 CELERY_RESULT_SERIALIZER  = 'json'
 CELERY_TIMEZONE           = 'Africa/Lagos'
 
+# FastAPI webhook workers listen here for tenant config invalidations
+TENANT_CACHE_REDIS_URL    = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
 # Celery Beat — runs dispatch_scheduled_campaigns every 60 seconds
 from celery.schedules import crontab
 
@@ -0,0 +1,89 @@
+"""
+Test setup for the FastAPI webhook engine.
+
+Settings are read at import time, so they are pinned here before anything
+from app/ is imported: a throwaway SQLite database, no Redis, inline lanes,
+message logs written at commit (MESSAGE_LOG_SYNC) and the strict query
+budget, so every test that runs a message also checks its SQL budget.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="botmart-tests-")
+
+os.environ["DATABASE_URL"]          = f"sqlite:///{_tmp}/test.sqlite"
+os.environ["QUERY_BUDGET_MODE"]     = "strict"
+os.environ["MESSAGE_LOG_SYNC"]      = "1"
+os.environ["MESSAGE_QUEUE_BACKEND"] = "inline"
+os.environ["AI_WORKERS"]            = "0"
+os.environ.pop("REDIS_URL", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from app import models  # noqa: E402
+from app.answer_cache import forget_answers  # noqa: E402
+from app.contact_cache import clear_contact_cache  # noqa: E402
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.dedup import clear_dedup_store  # noqa: E402
+from app.tenant_cache import clear_tenant_cache  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    clear_tenant_cache()
+    clear_contact_cache()
+    clear_dedup_store()
+    forget_answers()
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def tenant(db):
+    """A Growth-plan shop with two products and two auto-reply rules."""
+    client = models.Client(
+        business_name="Test Shop", email="shop@example.com", hashed_password="x",
+        phone_number_id="PN1", whatsapp_number="1", access_token="tok", plan="growth",
+    )
+    db.add(client)
+    db.commit()
+    db.add_all([
+        models.Product(client_id=client.id, name="Red Shoe", price="5000", category="Shoes", keyword="redshoe"),
+        models.Product(client_id=client.id, name="Cap", price="1000", category="Hats", keyword="cap"),
+        models.AutoReplyRule(client_id=client.id, trigger_keyword="price", response_text="Prices vary"),
+        models.AutoReplyRule(client_id=client.id, trigger_keyword="deliver", response_text="We deliver"),
+    ])
+    db.commit()
+    return client
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Messages the webhook would have sent, instead of calling Graph."""
+    from app.routers import webhook
+
+    outbox = []
+    monkeypatch.setattr(webhook, "send_whatsapp_message", lambda pid, token, to, text: outbox.append((to, text)))
+    monkeypatch.setattr(webhook, "send_whatsapp_image", lambda pid, token, to, url, caption: outbox.append((to, caption)))
+    monkeypatch.setattr(webhook, "send_email_notification", lambda *args, **kwargs: None)
+    monkeypatch.setattr(webhook, "try_ai_reply", lambda config, text: None)
+    return outbox
+
+
+def inbound(message_id, sender, text, phone_number_id="PN1"):
+    """A Meta webhook payload carrying one text message."""
+    return {"entry": [{"changes": [{"value": {
+        "metadata": {"phone_number_id": phone_number_id},
+        "messages": [{"from": sender, "id": message_id, "type": "text", "text": {"body": text}}],
+    }}]}]}
@@ -0,0 +1,75 @@
+"""AI usage ledger — the plan limit, and what counts as a reply."""
+import time
+from datetime import date
+from types import SimpleNamespace
+
+import anthropic
+import pytest
+
+from app import ai_reply, models
+from app.tenant_cache import get_tenant_config
+
+
+class FakeAnthropic:
+    """Stands in for the shared Anthropic client; fails the first `failures` calls."""
+
+    def __init__(self, failures=0):
+        self.calls    = 0
+        self.failures = failures
+        self.messages = self
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise anthropic.APIConnectionError(request=None)
+        return SimpleNamespace(content=[SimpleNamespace(text="Hello!")], usage=None)
+
+
+@pytest.fixture
+def claude(monkeypatch):
+    fake = FakeAnthropic()
+    monkeypatch.setenv("CLAUDE_API_KEY", "test")
+    monkeypatch.setattr(ai_reply, "get_anthropic_client", lambda api_key: fake)
+    return fake
+
+
+def used_today(db, client_id):
+    row = db.query(models.AIUsageDaily).filter_by(client_id=client_id, day=date.today()).first()
+    db.expire_all()
+    return row.replies if row else 0
+
+
+def test_growth_limit_is_enforced(db, tenant, monkeypatch):
+    monkeypatch.setitem(ai_reply.AI_LIMITS, "growth", 2)
+
+    results = [ai_reply.check_and_increment_ai_usage(tenant)[0] for _ in range(3)]
+
+    assert results == [True, True, False]
+    assert used_today(db, tenant.id) == 2
+
+
+def test_starter_has_no_ai(db, tenant):
+    tenant.plan = "starter"
+    assert ai_reply.check_and_increment_ai_usage(tenant)[0] is False
+    assert used_today(db, tenant.id) == 0
+
+
+def test_retried_reply_is_counted_once(db, tenant, claude):
+    claude.failures = 1
+    config = get_tenant_config(db, "PN1")
+
+    with pytest.raises(ai_reply.AITransientError):
+        ai_reply.get_ai_reply(config, "do you open on sundays")
+    assert ai_reply.get_ai_reply(config, "do you open on sundays", counted=True) == "Hello!"
+
+    assert claude.calls == 2
+    assert used_today(db, tenant.id) == 1
+
+
+def test_reply_past_its_deadline_is_not_counted(db, tenant, claude):
+    config = get_tenant_config(db, "PN1")
+
+    assert ai_reply.get_ai_reply(config, "do you open on sundays", deadline=time.monotonic() - 1) is None
+
+    assert claude.calls == 0
+    assert used_today(db, tenant.id) == 0
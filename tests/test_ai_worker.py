@@ -0,0 +1,109 @@
+"""AI stage — queue priority, eviction, submitting only committed messages, stale replies."""
+from types import SimpleNamespace
+
+import pytest
+
+from app import ai_worker, models
+from app.ai_worker import AIJob, AIQueue
+from app.contact_cache import invalidate_contact
+from app.routers import webhook
+from conftest import inbound
+
+
+def job(plan, seq):
+    config = SimpleNamespace(client=SimpleNamespace(id=seq, plan=plan))
+    return AIJob(config, f"sender-{seq}", "question", deliver=None, seq=seq)
+
+
+def test_pro_is_served_before_growth_then_oldest_first():
+    queue = AIQueue(max_waiting=10)
+    for index, plan in enumerate(["growth", "pro", "growth", "pro"]):
+        assert queue.put(job(plan, index)) is None
+
+    served = [queue.get().seq for _ in range(4)]
+
+    assert served == [1, 3, 0, 2]
+
+
+def test_full_queue_evicts_the_newest_lower_plan_job():
+    queue = AIQueue(max_waiting=2)
+    queue.put(job("growth", 0))
+    queue.put(job("growth", 1))
+
+    evicted = queue.put(job("pro", 2))
+
+    assert evicted.seq == 1
+    assert queue.depths() == {"growth": 1, "pro": 1}
+
+
+def test_full_queue_turns_away_a_job_that_ranks_last():
+    queue = AIQueue(max_waiting=2)
+    queue.put(job("pro", 0))
+    queue.put(job("growth", 1))
+
+    newcomer = job("growth", 2)
+    assert queue.put(newcomer) is newcomer
+    assert queue.depths() == {"pro": 1, "growth": 1}
+
+
+def test_ai_job_is_submitted_only_after_the_commit(db, tenant, sent, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(ai_worker, "accepts", lambda config: True)
+    monkeypatch.setattr(ai_worker, "submit", lambda config, sender, text, deliver: submitted.append(text) or True)
+    webhook.handle_payload(inbound("wamid.1", "2348000000001", "hi"))
+
+    # The message fails after choosing the AI path but before its commit
+    handle_message = webhook.handle_message
+
+    def fail_before_commit(*args):
+        handle_message(*args)
+        raise RuntimeError("commit failed")
+
+    monkeypatch.setattr(webhook, "handle_message", fail_before_commit)
+    with pytest.raises(RuntimeError):
+        webhook.handle_payload(inbound("wamid.2", "2348000000001", "do you open on sundays"))
+    assert submitted == []
+
+    # Redelivered and committed — now the question goes to the AI stage
+    monkeypatch.setattr(webhook, "handle_message", handle_message)
+    webhook.handle_payload(inbound("wamid.2", "2348000000001", "do you open on sundays"))
+    assert submitted == ["do you open on sundays"]
+
+
+@pytest.fixture
+def held_ai_jobs(monkeypatch):
+    """AI jobs submitted by the webhook, held until the test delivers them."""
+    jobs = []
+    monkeypatch.setattr(ai_worker, "accepts", lambda config: True)
+    monkeypatch.setattr(ai_worker, "submit", lambda config, sender, text, deliver: jobs.append((config, sender, deliver)) or True)
+    return jobs
+
+
+def test_ai_reply_is_dropped_after_an_opt_out(db, tenant, sent, held_ai_jobs):
+    webhook.handle_payload(inbound("wamid.1", "2348000000001", "hi"))
+    webhook.handle_payload(inbound("wamid.2", "2348000000001", "do you open on sundays"))
+    # Opted out while the reply was generated — by a STOP handled elsewhere, or the dashboard
+    db.query(models.Contact).update({models.Contact.opted_out: True})
+    db.commit()
+    invalidate_contact(tenant.id, "2348000000001")
+    del sent[:]
+
+    config, sender, deliver = held_ai_jobs[0]
+    deliver(config, sender, "Yes, 10am to 4pm")
+
+    assert sent == []
+
+
+def test_ai_reply_is_dropped_once_a_newer_message_is_answered(db, tenant, sent, held_ai_jobs):
+    webhook.handle_payload(inbound("wamid.1", "2348000000001", "hi"))
+    webhook.handle_payload(inbound("wamid.2", "2348000000001", "do you open on sundays"))
+    webhook.handle_payload(inbound("wamid.3", "2348000000001", "do you deliver"))
+    webhook.handle_payload(inbound("wamid.4", "2348000000002", "hi"))
+    webhook.handle_payload(inbound("wamid.5", "2348000000002", "do you open on sundays"))
+    del sent[:]
+
+    for config, sender, deliver in held_ai_jobs:
+        deliver(config, sender, "Yes, 10am to 4pm")
+
+    # The first sender's question was overtaken by "We deliver"; the second's wasn't
+    assert sent == [("2348000000002", "Yes, 10am to 4pm")]
@@ -0,0 +1,60 @@
+"""AI answer cache — question keys and prompt-version invalidation."""
+import pytest
+
+from app import answer_cache
+from app.answer_cache import lookup, normalize_question, store
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    answer_cache.forget_answers()
+    yield
+    answer_cache.forget_answers()
+
+
+@pytest.mark.parametrize("text, key", [
+    ("How much is delivery?", "how much is delivery"),
+    ("  Delivery   PRICES!! ", "delivery price"),
+    ("delivering shoes", "deliver shoe"),
+    ("boxes and watches", "box and watch"),
+    ("ordered categories", "order category"),
+    ("is this bus yours", "is this bus your"),
+])
+def test_normalize_question(text, key):
+    assert normalize_question(text) == key
+
+
+def test_normalize_question_skips_what_should_not_be_cached():
+    assert normalize_question("") is None
+    assert normalize_question("?!") is None
+    assert normalize_question("x" * (answer_cache.AI_ANSWER_CACHE_MAX_CHARS + 1)) is None
+
+
+def test_similar_questions_share_an_answer():
+    store(1, 1, "prompt-a", "Delivery prices?", "N1500 in Lagos")
+
+    assert lookup(1, 1, "prompt-a", "delivery price") == "N1500 in Lagos"
+    assert lookup(2, 1, "prompt-a", "delivery price") is None
+
+
+def test_new_prompt_drops_the_old_answers():
+    store(1, 1, "prompt-a", "delivery price", "N1500")
+
+    assert lookup(1, 2, "prompt-b", "delivery price") is None
+    assert lookup(1, 1, "prompt-a", "delivery price") is None
+
+
+def test_reloaded_snapshot_with_the_same_prompt_keeps_the_answers():
+    store(1, 1, "prompt-a", "delivery price", "N1500")
+
+    assert lookup(1, 2, "prompt-a", "delivery price") == "N1500"
+
+
+def test_older_prompt_does_not_wipe_the_new_answers():
+    store(1, 2, "prompt-b", "delivery price", "N2000")
+
+    # A reply that was generated on the snapshot before the dashboard change
+    store(1, 1, "prompt-a", "delivery price", "N1500")
+    assert lookup(1, 1, "prompt-a", "delivery price") is None
+
+    assert lookup(1, 2, "prompt-b", "delivery price") == "N2000"
@@ -0,0 +1,33 @@
+"""Broadcast runs — sent, failed and deferred sends are counted apart."""
+from types import SimpleNamespace
+
+from app import models
+from app.circuit_breaker import CircuitOpenError
+from app.routers import broadcast
+
+
+def test_deferred_sends_are_neither_sent_nor_failed(db, tenant, monkeypatch):
+    db.add_all([
+        models.Contact(client_id=tenant.id, name=name, phone_number=number)
+        for name, number in (("Ada", "100"), ("Ben", "200"), ("Cy", "300"))
+    ])
+    job = models.Broadcast(client_id=tenant.id, title="Sale", message="Sale!", template_name="sale")
+    db.add(job)
+    db.commit()
+
+    def post_message(phone_number_id, access_token, payload):
+        if payload["to"] == "200":
+            raise CircuitOpenError("graph")
+        return SimpleNamespace(status_code=400 if payload["to"] == "300" else 200)
+
+    deferred = []
+    monkeypatch.setattr(broadcast.graph_client, "post_message", post_message)
+    monkeypatch.setattr(broadcast, "defer_send", lambda phone_number_id, payload: deferred.append(payload["to"]))
+
+    broadcast.run_broadcast(job.id)
+
+    db.refresh(job)
+    assert (job.status, job.total, job.sent, job.failed) == ("completed", 3, 1, 1)
+    assert deferred == ["200"]
+    logged = db.query(models.MessageLog).filter_by(client_id=tenant.id).all()
+    assert [log.sender_number for log in logged] == ["100"]
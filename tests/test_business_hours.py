@@ -0,0 +1,54 @@
+"""Compiled business hours — the same answers the per-message query used to give."""
+from datetime import datetime
+
+from app import models
+from app.tenant_cache import get_tenant_config
+
+# 2026-10-19 is a Monday
+MONDAY, TUESDAY, WEDNESDAY = 19, 20, 21
+
+
+def schedule(db, tenant, *rows):
+    db.add_all([
+        models.BusinessHours(client_id=tenant.id, day_of_week=day, open_time=opens, close_time=closes, is_open=is_open)
+        for day, opens, closes, is_open in rows
+    ])
+    db.commit()
+    return get_tenant_config(db, "PN1").schedule
+
+
+def is_open(schedule, day, hour, minute=0):
+    return schedule.is_open_at(datetime(2026, 10, day, hour, minute))
+
+
+def test_daytime_hours_are_inclusive(db, tenant):
+    week = schedule(db, tenant, (0, "09:00", "17:30", True))
+
+    assert not is_open(week, MONDAY, 8, 59)
+    assert is_open(week, MONDAY, 9, 0)
+    assert is_open(week, MONDAY, 17, 30)
+    assert not is_open(week, MONDAY, 17, 31)
+
+
+def test_overnight_span_covers_the_same_days_early_hours(db, tenant):
+    week = schedule(db, tenant, (0, "22:00", "02:00", True), (1, "09:00", "17:00", True))
+
+    assert is_open(week, MONDAY, 23, 0)
+    assert is_open(week, MONDAY, 1, 0)
+    assert not is_open(week, MONDAY, 3, 0)
+    # Tuesday keeps its own hours — Monday's span doesn't spill into it
+    assert not is_open(week, TUESDAY, 1, 0)
+
+
+def test_closed_day_never_sends_the_closed_reply(db, tenant):
+    week = schedule(db, tenant, (0, "09:00", "17:00", False))
+
+    assert is_open(week, MONDAY, 3, 0)
+    assert is_open(week, MONDAY, 23, 0)
+
+
+def test_day_without_rows_is_open_all_day(db, tenant):
+    week = schedule(db, tenant, (0, "09:00", "17:00", True))
+
+    assert is_open(week, WEDNESDAY, 0, 0)
+    assert is_open(week, WEDNESDAY, 23, 59)
@@ -0,0 +1,102 @@
+"""Circuit breakers — closed, open, half-open and back."""
+from types import SimpleNamespace
+
+import pytest
+
+from app import ai_reply, circuit_breaker
+from app.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from app.tenant_cache import get_tenant_config
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A monotonic clock the test moves by hand."""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(circuit_breaker, "time", SimpleNamespace(monotonic=lambda: now.value))
+    monkeypatch.setattr(circuit_breaker, "_breakers", {})
+    return now
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test", failure_rate=0.5, window=4, min_calls=4, open_seconds=30)
+
+
+def trip(breaker):
+    for _ in range(4):
+        assert breaker.allow()
+        breaker.record_failure()
+
+
+def test_opens_once_the_failure_rate_is_reached(breaker):
+    for record in (breaker.record_success, breaker.record_failure, breaker.record_success):
+        breaker.allow()
+        record()
+    assert breaker.state == CLOSED
+
+    breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    assert breaker.allow() is False
+
+
+def test_reads_half_open_when_the_open_period_ends(breaker, clock):
+    trip(breaker)
+    clock.value += 29
+    assert breaker.state == OPEN
+
+    clock.value += 1
+
+    # Before any call has asked — the state gauge must not keep saying open
+    assert breaker.state == HALF_OPEN
+    assert breaker.stats()["state"] == HALF_OPEN
+
+
+def test_half_open_lets_one_probe_through(breaker, clock):
+    trip(breaker)
+    clock.value += 30
+
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+
+
+def test_successful_probe_closes(breaker, clock):
+    trip(breaker)
+    clock.value += 30
+    breaker.allow()
+
+    breaker.record_success()
+
+    assert breaker.state == CLOSED
+    assert breaker.allow() is True
+
+
+def test_failed_probe_opens_again(breaker, clock):
+    trip(breaker)
+    clock.value += 30
+    breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    assert breaker.allow() is False
+
+
+def test_unexpected_ai_error_settles_the_probe(db, tenant, breaker, clock, monkeypatch):
+    class BrokenAnthropic:
+        def __init__(self):
+            self.messages = self
+
+        def create(self, **kwargs):
+            raise ValueError("bad response")
+
+    monkeypatch.setenv("CLAUDE_API_KEY", "test")
+    monkeypatch.setattr(ai_reply, "get_anthropic_client", lambda api_key: BrokenAnthropic())
+    monkeypatch.setattr(ai_reply, "ANTHROPIC_BREAKER", breaker)
+    trip(breaker)
+    clock.value += 30
+
+    assert ai_reply.get_ai_reply(get_tenant_config(db, "PN1"), "do you open on sundays") is None
+
+    assert breaker.state == OPEN
@@ -0,0 +1,62 @@
+"""Webhook deduplication — claim, release and the processing TTL."""
+import fakeredis
+import pytest
+
+from app import dedup
+from app.dedup import claim_message, complete_message, release_message
+from app.routers import webhook
+from conftest import inbound
+
+
+@pytest.fixture(autouse=True)
+def empty_store():
+    dedup.clear_dedup_store()
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(dedup, "get_redis", lambda: r)
+    return r
+
+
+def test_second_claim_is_a_duplicate():
+    assert claim_message("wamid.1") is True
+    assert claim_message("wamid.1") is False
+    assert claim_message("wamid.2") is True
+
+
+def test_released_claim_can_be_claimed_again():
+    assert claim_message("wamid.1") is True
+    release_message("wamid.1")
+    assert claim_message("wamid.1") is True
+
+
+def test_messages_without_an_id_are_always_processed():
+    assert claim_message(None) is True
+    assert claim_message(None) is True
+
+
+def test_claim_is_shared_through_redis(redis):
+    assert claim_message("wamid.1") is True
+    dedup.clear_dedup_store()            # another process: nothing local
+    assert claim_message("wamid.1") is False
+
+    release_message("wamid.1")
+    dedup.clear_dedup_store()
+    assert claim_message("wamid.1") is True
+
+
+def test_claim_is_short_until_the_message_commits(redis):
+    claim_message("wamid.1")
+    assert 0 < redis.ttl(dedup._redis_key("wamid.1")) <= dedup.DEDUP_PROCESSING_TTL
+
+    complete_message("wamid.1")
+    assert redis.ttl(dedup._redis_key("wamid.1")) > dedup.DEDUP_PROCESSING_TTL
+
+
+def test_redelivered_webhook_is_handled_once(db, tenant, sent):
+    webhook.handle_payload(inbound("wamid.1", "2348000000001", "hi"))
+    webhook.handle_payload(inbound("wamid.1", "2348000000001", "hi"))
+
+    assert len(sent) == 1
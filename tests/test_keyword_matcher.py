@@ -0,0 +1,62 @@
+"""KeywordMatcher must agree with the linear `keyword in text` scan it replaced."""
+import random
+
+import pytest
+
+from app import keyword_matcher
+from app.keyword_matcher import KeywordMatcher
+
+
+def linear_scan(pairs, text):
+    for keyword, value in pairs:
+        if keyword in text:
+            return value
+    return None
+
+
+@pytest.fixture
+def automaton(monkeypatch):
+    """Force the Aho-Corasick path even for small keyword sets."""
+    monkeypatch.setattr(keyword_matcher, "LINEAR_SCAN_MAX", 0)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("how much is delivery", "deliver"),
+    ("price of the red shoe", "price"),
+    ("shoe prices please", "price"),      # both occur — the earlier pair wins
+    ("hello there", None),
+    ("", None),
+])
+def test_first_pair_wins(automaton, text, expected):
+    pairs   = [("price", "price"), ("deliver", "deliver"), ("shoe", "shoe")]
+    matcher = KeywordMatcher(pairs)
+    assert matcher.search(text) == expected == linear_scan(pairs, text)
+
+
+def test_overlapping_keywords(automaton):
+    # "she" ends inside "ushers" via a fail link; "hers" comes later in the list
+    pairs   = [("he", 0), ("she", 1), ("his", 2), ("hers", 3)]
+    matcher = KeywordMatcher(pairs)
+    for text in ("ushers", "ahishers", "hers", "sh", "hhis"):
+        assert matcher.search(text) == linear_scan(pairs, text), text
+
+
+def test_empty_keyword_matches_everything(automaton):
+    matcher = KeywordMatcher([("", "any"), ("price", "price")])
+    assert matcher.search("no keywords here") == "any"
+
+
+def test_duplicate_keywords_keep_the_first(automaton):
+    matcher = KeywordMatcher([("cap", "first"), ("cap", "second")])
+    assert matcher.search("a blue cap") == "first"
+
+
+@pytest.mark.parametrize("count", [5, 40, 200])
+def test_random_rule_sets_agree_with_linear_scan(count):
+    rng      = random.Random(count)
+    alphabet = "abcde "
+    pairs    = [("".join(rng.choices(alphabet, k=rng.randint(1, 5))), index) for index in range(count)]
+    matcher  = KeywordMatcher(pairs)
+    for _ in range(500):
+        text = "".join(rng.choices(alphabet, k=rng.randint(0, 40)))
+        assert matcher.search(text) == linear_scan(pairs, text), text
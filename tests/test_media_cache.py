@@ -0,0 +1,22 @@
+"""Product image media ids — a refused id is forgotten off the send path."""
+import time
+from datetime import datetime, timedelta
+
+from app import media_cache, models
+
+
+def test_forget_media_drops_the_id_now_and_the_row_in_the_background(db, monkeypatch):
+    key     = ("PN1", "https://example.com/shoe.jpg")
+    expires = datetime.utcnow() + timedelta(days=1)
+    db.add(models.WhatsAppMedia(phone_number_id=key[0], image_url=key[1], media_id="m1", expires_at=expires))
+    db.commit()
+    monkeypatch.setitem(media_cache._cache, key, ("m1", expires))
+
+    media_cache.forget_media(*key)
+
+    assert key not in media_cache._cache
+    for _ in range(50):
+        if db.query(models.WhatsAppMedia).count() == 0:
+            break
+        time.sleep(0.02)
+    assert db.query(models.WhatsAppMedia).count() == 0
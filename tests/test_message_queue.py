@@ -0,0 +1,37 @@
+"""Durable lane queues — a head that keeps killing its worker is dead-lettered."""
+import fakeredis
+import pytest
+
+from app import models
+from app.message_queue import MESSAGE_QUEUE_MAX_ATTEMPTS, PostgresQueue, RedisStreamQueue
+
+
+@pytest.fixture(params=["postgres", "redis"])
+def queue(request, db):
+    if request.param == "postgres":
+        return PostgresQueue("lane:0")
+    return RedisStreamQueue("lane:0", fakeredis.FakeRedis(decode_responses=True))
+
+
+def test_head_redelivery_counts_attempts(queue):
+    queue.enqueue({"n": 1})
+
+    # Each claim without an ack is a worker that died holding the job
+    attempts = [queue.claim_head(block_ms=None).attempts for _ in range(3)]
+
+    assert attempts == [1, 2, 3]
+
+
+def test_crashing_head_is_dead_lettered_and_the_lane_moves_on(queue, db):
+    queue.enqueue({"n": 1})
+    queue.enqueue({"n": 2})
+    for _ in range(MESSAGE_QUEUE_MAX_ATTEMPTS):
+        assert queue.claim_head(block_ms=None).payload == {"n": 1}
+
+    job = queue.claim_head(block_ms=None)
+
+    assert (job.payload, job.attempts) == ({"n": 2}, 1)
+    if isinstance(queue, PostgresQueue):
+        assert db.query(models.QueuedWebhook).filter(models.QueuedWebhook.dead_at != None).count() == 1
+    else:
+        assert queue.redis.xlen(queue.dead) == 1
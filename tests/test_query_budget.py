@@ -0,0 +1,32 @@
+import pytest
+
+from app import models
+from app.query_budget import QueryBudgetExceeded
+from app.routers import webhook
+
+from conftest import inbound
+
+
+def test_conversation_stays_within_budget(db, tenant, sent):
+    # Strict mode (conftest) raises if any of these goes over MESSAGE_QUERY_BUDGET
+    for i, text in enumerate(["hi", "menu", "what is the price", "shoes", "redshoe", "blah", "stop", "start"]):
+        webhook.handle_payload(inbound(f"m{i}", "234800", text))
+
+    assert len(sent) == 8
+    assert db.query(models.MessageLog).filter_by(direction="outbound").count() == 8
+
+
+def test_over_budget_message_is_rolled_back(db, tenant, sent, monkeypatch):
+    monkeypatch.setattr(webhook, "MESSAGE_QUERY_BUDGET", 1)
+
+    with pytest.raises(QueryBudgetExceeded):
+        webhook.handle_payload(inbound("m1", "234800", "hi"))
+
+    # Nothing committed — no contact, no logs, and the claim is released for the retry
+    assert db.query(models.Contact).count() == 0
+    assert db.query(models.MessageLog).count() == 0
+
+    monkeypatch.setattr(webhook, "MESSAGE_QUERY_BUDGET", 12)
+    webhook.handle_payload(inbound("m1", "234800", "hi"))
+    assert db.query(models.Contact).count() == 1
+    assert db.query(models.MessageLog).count() == 2
@@ -0,0 +1,45 @@
+"""Outbound rate limiting — local buckets (no Redis in the test setup)."""
+import pytest
+
+from app import rate_limiter
+
+
+@pytest.fixture(autouse=True)
+def fresh_buckets(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_local", {})
+    monkeypatch.setattr(rate_limiter, "_local_paused", {})
+    monkeypatch.setattr(rate_limiter, "_local_strikes", {})
+    monkeypatch.setattr(rate_limiter, "_tier_rates", {"PN1": 2})
+
+
+def test_empty_bucket_defers_instead_of_sleeping():
+    rate_limiter.acquire("PN1", "a", max_wait=0)
+    rate_limiter.acquire("PN1", "b", max_wait=0)
+
+    with pytest.raises(rate_limiter.SendThrottled) as throttled:
+        rate_limiter.acquire("PN1", "c", max_wait=0.1)
+    assert 0 < throttled.value.wait <= 0.5
+
+
+def test_pair_limit_pauses_only_that_recipient():
+    rate_limiter.pause("PN1", "a")
+
+    with pytest.raises(rate_limiter.SendThrottled):
+        rate_limiter.acquire("PN1", "a", max_wait=0)
+    rate_limiter.acquire("PN1", "b", max_wait=0)
+
+
+def test_number_limit_pauses_every_recipient():
+    rate_limiter.pause("PN1")
+
+    for recipient in ("a", "b"):
+        with pytest.raises(rate_limiter.SendThrottled):
+            rate_limiter.acquire("PN1", recipient, max_wait=0)
+
+
+def test_pause_doubles_with_each_throttle_in_a_row(monkeypatch):
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda low, high: 1.0)
+
+    delays = [rate_limiter.pause("PN1", "a") for _ in range(3)]
+
+    assert delays == [rate_limiter.GRAPH_THROTTLE_BACKOFF * 2 ** n for n in range(3)]
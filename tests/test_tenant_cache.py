@@ -0,0 +1,107 @@
+"""Tenant config cache — single-flight loads and invalidation."""
+import threading
+import time
+
+import pytest
+
+from app import models, tenant_cache
+from app.database import SessionLocal
+
+
+@pytest.fixture
+def gated_load(monkeypatch):
+    """Loads that wait for `release` before going to the DB. Returns (release, calls)."""
+    release = threading.Event()
+    calls   = []
+    real    = tenant_cache.load_tenant_config
+
+    def load(db, phone_number_id):
+        calls.append(phone_number_id)
+        release.wait(5)
+        return real(db, phone_number_id)
+
+    monkeypatch.setattr(tenant_cache, "load_tenant_config", load)
+    return release, calls
+
+
+def get_in_thread(results):
+    def run():
+        db = SessionLocal()
+        try:
+            results.append(tenant_cache.get_tenant_config(db, "PN1"))
+        finally:
+            db.close()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_until(condition):
+    for _ in range(250):
+        if condition():
+            return
+        time.sleep(0.02)
+    raise AssertionError("condition never became true")
+
+
+def test_concurrent_misses_share_one_load(db, tenant, gated_load):
+    release, calls = gated_load
+    before  = tenant_cache.get_cache_stats()
+    results = []
+    threads = [get_in_thread(results) for _ in range(5)]
+
+    # One leader loading, four followers waiting on it
+    wait_until(lambda: tenant_cache.get_cache_stats()["coalesced"] - before["coalesced"] == 4)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == ["PN1"]
+    assert len(results) == 5
+    assert all(config is results[0] for config in results)
+    assert results[0].client.business_name == "Test Shop"
+    # ...and the result is cached for the next message
+    assert tenant_cache.get_tenant_config(db, "PN1") is results[0]
+    assert calls == ["PN1"]
+
+
+def test_invalidation_during_a_load_does_not_cache_the_stale_snapshot(db, tenant, gated_load):
+    release, calls = gated_load
+    results = []
+    thread  = get_in_thread(results)
+    wait_until(lambda: calls)
+
+    # The load has started; the dashboard saves a change and invalidates
+    tenant.business_name = "Renamed Shop"
+    db.commit()
+    tenant_cache.invalidate_tenant(phone_number_id="PN1")
+
+    release.set()
+    thread.join(5)
+    assert len(results) == 1
+
+    config = tenant_cache.get_tenant_config(db, "PN1")
+    assert len(calls) == 2
+    assert config.client.business_name == "Renamed Shop"
+
+
+def test_published_invalidation_drops_the_tenant_by_client_id(db, tenant):
+    first = tenant_cache.get_tenant_config(db, "PN1")
+    db.query(models.Client).filter_by(id=tenant.id).update({"business_name": "Renamed Shop"})
+    db.commit()
+    assert tenant_cache.get_tenant_config(db, "PN1") is first
+
+    handler, _ = tenant_cache._channel_handlers[tenant_cache.INVALIDATION_CHANNEL]
+    handler({"phone_number_id": None, "client_id": tenant.id})
+
+    assert tenant_cache.get_tenant_config(db, "PN1").client.business_name == "Renamed Shop"
+
+
+def test_listener_reconnect_clears_the_cache(db, tenant):
+    first = tenant_cache.get_tenant_config(db, "PN1")
+
+    _, on_reconnect = tenant_cache._channel_handlers[tenant_cache.INVALIDATION_CHANNEL]
+    on_reconnect()
+
+    assert tenant_cache.get_tenant_config(db, "PN1") is not first
@@ -0,0 +1,57 @@
+"""Token flags — written once, announced after the commit, cleared by revalidation for expired tokens."""
+from types import SimpleNamespace
+
+from app import models, token_health
+from app.database import SessionLocal
+
+
+def test_revalidation_clears_only_expired_token_flags(db, tenant, monkeypatch):
+    no_permission = models.Client(
+        business_name="Other Shop", email="other@example.com", hashed_password="x",
+        phone_number_id="PN2", whatsapp_number="2", access_token="tok2", plan="growth",
+    )
+    db.add(no_permission)
+    tenant.token_valid,        tenant.token_error_code        = False, 190
+    no_permission.token_valid, no_permission.token_error_code = False, 10
+    db.commit()
+
+    # GET /{phone_number_id} works for both — the token itself is fine
+    monkeypatch.setattr(token_health.graph_client, "get",
+                        lambda path, token: SimpleNamespace(status_code=200, json=lambda: {"id": path}))
+
+    token_health.revalidate_tokens()
+
+    db.expire_all()
+    assert (tenant.token_valid, tenant.token_error_code) == (True, None)
+    assert (no_permission.token_valid, no_permission.token_error_code) == (False, 10)
+
+
+def test_flag_winner_invalidates_after_the_commit(db, tenant, monkeypatch):
+    seen_at_invalidation = []
+
+    def invalidate(phone_number_id, client_id=None):
+        # A worker reloading now must already read the flag
+        other = SessionLocal()
+        try:
+            seen_at_invalidation.append(other.query(models.Client).filter_by(id=client_id).one().token_valid)
+        finally:
+            other.close()
+
+    monkeypatch.setattr(token_health, "invalidate_tenant", invalidate)
+    monkeypatch.setattr(token_health, "_claim_flag", lambda phone_number_id: True)
+
+    token_health._handle_flag("PN1", "tok", 190)
+
+    assert seen_at_invalidation == [False]
+
+
+def test_flag_loser_leaves_the_write_and_invalidation_to_the_winner(db, tenant, monkeypatch):
+    invalidated = []
+    monkeypatch.setattr(token_health, "invalidate_tenant", lambda *args: invalidated.append(args))
+    monkeypatch.setattr(token_health, "_claim_flag", lambda phone_number_id: False)
+
+    token_health._handle_flag("PN1", "tok", 190)
+
+    db.expire_all()
+    assert tenant.token_valid
+    assert invalidated == []
@@ -0,0 +1,44 @@
+"""Inbound message handling — replies go out only after the message commits."""
+import pytest
+
+from app import models
+from app.database import SessionLocal
+from app.routers import webhook
+from conftest import inbound
+
+
+def test_welcome_is_sent_after_the_contact_commits(db, tenant, monkeypatch):
+    saved_at_send = []
+
+    def send(phone_number_id, access_token, recipient, message):
+        # Another connection sees the contact only once the message has committed
+        other = SessionLocal()
+        try:
+            saved_at_send.append(other.query(models.Contact).filter_by(phone_number=recipient).count())
+        finally:
+            other.close()
+
+    monkeypatch.setattr(webhook, "send_whatsapp_message", send)
+    webhook.handle_payload(inbound("wamid.1", "2348000000001", "hi"))
+
+    assert saved_at_send == [1]
+
+
+def test_new_senders_are_auto_named(db, tenant, sent):
+    webhook.handle_payload(inbound("wamid.1", "2348000000001", "hi"))
+    webhook.handle_payload(inbound("wamid.2", "2348000000002", "hi"))
+
+    names = [c.name for c in db.query(models.Contact).order_by(models.Contact.id)]
+    assert names == ["test_shop_client_1", "test_shop_client_2"]
+
+
+def test_rolled_back_message_sends_nothing(db, tenant, sent, monkeypatch):
+    def fail_before_commit(db, config, contacts, message, outbox):
+        outbox.append((webhook.send_whatsapp_message, ("PN1", "tok", message["from"], "hello")))
+        raise RuntimeError("commit failed")
+
+    monkeypatch.setattr(webhook, "handle_message", fail_before_commit)
+    with pytest.raises(RuntimeError):
+        webhook.handle_payload(inbound("wamid.1", "2348000000001", "hi"))
+
+    assert sent == []